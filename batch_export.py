@@ -0,0 +1,103 @@
+"""
+批量统计导出 - CSV和Excel直接流式写入响应，不在static目录中保存文件
+
+结果按排名逐页计算后写出，内存占用与导出的行数无关：
+- CSV：带UTF-8 BOM（Excel能正确识别中文），逐页生成文本
+- Excel：openpyxl只写模式的工作簿，保存到自动删除的临时文件后分块读出
+"""
+from statistics import BatchRanking
+from job_manager import iterate_blocking
+from config import STATISTICS_CONFIG
+from openpyxl import Workbook
+from datetime import datetime
+from typing import BinaryIO, Iterator
+from urllib.parse import quote
+import tempfile
+import csv
+import io
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 导出的列：(结果字段, 中文列名)
+EXPORT_COLUMNS = [
+    ('rank', '排名'),
+    ('stock_code', '股票代码'),
+    ('stock_name', '股票名称'),
+    ('market', '市场'),
+    ('listing_date', '上市日期'),
+    ('up_count', '上涨次数'),
+    ('down_count', '下跌次数'),
+    ('total_count', '总涨跌次数'),
+    ('up_probability', '上涨概率(%)'),
+    ('down_probability', '下跌概率(%)'),
+    ('avg_up_pct', '平均涨幅(%)'),
+    ('avg_down_pct', '平均跌幅(%)'),
+    ('year_range', '统计年份范围'),
+    ('years_count', '统计年数'),
+]
+
+# 读取临时文件的块大小
+CHUNK_SIZE = 64 * 1024
+
+
+def export_filename(extension: str) -> str:
+    """生成导出文件名（使用连字符而不是下划线，避免格式问题）"""
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    return f"股票统计_{timestamp}.{extension}"
+
+
+def content_disposition(filename: str) -> str:
+    """附件响应头：中文文件名按RFC 5987编码，同时提供ASCII文件名供旧客户端使用"""
+    fallback = filename.replace("股票统计", "stock_statistics")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def _export_pages(ranking: BatchRanking, total: int) -> Iterator:
+    return ranking.iter_pages(total, STATISTICS_CONFIG["batch_page_size"], STATISTICS_CONFIG["batch_stream_page_size"])
+
+
+async def stream_csv(ranking: BatchRanking, total: int):
+    """逐页生成CSV内容（第一块以UTF-8 BOM开头）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header in EXPORT_COLUMNS])
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    
+    async for rows in iterate_blocking("export", _export_pages(ranking, total)):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([row.get(field) for field, _ in EXPORT_COLUMNS] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_xlsx(ranking: BatchRanking, total: int) -> BinaryIO:
+    """用只写模式的工作簿写出Excel，返回已定位到开头的临时文件（关闭后自动删除）"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('股票统计')
+    sheet.append([header for _, header in EXPORT_COLUMNS])
+    for rows in _export_pages(ranking, total):
+        for row in rows:
+            sheet.append([row.get(field) for field, _ in EXPORT_COLUMNS])
+    
+    fileobj = tempfile.TemporaryFile()
+    try:
+        workbook.save(fileobj)
+        fileobj.seek(0)
+    except Exception:
+        fileobj.close()
+        raise
+    return fileobj
+
+
+def iter_file(fileobj: BinaryIO) -> Iterator[bytes]:
+    """分块读出文件内容，读完后关闭（临时文件随之删除）"""
+    try:
+        while True:
+            chunk = fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
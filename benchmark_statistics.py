@@ -0,0 +1,88 @@
+"""
+批量统计性能测试：比较单进程与多进程（共享内存面板）计算前N名的耗时
+
+用法：
+    python benchmark_statistics.py                          使用数据库中的月K数据
+    python benchmark_statistics.py --synthetic 5000         使用随机生成的5000只股票面板
+    python benchmark_statistics.py --workers 2 4 8 --repeat 5 --months 1 2 3
+"""
+import argparse
+import os
+import time
+import numpy as np
+from monthly_panel import MonthlyPanel
+from panel_executor import SharedPanelExecutor, compute_top_statistics
+
+def load_database_panel():
+    """从数据库加载面板，股票按ID排序（与批量统计一致）"""
+    from database import SessionLocal
+    from models import Stock
+    
+    db = SessionLocal()
+    try:
+        panel = MonthlyPanel.load(db)
+        codes = [code for (code,) in db.query(Stock.code).filter(Stock.is_delisted == 0).order_by(Stock.id).all()]
+        return panel, codes
+    finally:
+        db.close()
+
+def build_synthetic_panel(stock_count, years):
+    """随机生成涨跌幅面板（约5%的月份无数据）"""
+    rng = np.random.default_rng(0)
+    shape = (stock_count, years, 12)
+    pct_change = np.round(rng.normal(0.5, 9.0, shape), 2)
+    present = rng.random(shape) > 0.05
+    pct_change[~present] = np.nan
+    codes = [f"{i:06d}" for i in range(stock_count)]
+    return MonthlyPanel(codes, 2024 - years + 1, pct_change, present), codes
+
+def measure(func, repeat):
+    """返回 (最短耗时, 结果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量统计性能测试")
+    parser.add_argument("--synthetic", type=int, default=0, help="随机生成指定数量股票的面板（默认使用数据库）")
+    parser.add_argument("--years", type=int, default=30, help="随机面板的年数")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="工作进程数列表，默认 2 4 ... CPU核数")
+    parser.add_argument("--months", type=int, nargs="*", default=None, help="统计的月份，默认所有月份")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--min-total-count", type=int, default=0)
+    parser.add_argument("--order-by", default="up_probability")
+    parser.add_argument("--repeat", type=int, default=3, help="每种配置运行次数，取最短耗时")
+    args = parser.parse_args()
+    
+    if args.synthetic:
+        panel, codes = build_synthetic_panel(args.synthetic, args.years)
+    else:
+        panel, codes = load_database_panel()
+    reverse = args.order_by in ["up_probability", "avg_up_pct"]
+    query = (args.months, args.min_total_count, args.order_by, reverse, args.limit)
+    
+    worker_counts = args.workers or [n for n in (2, 4, 8, 16, 32) if n <= (os.cpu_count() or 1)]
+    print(f"面板：{len(panel.codes)} 只股票 × {panel.pct_change.shape[1]} 年，统计 {len(codes)} 只，CPU核数 {os.cpu_count()}")
+    
+    serial_time, expected = measure(
+        lambda: compute_top_statistics(panel, list(range(len(codes))), codes, *query), args.repeat
+    )
+    print(f"{'进程数':>6} {'耗时(秒)':>10} {'加速比':>8}  结果一致")
+    print(f"{1:>6} {serial_time:>10.3f} {1.0:>8.2f}  -")
+    
+    for workers in worker_counts:
+        executor = SharedPanelExecutor(workers)
+        try:
+            # 预热：启动工作进程并发布共享内存，不计入耗时
+            executor.top_statistics(panel, codes, *query)
+            elapsed, result = measure(lambda: executor.top_statistics(panel, codes, *query), args.repeat)
+        finally:
+            executor.close()
+        same = [position for position, _ in result] == [position for position, _ in expected] and \
+            [stats for _, stats in result] == [stats for _, stats in expected]
+        print(f"{workers:>6} {elapsed:>10.3f} {serial_time / elapsed:>8.2f}  {'是' if same else '否'}")
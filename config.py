@@ -101,6 +101,32 @@ UPDATE_CONFIG = {
     "update_frequency": "monthly",  # 更新频率：monthly/weekly/daily
 }
 
+# BaoStock并行获取配置
+FETCH_CONFIG = {
+    "workers": 4,  # 并行获取的进程数（每个进程单独登录BaoStock）
+    "job_timeout": 30,  # 单个获取任务的超时时间（秒）
+    "max_retries": 2,  # 失败或超时后的重试次数
+    "job_max_attempts": 3,  # 更新任务中单只股票的最大尝试次数（继续任务时重试失败的股票）
+    "check_adjust_factors": True,  # 增量更新时多获取本地最后一个月并比较收盘价，已有数据获取后除权的股票重新获取全部前复权数据
+}
+
+# 后台任务配置
+JOB_CONFIG = {
+    "max_workers": 4,  # 同时运行的后台任务数（写数据库的任务始终依次运行）
+    "sse_max_rate": 5,  # 每个SSE客户端每秒最多接收的进度事件数，期间的进度合并为最新一条
+    # 请求中的阻塞调用（数据库查询、统计计算、导出）使用的线程池
+    "request_workers": 8,
+    # 各分组的并发上限，超出时排队；statistics/export/config_test 合计小于线程数，
+    # 保证自动补全等查询始终有空闲线程
+    "request_limits": {
+        "query": 8,
+        "statistics": 3,
+        "export": 2,
+        "config_test": 1,
+    },
+    "request_max_queue": 50,  # 每个分组最多排队的请求数，超出返回503
+}
+
 # Web服务配置
 WEB_CONFIG = {
     "host": "0.0.0.0",
@@ -113,6 +139,14 @@ STATISTICS_CONFIG = {
     "min_total_count": 0,  # 最小总涨跌次数过滤（默认不过滤）
     "exclude_delisted": True,  # 排除退市股票
     "include_st_stocks": True,  # 包含ST股票
+    "use_memory_panel": True,  # 使用进程内月K涨跌幅面板计算统计（首次使用时加载）
+    "enable_result_cache": True,  # 使用statistics_cache表缓存统计结果
+    "result_cache_max_entries": 20000,  # statistics_cache表最多保留的条目数，超过时删除最早写入的条目，0表示不限制
+    # 批量统计的工作进程数（面板发布到共享内存后分片计算），0或1表示在当前进程中计算
+    "parallel_workers": 0,
+    "parallel_min_stocks": 2000,  # 股票数少于该值时在当前进程中计算
+    "batch_page_size": 100,  # 批量统计分页查询的默认每页行数，也是流式输出的第一页行数
+    "batch_stream_page_size": 500,  # 批量统计流式输出时每次计算的行数
 }
 
 
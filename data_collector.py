@@ -6,16 +6,57 @@ import tushare as ts
 import pandas as pd
 import requests
 from datetime import datetime, date
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
+from sqlalchemy import func, select, insert, update, and_, or_
 from sqlalchemy.orm import Session
-from models import Stock, MonthlyKData, Industry
-from config import DATA_SOURCE_CONFIG
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import Stock, MonthlyKData, IndexMonthlyKData, Industry, AdjustFactor, DelistingEvent
+from config import DATA_SOURCE_CONFIG, FETCH_CONFIG
+from monthly_panel import refresh_monthly_panel_stock, invalidate_monthly_panel
+from statistics_cache import StatisticsResultCache
+from fetch_executor import BaoStockFetchExecutor, fetch_adjust_factors, to_baostock_code
 import time
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 行业指数月K数据的起始日期
+INDEX_START_DATE = "2000-01-01"
+
+# tushare全市场按月获取时最多补齐的月数，缺少更多月份的股票按股票单独获取区间数据
+TUSHARE_MARKET_MAX_MONTHS = 12
+
+# 基本资料中没有上市日期时使用的默认日期
+DEFAULT_LISTING_DATE = date(2000, 1, 1)
+
+# 已有股票中超过这个比例不在新获取的股票列表里时，认为列表不完整，不按消失判断退市
+VANISHED_MAX_RATIO = 0.1
+
+# 新获取的收盘价与本地收盘价的相对差超过这个值时，认为前复权历史已变化（发生过除权除息）
+ADJUSTMENT_TOLERANCE = 1e-6
+
+
+def _parse_date(value, fmt: str = '%Y-%m-%d') -> Optional[date]:
+    """解析日期字符串，空值或格式错误时返回None"""
+    if not value or pd.isna(value):
+        return None
+    try:
+        return datetime.strptime(str(value), fmt).date()
+    except ValueError:
+        return None
+
+
+def _next_month(year_month: int) -> int:
+    """YYYYMM格式的下一个月：202412 -> 202501"""
+    year, month = divmod(year_month, 100)
+    return (year + 1) * 100 + 1 if month == 12 else year_month + 1
+
+
+def _months_between(start: int, end: int) -> int:
+    """两个YYYYMM之间相差的月数"""
+    return (end // 100 * 12 + end % 100) - (start // 100 * 12 + start % 100)
+
 
 class DataCollector:
     """数据采集器"""
@@ -26,7 +67,7 @@ class DataCollector:
         self.primary_source = self.config["primary"]
         self.backup_sources = self.config["backup"]
         self._baostock_logged_in = False
-        
+    
     def _init_baostock(self) -> bool:
         """初始化BaoStock"""
         try:
@@ -111,7 +152,7 @@ class DataCollector:
                 row = rs.get_row_data()
                 if not row or len(row) < 3:
                     continue
-                    
+                
                 code = row[0]  # 股票代码，格式可能是 "sh.600000" 或 "sz.000001"
                 # BaoStock返回格式: [code, tradeStatus, code_name]
                 # row[1] 是交易状态，row[2] 才是股票名称
@@ -203,245 +244,220 @@ class DataCollector:
             logger.error(f"tushare获取股票列表失败: {e}")
             return []
     
-    def get_industry_monthly_k_baostock(self, index_code: str, start_date: str, end_date: str) -> pd.DataFrame:
-        """从BaoStock获取行业指数的前复权月K数据
-        
-        Args:
-            index_code: BaoStock指数代码（如：sh.000006）
-            start_date: 开始日期
-            end_date: 结束日期
-        """
+    def get_monthly_k_tushare(self, code: str, start_date: str, end_date: str) -> pd.DataFrame:
+        """从tushare获取月K数据（一次请求获取整个日期区间）"""
         try:
-            if not self._init_baostock():
-                return pd.DataFrame()
-            
-            # 获取前复权月K数据（添加超时保护）
-            import threading
-            import queue as thread_queue
-            
-            result_container = {'rs': None, 'error': None, 'completed': False}
-            
-            def fetch_data():
-                try:
-                    result_container['rs'] = bs.query_history_k_data_plus(
-                        index_code,
-                        "date,open,high,low,close,volume,amount,adjustflag",
-                        start_date=start_date,
-                        end_date=end_date,
-                        frequency="m",  # 月K
-                        adjustflag="2"  # 前复权
-                    )
-                    result_container['completed'] = True
-                except Exception as e:
-                    result_container['error'] = e
-                    result_container['completed'] = True
-            
-            # 在单独线程中执行，设置超时
-            fetch_thread = threading.Thread(target=fetch_data, daemon=True)
-            fetch_thread.start()
-            fetch_thread.join(timeout=6)  # 6秒超时
-            
-            if not result_container['completed']:
-                logger.warning(f"BaoStock获取行业指数 {index_code} 月K数据超时")
-                return pd.DataFrame()
-            
-            if result_container['error']:
-                logger.warning(f"BaoStock获取行业指数 {index_code} 月K数据异常: {result_container['error']}")
-                return pd.DataFrame()
-            
-            rs = result_container['rs']
-            if not rs or rs.error_code != '0':
-                logger.debug(f"BaoStock获取行业指数 {index_code} 月K数据失败: {rs.error_msg if rs else '无响应'}")
+            if not self._init_tushare():
                 return pd.DataFrame()
             
-            data_list = []
-            max_iterations = 500  # 防止无限循环
-            iteration = 0
-            while (rs.error_code == '0') & rs.next() and iteration < max_iterations:
-                row = rs.get_row_data()
-                if row:
-                    data_list.append(row)
-                iteration += 1
+            pro = ts.pro_api()
+            # tushare代码格式：600000.SH 或 000001.SZ
+            market = "SH" if code.startswith("6") else "SZ"
+            ts_code = f"{code}.{market}"
             
-            if not data_list:
+            df = pro.monthly(ts_code=ts_code, start_date=start_date.replace('-', ''), end_date=end_date.replace('-', ''))
+            if df is None or df.empty:
                 return pd.DataFrame()
             
-            df = pd.DataFrame(data_list, columns=rs.fields)
-            if df.empty:
+            return self._format_tushare_monthly(df).sort_values(['year', 'month'])
+        except Exception as e:
+            logger.error(f"tushare获取月K数据失败 {code}: {e}")
+            return pd.DataFrame()
+    
+    def get_market_monthly_k_tushare(self, trade_date: str) -> pd.DataFrame:
+        """从tushare一次获取全市场某个月末交易日的月K数据
+        
+        Args:
+            trade_date: 月末交易日（YYYYMMDD）
+        
+        Returns:
+            包含 stock_code 列的DataFrame
+        """
+        try:
+            pro = ts.pro_api()
+            df = pro.monthly(trade_date=trade_date)
+            if df is None or df.empty:
                 return pd.DataFrame()
-                
-            df['date'] = pd.to_datetime(df['date'])
-            df['year'] = df['date'].dt.year
-            df['month'] = df['date'].dt.month
-            
-            # 转换数据类型
-            for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            # 计算涨跌幅：月K涨跌幅 = (收盘价 - 上月收盘价) / 上月收盘价 × 100%
-            df = df.sort_values('date')
-            df['prev_close'] = df['close'].shift(1)
-            df['pct_change'] = ((df['close'] - df['prev_close']) / df['prev_close'] * 100).round(2)
-            df = df.drop('prev_close', axis=1)
             
+            df = self._format_tushare_monthly(df)
+            df['stock_code'] = df['ts_code'].str.split('.').str[0]
             return df
         except Exception as e:
-            logger.error(f"BaoStock获取行业指数月K数据失败 {index_code}: {e}", exc_info=True)
+            logger.error(f"tushare获取 {trade_date} 全市场月K数据失败: {e}")
             return pd.DataFrame()
     
+    def _tushare_month_end_dates(self, start_month: int) -> List[str]:
+        """从交易日历获取从start_month（YYYYMM）到今天每个月的最后一个交易日"""
+        pro = ts.pro_api()
+        cal = pro.trade_cal(
+            exchange='SSE',
+            start_date=f"{start_month}01",
+            end_date=datetime.now().strftime('%Y%m%d'),
+            is_open='1'
+        )
+        if cal is None or cal.empty:
+            return []
+        dates = cal['cal_date'].astype(str)
+        return sorted(dates.groupby(dates.str[:6]).max().tolist())
+    
+    @staticmethod
+    def _format_tushare_monthly(df: pd.DataFrame) -> pd.DataFrame:
+        """tushare月线数据转换为与BaoStock一致的列"""
+        df = df.copy()
+        df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
+        df['year'] = df['trade_date'].dt.year
+        df['month'] = df['trade_date'].dt.month
+        
+        # 重命名列以匹配我们的数据结构
+        return df.rename(columns={
+            'vol': 'volume',
+            'pct_chg': 'pct_change'
+        })
     
-    def get_monthly_k_baostock(self, code: str, start_date: str, end_date: str) -> pd.DataFrame:
-        """从BaoStock获取前复权月K数据"""
+    def get_stock_basic_baostock(self) -> Dict[str, Dict]:
+        """一次查询BaoStock全市场证券基本资料（query_stock_basic不传代码时返回全部证券）
+        
+        Returns:
+            {股票代码: {"listing_date": 上市日期, "out_date": 退市日期, "is_delisted": 0/1}}，只包含股票（type=1）
+        """
         try:
             if not self._init_baostock():
-                return pd.DataFrame()
-            
-            # BaoStock代码格式：sh.600000 或 sz.000001
-            market = "sh" if code.startswith("6") else "sz"
-            bs_code = f"{market}.{code}"
-            
-            # 获取前复权月K数据
-            rs = bs.query_history_k_data_plus(
-                bs_code,
-                "date,open,high,low,close,volume,amount,adjustflag",
-                start_date=start_date,
-                end_date=end_date,
-                frequency="m",  # 月K
-                adjustflag="2"  # 前复权
-            )
+                return {}
             
+            rs = bs.query_stock_basic()
             if rs.error_code != '0':
-                logger.warning(f"BaoStock获取股票 {code} 月K数据失败: {rs.error_msg}")
-                return pd.DataFrame()
+                logger.warning(f"BaoStock查询证券基本资料失败: {rs.error_msg}")
+                return {}
             
-            data_list = []
+            fields = {name: idx for idx, name in enumerate(rs.fields)}
+            basic = {}
             while (rs.error_code == '0') & rs.next():
                 row = rs.get_row_data()
-                if row:
-                    data_list.append(row)
-            
-            if not data_list:
-                return pd.DataFrame()
-            
-            df = pd.DataFrame(data_list, columns=rs.fields)
-            if df.empty:
-                return pd.DataFrame()
-                
-            df['date'] = pd.to_datetime(df['date'])
-            df['year'] = df['date'].dt.year
-            df['month'] = df['date'].dt.month
-            
-            # 转换数据类型
-            for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            # 计算涨跌幅：月K涨跌幅 = (收盘价 - 上月收盘价) / 上月收盘价 × 100%
-            df = df.sort_values('date')
-            df['prev_close'] = df['close'].shift(1)
-            df['pct_change'] = ((df['close'] - df['prev_close']) / df['prev_close'] * 100).round(2)
-            df = df.drop('prev_close', axis=1)
-            
-            return df
+                if not row or row[fields['type']] != '1':
+                    continue
+                out_date = _parse_date(row[fields['outDate']])
+                basic[row[fields['code']].split('.')[-1]] = {
+                    "listing_date": _parse_date(row[fields['ipoDate']]),
+                    "out_date": out_date,
+                    "is_delisted": 1 if row[fields['status']] == '0' or out_date else 0,
+                }
+            return basic
         except Exception as e:
-            logger.error(f"BaoStock获取月K数据失败 {code}: {e}", exc_info=True)
-            return pd.DataFrame()
+            logger.error(f"BaoStock获取证券基本资料失败: {e}", exc_info=True)
+            return {}
     
-    def get_monthly_k_tushare(self, code: str, start_date: str, end_date: str) -> pd.DataFrame:
-        """从tushare获取前复权月K数据"""
+    def get_stock_basic_tushare(self) -> Dict[str, Dict]:
+        """从tushare获取全市场股票的上市和退市日期（上市和已退市各一次请求）"""
         try:
             if not self._init_tushare():
-                return pd.DataFrame()
+                return {}
             
             pro = ts.pro_api()
-            # tushare代码格式：600000.SH 或 000001.SZ
-            market = "SH" if code.startswith("6") else "SZ"
-            ts_code = f"{code}.{market}"
-            
-            # 获取月K数据（需要按月获取）
-            start_year = int(start_date[:4])
-            start_month = int(start_date[5:7])
-            end_year = int(end_date[:4])
-            end_month = int(end_date[5:7])
-            
-            all_data = []
-            for year in range(start_year, end_year + 1):
-                for month in range(1, 13):
-                    if year == start_year and month < start_month:
-                        continue
-                    if year == end_year and month > end_month:
-                        break
-                    
-                    # tushare获取月线数据
-                    try:
-                        df = pro.monthly(ts_code=ts_code, start_date=f"{year}{month:02d}01", end_date=f"{year}{month:02d}28")
-                        if not df.empty:
-                            all_data.append(df)
-                        time.sleep(0.2)  # 避免请求过快
-                    except:
-                        continue
-            
-            if not all_data:
-                return pd.DataFrame()
+            basic = {}
+            for list_status in ('L', 'D'):
+                df = pro.stock_basic(exchange='', list_status=list_status, fields='symbol,list_date,delist_date')
+                for code, list_date, delist_date in zip(df['symbol'], df['list_date'], df['delist_date']):
+                    out_date = _parse_date(delist_date, '%Y%m%d')
+                    basic[code] = {
+                        "listing_date": _parse_date(list_date, '%Y%m%d'),
+                        "out_date": out_date,
+                        "is_delisted": 1 if list_status == 'D' or out_date else 0,
+                    }
+            return basic
+        except Exception as e:
+            logger.error(f"tushare获取股票基本资料失败: {e}")
+            return {}
+    
+    def get_stock_basic(self) -> Dict[str, Dict]:
+        """获取全市场股票基本资料（优先BaoStock，见 get_stock_basic_baostock）"""
+        basic = {}
+        if self.config["baostock"]["enabled"]:
+            basic = self.get_stock_basic_baostock()
+        if not basic and self.config["tushare"]["enabled"]:
+            basic = self.get_stock_basic_tushare()
+        return basic
+    
+    def update_stock_metadata(self, basic: Optional[Dict[str, Dict]] = None, listed_codes: Optional[Set[str]] = None) -> Dict[str, int]:
+        """按全市场基本资料和股票列表在一个事务中批量更新股票的上市日期和退市标记
+        
+        基本资料中有退市日期或状态为退市的股票，以及不在本次股票列表中、基本资料里也没有的股票
+        标记为退市，并记录到 delisting_events 表（月K历史数据保留）；
+        已标记退市但重新出现在列表或基本资料中为上市状态的股票恢复为上市。
+        列表中消失的股票超过 VANISHED_MAX_RATIO 时认为列表不完整，不按消失判断退市。
+        
+        Args:
+            basic: get_stock_basic 的结果，为None时重新获取
+            listed_codes: 本次获取到的股票列表中的代码，为None时不按消失判断退市
+        
+        Returns:
+            {"updated": 上市日期或退市标记有变化的股票数, "delisted": 新退市数, "relisted": 恢复上市数}
+        """
+        if basic is None:
+            basic = self.get_stock_basic()
+        stocks = self.db.query(Stock.id, Stock.code, Stock.listing_date, Stock.is_delisted).all()
+        
+        if listed_codes is not None:
+            vanished = sum(1 for _, code, _, _ in stocks if code not in listed_codes and code not in basic)
+            if vanished > len(stocks) * VANISHED_MAX_RATIO:
+                logger.warning(f"有 {vanished} 只股票不在本次获取的股票列表中，可能列表不完整，本次不按消失判断退市")
+                listed_codes = None
+        
+        today = date.today()
+        now = datetime.now()
+        changes = []
+        events = []
+        relisted = 0
+        for stock_id, code, listing_date, is_delisted in stocks:
+            info = basic.get(code)
+            values = {}
+            if info and info["listing_date"] and info["listing_date"] != listing_date:
+                values["listing_date"] = info["listing_date"]
             
-            df = pd.concat(all_data, ignore_index=True)
-            df['trade_date'] = pd.to_datetime(df['trade_date'], format='%Y%m%d')
-            df['year'] = df['trade_date'].dt.year
-            df['month'] = df['trade_date'].dt.month
+            # (退市日期, 判断依据)，没有退市日期时使用检测日期
+            if info and info["is_delisted"]:
+                delisting = (info["out_date"] or today, "out_date" if info["out_date"] else "status")
+            elif info is None and listed_codes is not None and code not in listed_codes:
+                delisting = (today, "vanished")
+            else:
+                delisting = None
             
-            # 重命名列以匹配我们的数据结构
-            df = df.rename(columns={
-                'open': 'open',
-                'high': 'high',
-                'low': 'low',
-                'close': 'close',
-                'vol': 'volume',
-                'amount': 'amount',
-                'pct_chg': 'pct_change'
-            })
+            if delisting and not is_delisted:
+                values["is_delisted"] = 1
+                events.append({"stock_code": code, "delist_date": delisting[0], "reason": delisting[1], "created_at": now})
+            elif not delisting and is_delisted and (info or (listed_codes is not None and code in listed_codes)):
+                values["is_delisted"] = 0
+                relisted += 1
             
-            return df
-        except Exception as e:
-            logger.error(f"tushare获取月K数据失败 {code}: {e}")
-            return pd.DataFrame()
-    
-    def get_stock_listing_date(self, code: str) -> Optional[date]:
-        """获取股票上市日期"""
-        # 优先从BaoStock获取
-        try:
-            if self._init_baostock():
-                market = "sh" if code.startswith("6") else "sz"
-                bs_code = f"{market}.{code}"
-                rs = bs.query_stock_basic(code=bs_code)
-                if rs.error_code == '0':
-                    while rs.next():
-                        row = rs.get_row_data()
-                        if row and len(row) > 1 and row[1]:  # ipoDate
-                            listing_date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                            return listing_date
-        except Exception as e:
-            logger.debug(f"获取股票 {code} 上市日期失败: {e}")
-            pass
+            if values:
+                changes.append({"id": stock_id, "updated_at": now, **values})
         
-        # 备用：从tushare获取
-        try:
-            if self._init_tushare():
-                pro = ts.pro_api()
-                market = "SH" if code.startswith("6") else "SZ"
-                ts_code = f"{code}.{market}"
-                df = pro.stock_basic(ts_code=ts_code, fields='list_date')
-                if not df.empty and pd.notna(df.iloc[0]['list_date']):
-                    listing_date = datetime.strptime(str(df.iloc[0]['list_date']), '%Y%m%d').date()
-                    return listing_date
-        except:
-            pass
+        if changes:
+            try:
+                self.db.execute(update(Stock), changes)
+                if events:
+                    self.db.execute(insert(DelistingEvent), events)
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
         
-        return None
+        if events or relisted:
+            # 退市标记影响统计和更新的股票范围
+            StatisticsResultCache(self.db).invalidate_all()
+            logger.info(f"股票退市状态变化：新退市 {len(events)} 只，恢复上市 {relisted} 只")
+        if changes:
+            logger.info(f"更新股票基本资料完成，{len(changes)} 只股票的上市日期或退市标记有变化")
+        return {"updated": len(changes), "delisted": len(events), "relisted": relisted}
     
-    def update_stock_list(self, progress_callback=None) -> int:
+    def update_stock_list(self, progress_callback=None) -> Dict[str, int]:
         """更新股票列表
         
         Args:
             progress_callback: 进度回调函数，接收(current, total, message)参数
+        
+        Returns:
+            比对结果（见 reconcile_stock_list），另有 delisted（新退市数）和 relisted（恢复上市数），
+            没有获取到股票列表时为空字典
         """
         logger.info("开始更新股票列表...")
         
@@ -538,196 +554,870 @@ class DataCollector:
             logger.error("未能获取股票列表")
             if progress_callback:
                 progress_callback(100, 100, "获取股票列表失败")
-            return 0
+            return {}
         
-        # 补充行业信息到stock_list
+        # 一次获取全市场的上市日期和退市状态，新股票直接使用真实的上市日期
+        if progress_callback:
+            progress_callback(5, 100, f"已获取 {len(stock_list)} 只股票，正在获取上市日期...")
+        basic = self.get_stock_basic()
+        
+        # 补充行业信息和上市日期到stock_list
         for stock in stock_list:
             code = stock["code"]
             if code in industry_data:
                 stock["industry"] = industry_data[code]
             elif "industry" not in stock:
                 stock["industry"] = ""
+            if not stock.get("listing_date") and code in basic:
+                stock["listing_date"] = basic[code]["listing_date"]
         
         if progress_callback:
             progress_callback(10, 100, f"已获取 {len(stock_list)} 只股票，开始保存到数据库...")
         
-        # 保存到数据库
-        count = 0
-        total = len(stock_list)
+        summary = self.reconcile_stock_list(stock_list)
+        
+        # 上市日期和退市标记
+        metadata = self.update_stock_metadata(basic, {stock["code"] for stock in stock_list})
+        summary["delisted"] = metadata["delisted"]
+        summary["relisted"] = metadata["relisted"]
+        
+        # 股票列表变化后清除全部统计缓存
+        StatisticsResultCache(self.db).invalidate_all()
+        
+        message = (
+            f"更新完成，新增 {summary['added']} 只，信息变化 {summary['changed']} 只，"
+            f"未变化 {summary['unchanged']} 只，列表中已不存在 {summary['vanished']} 只，新退市 {summary['delisted']} 只"
+        )
+        if progress_callback:
+            progress_callback(100, 100, message)
+        
+        logger.info(f"更新股票列表{message}")
+        return summary
+    
+    def reconcile_stock_list(self, stock_list: List[Dict]) -> Dict[str, int]:
+        """把获取到的股票列表与股票表按集合比对，在一个事务中批量写入
+        
+        一次读取已有股票，在内存中比对后用一条批量INSERT写入新股票，
+        用一条按主键的批量UPDATE只写入有变化的字段（行业和上市日期为空时保留原值）。
+        
+        Args:
+            stock_list: [{"code", "name", "market", "listing_date"（可选）, "industry"（可选）}]
+        
+        Returns:
+            {"added": 新增数, "changed": 信息变化数, "unchanged": 未变化数, "vanished": 股票表中有而列表中没有的股票数}
+        """
+        incoming = {stock["code"]: stock for stock in stock_list}
+        existing = {
+            code: (stock_id, name, market, industry_name, listing_date)
+            for stock_id, code, name, market, industry_name, listing_date in self.db.query(
+                Stock.id, Stock.code, Stock.name, Stock.market, Stock.industry_name, Stock.listing_date
+            ).all()
+        }
+        
+        now = datetime.now()
+        inserts = []
+        updates = []
+        for code, stock in incoming.items():
+            current = existing.get(code)
+            if current is None:
+                inserts.append({
+                    "code": code,
+                    "name": stock["name"],
+                    "market": stock["market"],
+                    "listing_date": stock.get("listing_date") or DEFAULT_LISTING_DATE,
+                    "industry_name": stock.get("industry", ""),
+                })
+                continue
+            
+            stock_id, name, market, industry_name, listing_date = current
+            values = {}
+            if stock["name"] != name:
+                values["name"] = stock["name"]
+            if stock["market"] != market:
+                values["market"] = stock["market"]
+            if stock.get("industry") and stock["industry"] != industry_name:
+                values["industry_name"] = stock["industry"]
+            if stock.get("listing_date") and stock["listing_date"] != listing_date:
+                values["listing_date"] = stock["listing_date"]
+            if values:
+                updates.append({"id": stock_id, "updated_at": now, **values})
+        
+        try:
+            if inserts:
+                self.db.execute(insert(Stock), inserts)
+            if updates:
+                self.db.execute(update(Stock), updates)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        return {
+            "added": len(inserts),
+            "changed": len(updates),
+            "unchanged": len(incoming) - len(inserts) - len(updates),
+            "vanished": len(existing.keys() - incoming.keys()),
+        }
+    
+    def update_monthly_k_data(self, code: str, force_update: bool = False, progress_callback=None) -> int:
+        """更新单只股票的月K数据（与批量更新使用同一获取和写入流程，见 update_monthly_k_data_batch）
+        
+        Returns:
+            新增的记录数
+        """
+        count, _, _ = self.update_monthly_k_data_batch([code], force_update, progress_callback)
+        return count
+    
+    def plan_monthly_k_update(self, stock_codes: List[str], force_update: bool = False) -> Dict:
+        """在获取数据前生成更新计划
         
-        # 批量获取已存在的股票代码，避免重复查询
-        existing_codes = {s.code for s in self.db.query(Stock.code).all()}
+        一次分组查询得到每只股票已有数据的最新月份，已包含上一个完整月份数据的股票
+        和已退市的股票直接跳过，其余股票按开始日期分组，同一开始日期的股票可以批量获取。
+        检查除权除息时，增量获取从本地最后一个月开始（多获取一个月），
+        写入时用这个月的收盘价判断前复权历史是否变化（见 iter_monthly_k_updates）。
         
-        for idx, stock_info in enumerate(stock_list):
-            # 更新进度
-            if progress_callback and (idx + 1) % 100 == 0:
-                progress = 10 + int((idx + 1) / total * 80)
-                progress_callback(progress, 100, f"正在处理: {stock_info['code']} - {stock_info['name']} ({idx + 1}/{total})")
+        Args:
+            stock_codes: 股票代码列表
+            force_update: 是否从上市日期重新获取全部数据（不跳过任何股票，包括已退市的股票）
+        
+        Returns:
+            {
+                "groups": {开始日期: [股票代码, ...]},
+                "latest": {股票代码: 已有数据的最新月份（YYYYMM）},
+                "names": {股票代码: 股票名称},
+                "to_fetch": 需要获取的股票数,
+                "skipped": 已是最新而跳过的股票数,
+                "delisted": 已退市而跳过的股票数,
+                "new_listings": 本地还没有月K数据的股票数,
+                "missing": 股票表中不存在的股票代码列表,
+                "force_update": 是否强制更新,
+            }
+        """
+        stocks = {
+            code: (name, listing_date, is_delisted)
+            for code, name, listing_date, is_delisted in self.db.query(
+                Stock.code, Stock.name, Stock.listing_date, Stock.is_delisted
+            ).all()
+        }
+        # 每只股票已有数据的最新月份（YYYYMM），一次分组查询
+        latest = dict(self.db.query(
+            MonthlyKData.stock_code,
+            func.max(MonthlyKData.year * 100 + MonthlyKData.month)
+        ).group_by(MonthlyKData.stock_code).all())
+        overlap = self._check_adjustment_enabled()
+        
+        now = datetime.now()
+        last_completed_month = (now.year - 1) * 100 + 12 if now.month == 1 else now.year * 100 + now.month - 1
+        
+        groups = {}
+        skipped = 0
+        delisted = 0
+        new_listings = 0
+        missing = []
+        for code in stock_codes:
+            if code not in stocks:
+                missing.append(code)
+                continue
+            if stocks[code][2] and not force_update:
+                delisted += 1
+                continue
             
-            code = stock_info["code"]
+            last = latest.get(code)
+            if last is None:
+                new_listings += 1
+            elif not force_update and last >= last_completed_month:
+                skipped += 1
+                continue
             
-            if code in existing_codes:
-                # 更新现有记录
-                existing = self.db.query(Stock).filter(Stock.code == code).first()
-                if existing:
-                    existing.name = stock_info["name"]
-                    existing.market = stock_info["market"]
-                    if "listing_date" in stock_info and stock_info["listing_date"]:
-                        existing.listing_date = stock_info["listing_date"]
-                    if "industry" in stock_info and stock_info["industry"]:
-                        existing.industry_name = stock_info["industry"]
-                    existing.updated_at = datetime.now()
+            if force_update or last is None:
+                start_date = stocks[code][1].strftime('%Y-%m-%d')
             else:
-                # 创建新记录 - 优化：先使用默认日期，避免阻塞
-                listing_date = stock_info.get("listing_date")
-                if not listing_date:
-                    # 对于新股票，先使用默认日期，后续可以批量更新上市日期
-                    listing_date = date(2000, 1, 1)  # 默认日期
-                
-                # 再次检查，避免在批量提交期间重复添加
-                check_existing = self.db.query(Stock).filter(Stock.code == code).first()
-                if not check_existing:
-                    stock = Stock(
-                        code=code,
-                        name=stock_info["name"],
-                        market=stock_info["market"],
-                        listing_date=listing_date,
-                        industry_name=stock_info.get("industry", "")
-                    )
-                    self.db.add(stock)
-                    count += 1
-                    existing_codes.add(code)  # 添加到已存在集合中
-                
-                # 每100条提交一次，避免内存占用过大
-                if count % 100 == 0:
-                    try:
-                        self.db.commit()
-                    except Exception as e:
-                        logger.warning(f"批量提交时出错（可能重复）: {e}")
-                        self.db.rollback()
-                        # 重新获取已存在的代码集合
-                        existing_codes = {s.code for s in self.db.query(Stock.code).all()}
+                start_month = last if overlap else _next_month(last)
+                start_date = f"{start_month // 100}-{start_month % 100:02d}-01"
+            groups.setdefault(start_date, []).append(code)
+        
+        return {
+            "groups": groups,
+            "latest": latest,
+            "names": {code: name for code, (name, _, _) in stocks.items()},
+            "to_fetch": sum(len(codes) for codes in groups.values()),
+            "skipped": skipped,
+            "delisted": delisted,
+            "new_listings": new_listings,
+            "missing": missing,
+            "force_update": force_update,
+        }
+    
+    def _check_adjustment_enabled(self) -> bool:
+        """是否在增量更新时检查除权除息（只对BaoStock获取的前复权数据检查）"""
+        return bool(self.config["baostock"]["enabled"] and FETCH_CONFIG["check_adjust_factors"])
+    
+    def _adjusted_since_fetch(self, code: str, df: pd.DataFrame) -> bool:
+        """比较新获取的第一个月与本地同一个月的收盘价，判断本地数据获取后是否发生过除权除息
+        
+        除权除息后之前所有月份的前复权价格都会变化，比较一个月的收盘价即可；
+        本地没有这个月的数据时返回False。
+        """
+        first = df.index[0]
+        stored = self.db.query(MonthlyKData.close_price).filter(
+            MonthlyKData.stock_code == code,
+            MonthlyKData.year == int(df.loc[first, 'year']),
+            MonthlyKData.month == int(df.loc[first, 'month'])
+        ).scalar()
+        close = df.loc[first, 'close']
+        if stored is None or pd.isna(close):
+            return False
+        return abs(float(close) - stored) > ADJUSTMENT_TOLERANCE * max(abs(stored), 1.0)
+    
+    def record_adjust_factors(self, stock_codes: List[str]) -> int:
+        """获取并保存股票新的除权除息事件
+        
+        每只股票只查询本地已保存的最后一次除权除息之后的复权因子（没有记录时从上市日期开始），
+        多个进程并行获取。
+        
+        Returns:
+            新保存的除权除息事件数
+        """
+        if not stock_codes:
+            return 0
+        
+        codes = set(stock_codes)
+        latest = {
+            code: divid_date
+            for code, divid_date in self.db.query(
+                AdjustFactor.stock_code, func.max(AdjustFactor.divid_operate_date)
+            ).group_by(AdjustFactor.stock_code).all()
+            if code in codes
+        }
+        listing = {code: listing_date for code, listing_date in self.db.query(Stock.code, Stock.listing_date).all() if code in codes}
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        
+        jobs = {}  # {BaoStock代码: (股票代码, 已保存的最后一次除权除息日期)}
+        for code in codes:
+            start = latest.get(code) or listing.get(code) or DEFAULT_LISTING_DATE
+            jobs[to_baostock_code(code)] = (code, latest.get(code), start.strftime('%Y-%m-%d'))
         
-        self.db.commit()
+        records = []
+        executor = BaoStockFetchExecutor()
+        for (bs_code, _, _), df, error in executor.fetch(
+            ((bs_code, start_date, end_date) for bs_code, (_, _, start_date) in jobs.items()),
+            fetcher=fetch_adjust_factors
+        ):
+            code, last, _ = jobs[bs_code]
+            records.extend(
+                {"stock_code": code, "divid_operate_date": divid_date, "fore_adjust_factor": fore,
+                 "back_adjust_factor": back, "adjust_factor": factor}
+                for divid_date, fore, back, factor in df.itertuples(index=False, name=None)
+                if last is None or divid_date > last
+            )
         
+        if records:
+            stmt = sqlite_insert(AdjustFactor)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['stock_code', 'divid_operate_date'],
+                set_={name: stmt.excluded[name] for name in ('fore_adjust_factor', 'back_adjust_factor', 'adjust_factor')}
+            )
+            try:
+                self.db.execute(stmt, records)
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+        
+        logger.info(f"保存除权除息事件完成：{len(codes)} 只股票，新增 {len(records)} 条复权因子")
+        return len(records)
+    
+    def update_monthly_k_data_batch(self, stock_codes: List[str], force_update: bool = False, progress_callback=None) -> Tuple[int, int, int]:
+        """批量更新股票月K数据：BaoStock数据由多个进程并行获取，在当前会话中逐只写入
+        
+        先生成更新计划（见 plan_monthly_k_update），只获取需要更新的股票。
+        
+        Args:
+            stock_codes: 股票代码列表
+            force_update: 是否从上市日期重新获取全部数据
+            progress_callback: 进度回调函数，接收(current, total, message)参数，按股票计数；
+                另外以关键字参数 stocks（已处理股票数）和 rows（已写入记录数）传入累计数量
+        
+        Returns:
+            (新增记录数, 成功股票数, 失败股票数)，已是最新而跳过的股票计入成功
+        """
+        total = len(stock_codes)
+        
+        plan = self.plan_monthly_k_update(stock_codes, force_update)
+        names = plan["names"]
+        
+        plan_message = (
+            f"更新计划：需要获取 {plan['to_fetch']} 只（其中新上市 {plan['new_listings']} 只），"
+            f"已是最新跳过 {plan['skipped']} 只，已退市跳过 {plan['delisted']} 只"
+        )
+        logger.info(plan_message)
+        for code in plan["missing"]:
+            logger.warning(f"股票 {code} 不存在")
+        
+        total_count = 0
+        success_count = plan["skipped"] + plan["delisted"]
+        failed_count = len(plan["missing"])
+        done = success_count + failed_count
         if progress_callback:
-            progress_callback(100, 100, f"更新完成，新增 {count} 只股票")
+            progress_callback(done, total, plan_message, stocks=done, rows=0)
         
-        logger.info(f"更新股票列表完成，新增 {count} 只股票")
-        return count
+        # 只启用tushare时按月获取全市场截面数据
+        if not self.config["baostock"]["enabled"] and self.config["tushare"]["enabled"]:
+            count, success, failed = self._update_monthly_k_data_tushare(plan, progress_callback)
+            return count, success_count + success, failed_count + failed
+        
+        def report(code):
+            nonlocal done
+            done += 1
+            if progress_callback:
+                name = names.get(code) or code
+                progress_callback(done, total, f"已更新 {code} - {name} ({done}/{total})", stocks=done, rows=total_count)
+        
+        # 按开始日期分组排列获取任务
+        items = [
+            (code, start_date)
+            for start_date in sorted(plan["groups"])
+            for code in plan["groups"][start_date]
+        ]
+        for code, count, error in self.iter_monthly_k_updates(items):
+            if error:
+                failed_count += 1
+            else:
+                total_count += count
+                success_count += 1
+            report(code)
+        
+        logger.info(f"批量更新月K数据完成，成功 {success_count} 只，失败 {failed_count} 只，新增 {total_count} 条记录")
+        return total_count, success_count, failed_count
     
-    def update_monthly_k_data(self, code: str, force_update: bool = False, progress_callback=None) -> int:
-        """更新单只股票的月K数据"""
-        try:
-            stock = self.db.query(Stock).filter(Stock.code == code).first()
-            if not stock:
-                logger.warning(f"股票 {code} 不存在")
-                return 0
-            
-            # 确定更新日期范围
-            if force_update:
-                start_date = stock.listing_date.strftime('%Y-%m-%d')
+    def iter_monthly_k_updates(self, items: List[Tuple[str, str]]):
+        """获取并逐只写入股票月K数据，每写完一只股票返回一次结果
+        
+        BaoStock数据由多个进程并行获取，BaoStock获取失败时使用tushare补充。
+        增量获取的第一个月是本地已有的月份（见 plan_monthly_k_update），收盘价与本地不同的股票
+        在本地数据获取后除权除息过，这些股票不写入增量数据，其余股票处理完后保存新的复权因子，
+        并从上市日期重新获取全部数据。提前停止迭代时会结束获取进程，已返回的股票均已提交。
+        
+        Args:
+            items: [(股票代码, 开始日期), ...]
+        
+        Yields:
+            (股票代码, 新增记录数, 错误信息)，成功时错误信息为None
+        """
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        start_dates = dict(items)
+        listing_dates = {}
+        if self._check_adjustment_enabled():
+            listing_dates = {
+                code: listing_date.strftime('%Y-%m-%d')
+                for code, listing_date in self.db.query(Stock.code, Stock.listing_date).all()
+                if code in start_dates
+            }
+        adjusted = []
+        
+        def fetched():
+            """按完成顺序返回 (股票代码, DataFrame, 错误信息)"""
+            if self.config["baostock"]["enabled"]:
+                executor = BaoStockFetchExecutor()
+                codes = {to_baostock_code(code): code for code, _ in items}
+                for (bs_code, _, _), df, error in executor.fetch(
+                    (to_baostock_code(code), start_date, end_date) for code, start_date in items
+                ):
+                    yield codes[bs_code], df, error
             else:
-                # 获取已有数据的最新日期
-                latest = self.db.query(MonthlyKData).filter(
-                    MonthlyKData.stock_code == code
-                ).order_by(MonthlyKData.year.desc(), MonthlyKData.month.desc()).first()
-                
-                if latest:
-                    # 从下一个月开始更新
-                    if latest.month == 12:
-                        start_year = latest.year + 1
-                        start_month = 1
+                for code, _ in items:
+                    yield code, pd.DataFrame(), None
+        
+        results = fetched()
+        saved = 0
+        try:
+            for code, df, error in results:
+                start_date = start_dates[code]
+                try:
+                    # 增量获取的BaoStock数据：前复权历史变化的股票稍后重新获取全部数据
+                    if (not df.empty and code in listing_dates and start_date > listing_dates[code]
+                            and self._adjusted_since_fetch(code, df)):
+                        adjusted.append(code)
+                        continue
+                    
+                    if df.empty and self.config["tushare"]["enabled"]:
+                        df = self.get_monthly_k_tushare(code, start_date, end_date)
+                    
+                    if df.empty:
+                        logger.warning(f"未能获取股票 {code} 的月K数据（{start_date} 至 {end_date}）")
+                        result = (code, 0, error)
                     else:
-                        start_year = latest.year
-                        start_month = latest.month + 1
-                    start_date = f"{start_year}-{start_month:02d}-01"
+                        result = (code, self._save_monthly_k_data(code, df), None)
+                        saved += 1
+                except Exception as e:
+                    logger.error(f"更新股票 {code} 失败: {e}", exc_info=True)
+                    self.db.rollback()
+                    result = (code, 0, str(e))
+                yield result
+        finally:
+            results.close()
+            # 每只股票写入时只清除该股票的缓存，批量统计缓存在这批股票写入后清除一次
+            if saved:
+                StatisticsResultCache(self.db).invalidate_batch()
+        
+        if adjusted:
+            logger.info(f"{len(adjusted)} 只股票在本地数据获取后除权除息，从上市日期重新获取全部数据")
+            try:
+                self.record_adjust_factors(adjusted)
+            except Exception as e:
+                logger.error(f"保存复权因子失败: {e}", exc_info=True)
+            yield from self.iter_monthly_k_updates([(code, listing_dates[code]) for code in adjusted])
+    
+    def _update_monthly_k_data_tushare(self, plan: Dict, progress_callback=None) -> Tuple[int, int, int]:
+        """按更新计划用tushare批量更新股票月K数据
+        
+        增量更新时每个月末交易日只请求一次全市场截面数据（pro.monthly(trade_date=...)），
+        当月所有股票的数据在一个事务中批量写入；没有数据或缺少超过
+        TUSHARE_MARKET_MAX_MONTHS 个月的股票按股票单独请求一次区间数据补齐。
+        
+        Returns:
+            (新增记录数, 成功股票数, 失败股票数)
+        """
+        if not self._init_tushare():
+            return 0, 0, plan["to_fetch"]
+        
+        latest = plan["latest"]
+        now = datetime.now()
+        current_month = now.year * 100 + now.month
+        end_date = now.strftime('%Y-%m-%d')
+        total_count = 0
+        success_count = 0
+        failed_count = 0
+        
+        backfill = []  # [(股票代码, 开始日期)]
+        market_codes = set()
+        for start_date, codes in sorted(plan["groups"].items()):
+            for code in codes:
+                last = latest.get(code)
+                if plan["force_update"] or last is None or _months_between(last, current_month) > TUSHARE_MARKET_MAX_MONTHS:
+                    backfill.append((code, start_date))
                 else:
-                    start_date = stock.listing_date.strftime('%Y-%m-%d')
-            
-            end_date = datetime.now().strftime('%Y-%m-%d')
-            
-            # 检查是否需要更新（如果开始日期晚于结束日期，说明已经是最新数据）
-            if start_date > end_date:
-                logger.debug(f"股票 {code} 数据已是最新，无需更新")
-                return 0
-            
-            # 获取数据
-            df = pd.DataFrame()
-            
-            if self.config["baostock"]["enabled"]:
-                df = self.get_monthly_k_baostock(code, start_date, end_date)
-            
-            if df.empty and self.config["tushare"]["enabled"]:
-                df = self.get_monthly_k_tushare(code, start_date, end_date)
+                    market_codes.add(code)
+        
+        month_ends = []
+        if market_codes:
+            first_month = _next_month(min(latest[code] for code in market_codes))
+            month_ends = self._tushare_month_end_dates(first_month)
+        
+        total_steps = len(month_ends) + len(backfill)
+        logger.info(f"tushare更新月K数据：全市场按月获取 {len(month_ends)} 个月（{len(market_codes)} 只股票），单独补齐 {len(backfill)} 只股票")
+        
+        for idx, trade_date in enumerate(month_ends):
+            year_month = int(trade_date[:6])
+            df = self.get_market_monthly_k_tushare(trade_date)
+            if not df.empty:
+                # 只写入缺少该月数据的股票
+                df = df[df['stock_code'].map(lambda code: code in market_codes and latest[code] < year_month)]
+            if not df.empty:
+                try:
+                    total_count += self._save_market_monthly_k_data(df)
+                except Exception as e:
+                    logger.error(f"保存 {trade_date} 全市场月K数据失败: {e}", exc_info=True)
             
+            if progress_callback:
+                progress_callback(idx + 1, total_steps, f"已更新 {trade_date[:4]}年{int(trade_date[4:6])}月 全市场月K数据 ({idx + 1}/{total_steps})", rows=total_count)
+        success_count += len(market_codes)
+        
+        saved = 0
+        for idx, (code, start_date) in enumerate(backfill):
+            df = self.get_monthly_k_tushare(code, start_date, end_date)
             if df.empty:
                 logger.warning(f"未能获取股票 {code} 的月K数据（{start_date} 至 {end_date}）")
-                if progress_callback:
-                    progress_callback(100, 100, f"未能获取股票 {code} 的月K数据")
-                return 0
-            
-            if progress_callback:
-                progress_callback(50, 100, f"已获取 {len(df)} 条数据，正在保存...")
-            
-            # 保存到数据库
-            count = 0
-            total_rows = len(df)
-            for idx, (_, row) in enumerate(df.iterrows()):
+                failed_count += 1
+            else:
                 try:
-                    existing = self.db.query(MonthlyKData).filter(
-                        MonthlyKData.stock_code == code,
-                        MonthlyKData.year == int(row['year']),
-                        MonthlyKData.month == int(row['month'])
-                    ).first()
-                    
-                    if existing:
-                        # 更新现有记录
-                        existing.open_price = float(row.get('open', 0)) if pd.notna(row.get('open')) else None
-                        existing.close_price = float(row.get('close', 0)) if pd.notna(row.get('close')) else None
-                        existing.high_price = float(row.get('high', 0)) if pd.notna(row.get('high')) else None
-                        existing.low_price = float(row.get('low', 0)) if pd.notna(row.get('low')) else None
-                        existing.volume = float(row.get('volume', 0)) if pd.notna(row.get('volume')) else None
-                        existing.amount = float(row.get('amount', 0)) if pd.notna(row.get('amount')) else None
-                        existing.pct_change = float(row.get('pct_change', 0)) if pd.notna(row.get('pct_change')) else None
-                        existing.updated_at = datetime.now()
-                    else:
-                        # 创建新记录
-                        monthly_data = MonthlyKData(
-                            stock_code=code,
-                            year=int(row['year']),
-                            month=int(row['month']),
-                            open_price=float(row.get('open', 0)) if pd.notna(row.get('open')) else None,
-                            close_price=float(row.get('close', 0)) if pd.notna(row.get('close')) else None,
-                            high_price=float(row.get('high', 0)) if pd.notna(row.get('high')) else None,
-                            low_price=float(row.get('low', 0)) if pd.notna(row.get('low')) else None,
-                            volume=float(row.get('volume', 0)) if pd.notna(row.get('volume')) else None,
-                            amount=float(row.get('amount', 0)) if pd.notna(row.get('amount')) else None,
-                            pct_change=float(row.get('pct_change', 0)) if pd.notna(row.get('pct_change')) else None
-                        )
-                        self.db.add(monthly_data)
-                        count += 1
-                        
-                        # 每50条提交一次，避免内存占用过大
-                        if count % 50 == 0:
-                            self.db.commit()
-                            if progress_callback:
-                                progress = 50 + int((idx + 1) / total_rows * 50)
-                                progress_callback(progress, 100, f"已保存 {idx + 1}/{total_rows} 条数据...")
+                    total_count += self._save_monthly_k_data(code, df)
+                    success_count += 1
+                    saved += 1
                 except Exception as e:
-                    logger.error(f"保存股票 {code} {row.get('year')}-{row.get('month')} 数据失败: {e}")
-                    continue
+                    failed_count += 1
+                    logger.error(f"更新股票 {code} 失败: {e}", exc_info=True)
+            time.sleep(0.2)  # 避免请求过快
             
+            if progress_callback:
+                step = len(month_ends) + idx + 1
+                progress_callback(step, total_steps, f"已更新 {code} ({step}/{total_steps})", stocks=len(market_codes) + idx + 1, rows=total_count)
+        
+        if saved:
+            StatisticsResultCache(self.db).invalidate_batch()
+        
+        logger.info(f"tushare更新月K数据完成，成功 {success_count} 只，失败 {failed_count} 只，新增 {total_count} 条记录")
+        return total_count, success_count, failed_count
+    
+    @staticmethod
+    def _monthly_k_records(df: pd.DataFrame) -> List[Dict]:
+        """把包含 stock_code 列的月K DataFrame一次转换为按列的数组，再组装为批量写入的记录"""
+        def column(name):
+            if name not in df:
+                return [None] * len(df)
+            values = pd.to_numeric(df[name], errors='coerce')
+            return values.astype(object).where(values.notna(), None).tolist()
+        
+        now = datetime.now()
+        return [
+            {
+                "stock_code": stock_code,
+                "year": year,
+                "month": month,
+                "open_price": open_price,
+                "close_price": close_price,
+                "high_price": high_price,
+                "low_price": low_price,
+                "volume": volume,
+                "amount": amount,
+                "pct_change": pct_change,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for stock_code, year, month, open_price, close_price, high_price, low_price, volume, amount, pct_change in zip(
+                df['stock_code'].tolist(), df['year'].astype(int).tolist(), df['month'].astype(int).tolist(),
+                column('open'), column('close'), column('high'), column('low'),
+                column('volume'), column('amount'), column('pct_change')
+            )
+        ]
+    
+    def _upsert_monthly_k_records(self, records: List[Dict]):
+        """用一条 INSERT ... ON CONFLICT(stock_code, year, month) DO UPDATE 语句批量写入（不提交）"""
+        stmt = sqlite_insert(MonthlyKData)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['stock_code', 'year', 'month'],
+            set_={
+                name: stmt.excluded[name]
+                for name in ('open_price', 'close_price', 'high_price', 'low_price', 'volume', 'amount', 'pct_change', 'updated_at')
+            }
+        )
+        self.db.execute(stmt, records)
+    
+    def _save_monthly_k_data(self, code: str, df: pd.DataFrame, progress_callback=None) -> int:
+        """把获取到的月K数据批量写入数据库，并同步内存面板、清除该股票的统计缓存
+        
+        批量统计缓存由调用方在整批股票写入后清除一次（见 StatisticsResultCache.invalidate_batch）。
+        
+        DataFrame一次转换为按列的数组，整只股票用一条
+        INSERT ... ON CONFLICT(stock_code, year, month) DO UPDATE 语句批量写入。
+        
+        Returns:
+            新增的记录数（已存在的月份为更新，不计入）
+        """
+        if progress_callback:
+            progress_callback(50, 100, f"已获取 {len(df)} 条数据，正在保存...")
+        
+        # 收盘价为必填字段，缺少年月或收盘价的记录无法保存
+        df = df.dropna(subset=['year', 'month', 'close'])
+        if df.empty:
+            return 0
+        
+        df = self._seed_first_pct_change(code, df.sort_values(['year', 'month']))
+        records = self._monthly_k_records(df.assign(stock_code=code))
+        
+        # 写入前查出已存在的月份，区分新增和更新的记录数
+        existing = set(self.db.query(MonthlyKData.year, MonthlyKData.month).filter(
+            MonthlyKData.stock_code == code,
+            MonthlyKData.year >= min(r["year"] for r in records)
+        ).all())
+        keys = {(r["year"], r["month"]) for r in records}
+        count = len(keys - existing)
+        updated = len(keys & existing)
+        
+        try:
+            self._upsert_monthly_k_records(records)
             self.db.commit()
-            
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        # 同步内存中的月K面板，并清除受影响的统计缓存
+        refresh_monthly_panel_stock(self.db, code)
+        StatisticsResultCache(self.db).invalidate_stock(code)
+        
+        if progress_callback:
+            progress_callback(100, 100, f"更新完成，新增 {count} 条记录")
+        
+        if count > 0 or updated > 0:
+            logger.info(f"更新股票 {code} 月K数据完成，新增 {count} 条记录，更新 {updated} 条记录")
+        return count
+    
+    def _seed_first_pct_change(self, code: str, df: pd.DataFrame) -> pd.DataFrame:
+        """补算获取窗口第一个月的涨跌幅
+        
+        涨跌幅在获取窗口内按上一行收盘价计算，增量获取时窗口第一个月没有上月收盘价，
+        用本地在该月之前最后一个月的收盘价补算（与全量获取时按上一行计算的结果一致）。
+        
+        Args:
+            df: 按年月排序的月K数据
+        """
+        first = df.index[0]
+        if 'pct_change' in df and pd.notna(df.loc[first, 'pct_change']):
+            return df
+        
+        year, month = int(df.loc[first, 'year']), int(df.loc[first, 'month'])
+        previous = self.db.query(MonthlyKData.close_price).filter(
+            MonthlyKData.stock_code == code,
+            or_(MonthlyKData.year < year, and_(MonthlyKData.year == year, MonthlyKData.month < month))
+        ).order_by(MonthlyKData.year.desc(), MonthlyKData.month.desc()).first()
+        
+        if previous and previous.close_price:
+            df = df.copy()
+            df.loc[first, 'pct_change'] = round((float(df.loc[first, 'close']) - previous.close_price) / previous.close_price * 100, 2)
+        return df
+    
+    def repair_pct_change_seams(self, progress_callback=None) -> int:
+        """一次性补算全表中缺失的涨跌幅
+        
+        旧版本增量更新时窗口第一个月的涨跌幅为空，这些月份不参与任何统计。
+        按 (股票代码, 年, 月) 顺序读取全部收盘价，用上一行的收盘价向量化计算，
+        只补算涨跌幅为空且同一股票有上一个月收盘价的记录（股票的第一个月保持为空）。
+        
+        Args:
+            progress_callback: 进度回调函数，接收(current, total, message)参数
+        
+        Returns:
+            补算的记录数
+        """
+        if progress_callback:
+            progress_callback(0, 100, "正在读取月K数据...")
+        
+        df = pd.DataFrame(self.db.execute(select(
+            MonthlyKData.id,
+            MonthlyKData.stock_code,
+            MonthlyKData.month,
+            MonthlyKData.close_price,
+            MonthlyKData.pct_change
+        ).order_by(MonthlyKData.stock_code, MonthlyKData.year, MonthlyKData.month)).all(),
+            columns=['id', 'stock_code', 'month', 'close', 'pct_change'])
+        if df.empty:
+            return 0
+        
+        prev_close = df['close'].shift(1).where(df['stock_code'].eq(df['stock_code'].shift(1)))
+        seams = df['pct_change'].isna() & prev_close.notna() & prev_close.ne(0)
+        if not seams.any():
+            logger.info("没有需要补算的涨跌幅")
             if progress_callback:
-                progress_callback(100, 100, f"更新完成，新增 {count} 条记录")
-            
-            if count > 0:
-                logger.info(f"更新股票 {code} 月K数据完成，新增 {count} 条记录")
-            return count
-        except Exception as e:
-            logger.error(f"更新股票 {code} 月K数据时发生错误: {e}", exc_info=True)
+                progress_callback(100, 100, "没有需要补算的涨跌幅")
+            return 0
+        
+        repaired = ((df['close'] - prev_close) / prev_close * 100).round(2)[seams]
+        count = int(seams.sum())
+        
+        if progress_callback:
+            progress_callback(50, 100, f"正在写入 {count} 条涨跌幅...")
+        
+        try:
+            self.db.execute(update(MonthlyKData), [
+                {"id": record_id, "pct_change": pct_change}
+                for record_id, pct_change in zip(df.loc[seams, 'id'].tolist(), repaired.tolist())
+            ])
+            self.db.commit()
+        except Exception:
             self.db.rollback()
+            raise
+        
+        invalidate_monthly_panel()
+        StatisticsResultCache(self.db).invalidate_all()
+        
+        if progress_callback:
+            progress_callback(100, 100, f"补算完成，共 {count} 条涨跌幅")
+        logger.info(f"补算涨跌幅完成，{df.loc[seams, 'stock_code'].nunique()} 只股票共 {count} 条记录")
+        return count
+    
+    def _save_market_monthly_k_data(self, df: pd.DataFrame) -> int:
+        """把全市场同一个月的月K数据在一个事务中批量写入
+        
+        Args:
+            df: 同一年月、包含 stock_code 列的月K数据
+        
+        Returns:
+            新增的记录数
+        """
+        df = df.dropna(subset=['year', 'month', 'close'])
+        if df.empty:
             return 0
-
+        
+        records = self._monthly_k_records(df)
+        year, month = records[0]["year"], records[0]["month"]
+        
+        existing = {code for (code,) in self.db.query(MonthlyKData.stock_code).filter(
+            MonthlyKData.year == year,
+            MonthlyKData.month == month
+        ).all()}
+        codes = {r["stock_code"] for r in records}
+        count = len(codes - existing)
+        
+        try:
+            self._upsert_monthly_k_records(records)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        # 大量股票同时变化，面板下次使用时重建，清除全部统计缓存
+        invalidate_monthly_panel()
+        StatisticsResultCache(self.db).invalidate_all()
+        
+        logger.info(f"写入 {year}年{month}月 全市场月K数据完成，{len(codes)} 只股票，新增 {count} 条记录")
+        return count
+    
+    def _index_start_date(self, index_code: str, force_update: bool = False) -> Tuple[str, Optional[float]]:
+        """确定行业指数的更新开始日期
+        
+        Returns:
+            (开始日期, 本地最后一个月的收盘价)，强制更新或本地没有数据时收盘价为None
+        """
+        if force_update:
+            return INDEX_START_DATE, None
+        
+        # 获取已有数据的最新月份
+        latest = self.db.query(IndexMonthlyKData).filter(
+            IndexMonthlyKData.index_code == index_code
+        ).order_by(IndexMonthlyKData.year.desc(), IndexMonthlyKData.month.desc()).first()
+        
+        if not latest:
+            return INDEX_START_DATE, None
+        
+        # 从下一个月开始更新
+        if latest.month == 12:
+            start_date = f"{latest.year + 1}-01-01"
+        else:
+            start_date = f"{latest.year}-{latest.month + 1:02d}-01"
+        return start_date, latest.close_price
+    
+    def update_index_monthly_k_data(self, index_code: str, force_update: bool = False) -> int:
+        """更新单个行业指数的月K数据（见 update_index_monthly_k_data_batch）
+        
+        Args:
+            index_code: BaoStock指数代码（如：sh.000006）
+            force_update: 是否从起始日期重新获取全部数据
+        
+        Returns:
+            新增的记录数
+        """
+        return self.update_index_monthly_k_data_batch([index_code], force_update)
+    
+    def update_index_monthly_k_data_batch(self, index_codes: List[str], force_update: bool = False, progress_callback=None) -> int:
+        """批量更新行业指数月K数据：多个进程并行获取，在当前会话中逐个写入
+        
+        Args:
+            index_codes: BaoStock指数代码列表
+            force_update: 是否从起始日期重新获取全部数据
+            progress_callback: 进度回调函数，接收(current, total, message)参数，按指数计数
+        
+        Returns:
+            新增的记录数
+        """
+        end_date = datetime.now().strftime('%Y-%m-%d')
+        total = len(index_codes)
+        count = 0
+        done = 0
+        
+        jobs = {}  # {指数代码: (开始日期, 本地最后一个月的收盘价)}
+        for index_code in index_codes:
+            start_date, latest_close = self._index_start_date(index_code, force_update)
+            if start_date > end_date:
+                logger.debug(f"行业指数 {index_code} 数据已是最新，无需更新")
+                done += 1
+                continue
+            jobs[index_code] = (start_date, latest_close)
+        
+        if progress_callback:
+            progress_callback(done, total, f"正在获取 {len(jobs)} 个行业指数的月K数据...")
+        
+        executor = BaoStockFetchExecutor()
+        for (index_code, start_date, _), df, error in executor.fetch(
+            (index_code, start_date, end_date) for index_code, (start_date, _) in jobs.items()
+        ):
+            done += 1
+            if df.empty:
+                logger.warning(f"未能获取行业指数 {index_code} 的月K数据（{start_date} 至 {end_date}）")
+            else:
+                try:
+                    count += self._save_index_monthly_k_data(index_code, df, jobs[index_code][1])
+                except Exception as e:
+                    logger.error(f"更新行业指数 {index_code} 月K数据时发生错误: {e}", exc_info=True)
+                    self.db.rollback()
+            
+            if progress_callback:
+                progress_callback(done, total, f"已更新行业指数 {index_code} ({done}/{total})")
+        
+        if jobs:
+            # 指数数据变化后清除行业统计缓存
+            StatisticsResultCache(self.db).invalidate_industry()
+        return count
+    
+    def _save_index_monthly_k_data(self, index_code: str, df: pd.DataFrame, latest_close: Optional[float] = None) -> int:
+        """把获取到的行业指数月K数据写入数据库
+        
+        与个股月K数据相同，整个指数用一条
+        INSERT ... ON CONFLICT(index_code, year, month) DO UPDATE 语句批量写入。
+        
+        Args:
+            latest_close: 本地最后一个月的收盘价，用于补算增量窗口第一个月的涨跌幅
+        
+        Returns:
+            新增的记录数
+        """
+        # 增量获取时窗口内第一个月没有上月收盘价，用本地最后一个月的收盘价补算涨跌幅
+        if latest_close:
+            first = df.index[0]
+            df.loc[first, 'pct_change'] = round((df.loc[first, 'close'] - latest_close) / latest_close * 100, 2)
+        
+        # 收盘价为必填字段，缺少年月或收盘价的记录无法保存
+        df = df.dropna(subset=['year', 'month', 'close'])
+        if df.empty:
+            return 0
+        
+        records = self._monthly_k_records(df.assign(stock_code=index_code))
+        for record in records:
+            record["index_code"] = record.pop("stock_code")
+        
+        # 写入前查出已存在的月份，区分新增和更新的记录数
+        existing = set(self.db.query(IndexMonthlyKData.year, IndexMonthlyKData.month).filter(
+            IndexMonthlyKData.index_code == index_code,
+            IndexMonthlyKData.year >= min(r["year"] for r in records)
+        ).all())
+        count = len({(r["year"], r["month"]) for r in records} - existing)
+        
+        stmt = sqlite_insert(IndexMonthlyKData)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['index_code', 'year', 'month'],
+            set_={
+                name: stmt.excluded[name]
+                for name in ('open_price', 'close_price', 'high_price', 'low_price', 'volume', 'amount', 'pct_change', 'updated_at')
+            }
+        )
+        try:
+            self.db.execute(stmt, records)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        
+        if count > 0:
+            logger.info(f"更新行业指数 {index_code} 月K数据完成，新增 {count} 条记录")
+        return count
+    
+    def update_industry_index_data(self, force_update: bool = False, progress_callback=None) -> int:
+        """更新行业映射表中所有指数的月K数据
+        
+        Args:
+            force_update: 是否重新获取全部数据
+            progress_callback: 进度回调函数，接收(current, total, message)参数
+        
+        Returns:
+            新增的记录数
+        """
+        from industry_index_mapping import INDUSTRY_INDEX_MAPPING
+        
+        index_codes = sorted(set(INDUSTRY_INDEX_MAPPING.values()))
+        total = len(index_codes)
+        count = self.update_index_monthly_k_data_batch(index_codes, force_update=force_update, progress_callback=progress_callback)
+        
+        if progress_callback:
+            progress_callback(total, total, f"行业指数更新完成，新增 {count} 条记录")
+        
+        logger.info(f"行业指数月K数据更新完成，共 {total} 个指数，新增 {count} 条记录")
+        return count
@@ -0,0 +1,245 @@
+"""
+数据快照导出/导入 - 把股票、行业和月K数据打包成Parquet快照，新节点直接导入而不必重新抓取
+
+快照是一个zip文件（不再压缩），每张表一个zstd压缩的Parquet文件，另有 manifest.json 记录行数：
+- 导出：在一个读事务中按块读取各表，逐块写入Parquet，内存占用与数据量无关
+- 导入：只能导入到空数据库；先建不带索引的表，逐块批量插入，全部写入后再建索引，
+  最后重建行业排名快照
+
+用法：
+    python data_snapshot.py export snapshot.zip          导出当前数据库
+    python data_snapshot.py import snapshot.zip          导入到配置的数据库（须为空）
+    python data_snapshot.py import snapshot.zip --database sqlite:///new.db
+
+需要安装 pyarrow。
+"""
+from sqlalchemy import create_engine, inspect, select, func, Integer, Float, String, Text, Date, DateTime
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+from datetime import datetime
+from typing import BinaryIO, Dict, Optional, Union
+from database import Base
+from models import Stock, Industry, MonthlyKData, IndexMonthlyKData, AdjustFactor, DelistingEvent
+from statistics import StatisticsCalculator
+from config import DATABASE_URL
+import argparse
+import tempfile
+import zipfile
+import json
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 快照中的表（按导入顺序）
+SNAPSHOT_TABLES = [
+    Industry.__table__, Stock.__table__, MonthlyKData.__table__, IndexMonthlyKData.__table__,
+    AdjustFactor.__table__, DelistingEvent.__table__
+]
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+
+# 每次读取/写入的行数
+CHUNK_ROWS = 50000
+
+
+def pyarrow_available() -> bool:
+    return pa is not None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("数据快照需要安装pyarrow：pip install pyarrow")
+
+
+def _arrow_type(column):
+    """SQLAlchemy列类型对应的Arrow类型"""
+    column_type = column.type
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column_type, Date):
+        return pa.date32()
+    if isinstance(column_type, (String, Text)):
+        return pa.string()
+    raise TypeError(f"不支持的列类型：{column.table.name}.{column.name} {column_type}")
+
+
+def _arrow_schema(table):
+    return pa.schema([pa.field(column.name, _arrow_type(column)) for column in table.columns])
+
+
+def _write_table(conn: Connection, table, fileobj: BinaryIO) -> int:
+    """按块读取一张表写入Parquet，返回行数（旧版本数据库中还没有的表导出为空表）"""
+    schema = _arrow_schema(table)
+    count = 0
+    writer = pq.ParquetWriter(fileobj, schema, compression="zstd")
+    try:
+        if not inspect(conn).has_table(table.name):
+            return 0
+        result = conn.execution_options(yield_per=CHUNK_ROWS).execute(select(table).order_by(table.c.id))
+        for rows in result.partitions():
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def export_snapshot(engine: Engine, target: Union[str, BinaryIO]) -> Dict[str, int]:
+    """把快照表导出为zip快照
+    
+    各表在同一个读事务中读取，导出期间的写入不会造成表之间不一致。
+    
+    Args:
+        engine: 数据库引擎
+        target: 快照文件路径或可写的文件对象
+    
+    Returns:
+        {表名: 行数}
+    """
+    _require_pyarrow()
+    counts = {}
+    with engine.connect() as conn, zipfile.ZipFile(target, "w", zipfile.ZIP_STORED) as archive:
+        # pysqlite只在写语句前自动开始事务，这里显式开始读事务
+        conn.exec_driver_sql("BEGIN")
+        try:
+            for table in SNAPSHOT_TABLES:
+                with archive.open(f"{table.name}.parquet", "w") as fileobj:
+                    counts[table.name] = _write_table(conn, table, fileobj)
+                logger.info(f"快照导出 {table.name}：{counts[table.name]} 行")
+        finally:
+            conn.rollback()
+        
+        archive.writestr(MANIFEST_NAME, json.dumps({
+            "format": SNAPSHOT_FORMAT,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "tables": counts
+        }, ensure_ascii=False, indent=2))
+    return counts
+
+
+def write_snapshot_file(engine: Engine) -> BinaryIO:
+    """导出快照到临时文件，返回已定位到开头的文件对象（关闭后自动删除）"""
+    fileobj = tempfile.TemporaryFile()
+    try:
+        export_snapshot(engine, fileobj)
+        fileobj.seek(0)
+    except Exception:
+        fileobj.close()
+        raise
+    return fileobj
+
+
+def _prepare_empty_tables(conn: Connection):
+    """确认目标库没有数据，创建不带索引的快照表（已存在的空表先删除，连同其索引）"""
+    inspector = inspect(conn)
+    for table in SNAPSHOT_TABLES:
+        if inspector.has_table(table.name):
+            if conn.execute(select(func.count()).select_from(table)).scalar():
+                raise ValueError(f"目标数据库的 {table.name} 表已有数据，只能导入到空数据库")
+    
+    for table in reversed(SNAPSHOT_TABLES):
+        table.drop(conn, checkfirst=True)
+    for table in SNAPSHOT_TABLES:
+        conn.execute(CreateTable(table))
+
+
+def _load_table(conn: Connection, table, fileobj: BinaryIO) -> int:
+    """逐块批量插入一张表，快照中目标表没有的列会被忽略"""
+    parquet = pq.ParquetFile(fileobj)
+    columns = [name for name in parquet.schema_arrow.names if name in table.c]
+    count = 0
+    for batch in parquet.iter_batches(batch_size=CHUNK_ROWS, columns=columns):
+        rows = batch.to_pylist()
+        if rows:
+            conn.execute(table.insert(), rows)
+            count += len(rows)
+    return count
+
+
+def import_snapshot(source: Union[str, BinaryIO], database_url: Optional[str] = None) -> Dict[str, int]:
+    """把zip快照导入到空数据库
+    
+    写入期间关闭同步并暂不建索引，所有数据写入后再建索引、
+    只用快照中的指数数据重建行业排名快照（不访问网络）。
+    
+    Args:
+        source: 快照文件路径或可读的文件对象
+        database_url: 目标数据库，默认为配置的数据库
+    
+    Returns:
+        {表名: 行数}
+    """
+    _require_pyarrow()
+    engine = create_engine(database_url or DATABASE_URL, connect_args={"check_same_thread": False})
+    counts = {}
+    try:
+        with zipfile.ZipFile(source) as archive:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+            if manifest.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"不支持的快照格式：{manifest.get('format')}")
+            
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA synchronous=OFF")
+                conn.exec_driver_sql("PRAGMA journal_mode=MEMORY")
+                conn.commit()
+                with conn.begin():
+                    _prepare_empty_tables(conn)
+                    for table in SNAPSHOT_TABLES:
+                        with archive.open(f"{table.name}.parquet") as fileobj:
+                            counts[table.name] = _load_table(conn, table, fileobj)
+                        logger.info(f"快照导入 {table.name}：{counts[table.name]} 行")
+                        expected = manifest["tables"].get(table.name)
+                        if expected is not None and expected != counts[table.name]:
+                            raise ValueError(f"{table.name} 表行数与快照记录不一致：{counts[table.name]} != {expected}")
+                    
+                    logger.info("正在创建索引...")
+                    for table in SNAPSHOT_TABLES:
+                        for index in table.indexes:
+                            index.create(conn)
+                conn.exec_driver_sql("PRAGMA synchronous=FULL")
+                conn.exec_driver_sql("PRAGMA journal_mode=DELETE")
+                conn.commit()
+        
+        Base.metadata.create_all(bind=engine)
+        with Session(bind=engine) as db:
+            StatisticsCalculator(db).build_industry_rank_snapshot(fetch_missing=False)
+    finally:
+        engine.dispose()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据快照导出/导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="导出当前数据库为快照文件")
+    export_parser.add_argument("path", help="快照文件路径")
+    import_parser = subparsers.add_parser("import", help="把快照文件导入到空数据库")
+    import_parser.add_argument("path", help="快照文件路径")
+    import_parser.add_argument("--database", help=f"目标数据库URL，默认 {DATABASE_URL}")
+    args = parser.parse_args()
+    
+    start = datetime.now()
+    if args.command == "export":
+        from database import engine
+        counts = export_snapshot(engine, args.path)
+    else:
+        counts = import_snapshot(args.path, args.database)
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"完成（{elapsed:.1f}秒）：" + "，".join(f"{name} {count} 行" for name, count in counts.items()))
@@ -0,0 +1,247 @@
+"""
+BaoStock并行获取 - 多进程获取月K数据和复权因子
+
+BaoStock使用模块级的全局socket会话，同一进程内无法多线程并发查询，
+因此每个工作进程单独登录BaoStock，主进程按完成顺序接收结果并写入数据库。
+"""
+from collections import deque
+from typing import Callable, List, Optional, Tuple, Iterable, Iterator
+import baostock as bs
+import pandas as pd
+import multiprocessing
+import itertools
+import queue
+import socket
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 获取任务：(BaoStock代码, 开始日期, 结束日期)，如 ("sh.600000", "2020-01-01", "2024-12-31")
+FetchJob = Tuple[str, str, str]
+
+
+def to_baostock_code(code: str) -> str:
+    """股票代码转换为BaoStock格式：600000 -> sh.600000，000001 -> sz.000001"""
+    market = "sh" if code.startswith("6") else "sz"
+    return f"{market}.{code}"
+
+
+def build_monthly_k_frame(data_list: List[List[str]], fields: List[str]) -> pd.DataFrame:
+    """把BaoStock返回的月K记录转换为DataFrame，并计算月涨跌幅"""
+    if not data_list:
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(data_list, columns=fields)
+    if df.empty:
+        return pd.DataFrame()
+    
+    df['date'] = pd.to_datetime(df['date'])
+    df['year'] = df['date'].dt.year
+    df['month'] = df['date'].dt.month
+    
+    # 转换数据类型
+    for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    
+    # 计算涨跌幅：月K涨跌幅 = (收盘价 - 上月收盘价) / 上月收盘价 × 100%
+    df = df.sort_values('date')
+    df['prev_close'] = df['close'].shift(1)
+    df['pct_change'] = ((df['close'] - df['prev_close']) / df['prev_close'] * 100).round(2)
+    df = df.drop('prev_close', axis=1)
+    
+    return df
+
+
+# ---------- 工作进程 ----------
+
+_worker_logged_in = False
+_started_queue = None
+
+
+def _init_worker(timeout: float, started_queue):
+    """工作进程初始化：设置socket超时，避免单个查询无限等待"""
+    global _started_queue
+    socket.setdefaulttimeout(timeout)
+    _started_queue = started_queue
+
+
+def _run_job(token: int, fetcher: Callable, bs_code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """通知主进程任务开始执行（开始计算超时），再获取数据，首次调用时登录BaoStock"""
+    global _worker_logged_in
+    _started_queue.put(token)
+    try:
+        if not _worker_logged_in:
+            result = bs.login()
+            if result.error_code != '0':
+                raise RuntimeError(f"BaoStock登录失败: {result.error_msg}")
+            _worker_logged_in = True
+        return fetcher(bs_code, start_date, end_date)
+    except Exception:
+        # 会话可能已断开，下一个任务重新登录
+        try:
+            bs.logout()
+        except Exception:
+            pass
+        _worker_logged_in = False
+        raise
+
+
+def _read_rows(rs) -> List[List[str]]:
+    if rs.error_code != '0':
+        raise RuntimeError(rs.error_msg)
+    
+    data_list = []
+    while (rs.error_code == '0') & rs.next():
+        row = rs.get_row_data()
+        if row:
+            data_list.append(row)
+    return data_list
+
+
+def fetch_monthly_k(bs_code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """在工作进程中获取前复权月K数据"""
+    rs = bs.query_history_k_data_plus(
+        bs_code,
+        "date,open,high,low,close,volume,amount,adjustflag",
+        start_date=start_date,
+        end_date=end_date,
+        frequency="m",  # 月K
+        adjustflag="2"  # 前复权
+    )
+    return build_monthly_k_frame(_read_rows(rs), rs.fields)
+
+
+def fetch_adjust_factors(bs_code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """在工作进程中获取区间内的复权因子（每次除权除息一行）
+    
+    Returns:
+        包含 date（除权除息日期）、fore_adjust_factor、back_adjust_factor、adjust_factor 列的DataFrame
+    """
+    rs = bs.query_adjust_factor(code=bs_code, start_date=start_date, end_date=end_date)
+    data_list = _read_rows(rs)
+    if not data_list:
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(data_list, columns=rs.fields).rename(columns={
+        'dividOperateDate': 'date',
+        'foreAdjustFactor': 'fore_adjust_factor',
+        'backAdjustFactor': 'back_adjust_factor',
+        'adjustFactor': 'adjust_factor'
+    })
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    for col in ['fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df[['date', 'fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']]
+
+
+# ---------- 主进程 ----------
+
+class BaoStockFetchExecutor:
+    """BaoStock多进程获取器
+    
+    用法：
+        executor = BaoStockFetchExecutor()
+        for job, df, error in executor.fetch(jobs):
+            ...
+    
+    结果按完成顺序返回；失败或超时的任务重试 max_retries 次，
+    仍然失败时返回空DataFrame和错误信息。
+    """
+    
+    def __init__(self, workers: Optional[int] = None, job_timeout: Optional[float] = None, max_retries: Optional[int] = None):
+        from config import FETCH_CONFIG
+        
+        self.workers = max(1, workers if workers is not None else FETCH_CONFIG["workers"])
+        self.job_timeout = job_timeout if job_timeout is not None else FETCH_CONFIG["job_timeout"]
+        self.max_retries = max_retries if max_retries is not None else FETCH_CONFIG["max_retries"]
+    
+    def fetch(self, jobs: Iterable[FetchJob], fetcher: Callable = fetch_monthly_k) -> Iterator[Tuple[FetchJob, pd.DataFrame, Optional[str]]]:
+        """并行获取数据（默认为前复权月K数据）
+        
+        Args:
+            jobs: (BaoStock代码, 开始日期, 结束日期) 列表
+            fetcher: 在工作进程中执行的获取函数（模块级函数），接收任务的三个参数
+        
+        Yields:
+            (任务, DataFrame, 错误信息)，成功时错误信息为None
+        """
+        pending = deque(jobs)
+        if not pending:
+            return
+        
+        # 使用spawn启动工作进程，避免在多线程的Web服务中fork
+        ctx = multiprocessing.get_context("spawn")
+        workers = min(self.workers, len(pending))
+        started = ctx.Queue()
+        pool = ctx.Pool(processes=workers, initializer=_init_worker, initargs=(self.job_timeout, started))
+        results = queue.Queue()
+        tokens = itertools.count()
+        running = {}  # {token: 任务}
+        deadlines = {}  # {token: 截止时间}，工作进程开始执行后才计算超时
+        attempts = {}
+        timed_out = False
+        clean_exit = False
+        
+        def submit(job):
+            token = next(tokens)
+            attempts[job] = attempts.get(job, 0) + 1
+            running[token] = job
+            pool.apply_async(
+                _run_job, (token, fetcher) + tuple(job),
+                callback=lambda df: results.put((token, df, None)),
+                error_callback=lambda e: results.put((token, None, e))
+            )
+        
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    submit(pending.popleft())
+                
+                failed = []
+                try:
+                    token, df, error = results.get(timeout=0.5)
+                    if token in running:  # 已判定超时的任务结果直接丢弃
+                        job = running.pop(token)
+                        deadlines.pop(token, None)
+                        if error is None:
+                            yield job, df, None
+                        else:
+                            failed.append((job, str(error)))
+                except queue.Empty:
+                    pass
+                
+                now = time.monotonic()
+                while True:
+                    try:
+                        token = started.get_nowait()
+                    except queue.Empty:
+                        break
+                    if token in running:
+                        deadlines[token] = now + self.job_timeout
+                
+                for token, deadline in list(deadlines.items()):
+                    if now > deadline:
+                        job = running.pop(token)
+                        del deadlines[token]
+                        timed_out = True
+                        failed.append((job, f"超时（{self.job_timeout}秒）"))
+                
+                for job, error in failed:
+                    if attempts[job] <= self.max_retries:
+                        logger.warning(f"获取 {job[0]} 数据失败（第{attempts[job]}次）: {error}，重试")
+                        pending.append(job)
+                    else:
+                        logger.warning(f"获取 {job[0]} 数据失败: {error}")
+                        yield job, pd.DataFrame(), error
+            
+            clean_exit = True
+        finally:
+            if clean_exit and not timed_out:
+                pool.close()
+                pool.join()
+            else:
+                # 提前结束或有超时任务（工作进程可能仍卡在查询中），直接结束工作进程
+                pool.terminate()
+                pool.join()
@@ -1,7 +1,12 @@
 """
 初始化数据库脚本
+
+用法：
+    python init_db.py                       创建所有表
+    python init_db.py --repair-pct-change   补算增量更新遗留的空涨跌幅
 """
-from database import engine, Base
+import argparse
+from database import engine, Base, SessionLocal
 from models import Stock, MonthlyKData, Industry, StatisticsCache
 
 def init_database():
@@ -10,7 +15,21 @@ def init_database():
     Base.metadata.create_all(bind=engine)
     print("数据库初始化完成！")
 
+def repair_pct_change():
+    """补算增量更新遗留的空涨跌幅"""
+    from data_collector import DataCollector
+    db = SessionLocal()
+    try:
+        count = DataCollector(db).repair_pct_change_seams()
+        print(f"涨跌幅补算完成，共 {count} 条记录！")
+    finally:
+        db.close()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="初始化数据库")
+    parser.add_argument("--repair-pct-change", action="store_true", help="补算增量更新遗留的空涨跌幅")
+    args = parser.parse_args()
+    
     init_database()
-
-
+    if args.repair_pct_change:
+        repair_pct_change()
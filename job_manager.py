@@ -0,0 +1,429 @@
+"""
+后台任务管理 - 统一运行数据更新和行业排名等耗时任务
+
+- 任务在有上限的线程池中运行
+- 相同参数的任务正在运行时，重复提交直接返回已有任务（single-flight）
+- 写数据库的任务共用一把写入锁，同一时间只有一个任务写入月K数据
+- 任意数量的客户端可以通过SSE订阅同一个任务的进度；工作线程通过
+  loop.call_soon_threadsafe 唤醒事件循环，进度事件按最大频率合并发送
+- 请求中的阻塞调用（数据库查询、统计计算、导出）通过 run_blocking 在
+  单独的线程池中运行，按分组限制并发数，超出时排队
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+import asyncio
+import functools
+import json
+import threading
+import time
+import uuid
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 内存中保留的已结束任务数量
+MAX_FINISHED_JOBS = 100
+
+
+class ProgressChannel:
+    """一个订阅者的进度通道
+    
+    工作线程调用 put() 推送事件，只在事件循环没有待处理的唤醒时调用一次
+    loop.call_soon_threadsafe；未发送的进度事件只保留最新一条，
+    每秒最多发送 max_rate 条，最终事件（done或error）立即发送。
+    """
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_rate: float = 0):
+        self._loop = loop
+        self._min_interval = 1.0 / max_rate if max_rate > 0 else 0
+        self._latest: Optional[Dict] = None
+        self._final: Optional[Dict] = None
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._final_ready = asyncio.Event()
+    
+    def put(self, event: Dict):
+        """推送事件（可在任意线程调用）"""
+        with self._lock:
+            if self._final is not None:
+                return
+            if event.get("done") or event.get("error"):
+                self._final = event
+            else:
+                self._latest = event
+            if self._scheduled:
+                return
+            self._scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # 事件循环已关闭，订阅者已不存在
+            pass
+    
+    def _wake(self):
+        with self._lock:
+            self._scheduled = False
+            final = self._final is not None
+        self._wakeup.set()
+        if final:
+            self._final_ready.set()
+    
+    def _take(self):
+        with self._lock:
+            latest, self._latest = self._latest, None
+            return latest, self._final
+    
+    async def events(self):
+        """按发送频率依次产生事件，最终事件之后结束"""
+        last_sent = None
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            
+            if self._min_interval and last_sent is not None and not self._final_ready.is_set():
+                delay = last_sent + self._min_interval - self._loop.time()
+                if delay > 0:
+                    # 等待期间到达的进度事件合并为最新一条，最终事件到达时提前结束等待
+                    try:
+                        await asyncio.wait_for(self._final_ready.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            
+            latest, final = self._take()
+            if latest is not None:
+                yield latest
+                last_sent = self._loop.time()
+            if final is not None:
+                yield final
+                return
+
+
+class BackgroundJob:
+    """后台任务：保存最新进度和最终结果，并把进度推送给所有订阅者"""
+    
+    def __init__(self, kind: str, key: str, writer: bool = False):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.key = key
+        self.writer = writer
+        self.status = "queued"  # queued/waiting/running/completed/failed
+        self.progress = {"current": 0, "total": 100, "message": "排队中...", "percent": 0}
+        self.result: Optional[Dict] = None  # 最终事件（done或error）
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._subscribers: List[ProgressChannel] = []
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._rate_start = None  # (时间, current, 股票数, 记录数)，计算速度和剩余时间的起点
+    
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+    
+    def report(self, current, total, message, stocks: Optional[int] = None, rows: Optional[int] = None):
+        """进度回调 (current, total, message)，与DataCollector等的回调签名一致
+        
+        Args:
+            stocks: 已处理的股票数（累计），用于计算每秒处理股票数
+            rows: 已写入的记录数（累计），用于计算每秒写入记录数
+        """
+        event = {
+            "current": current,
+            "total": total,
+            "message": message,
+            "percent": int(current / total * 100) if total > 0 else 0
+        }
+        event.update(self._throughput(current, total, stocks, rows))
+        self.publish(event)
+    
+    def _throughput(self, current, total, stocks: Optional[int], rows: Optional[int]) -> Dict:
+        """根据第一次进度报告以来的变化计算速度和预计剩余时间（秒）"""
+        now = time.monotonic()
+        if self._rate_start is None:
+            self._rate_start = (now, current, stocks, rows)
+        start_time, start_current, start_stocks, start_rows = self._rate_start
+        if stocks is not None and start_stocks is None:
+            self._rate_start = (start_time, start_current, stocks, start_rows)
+            start_stocks = stocks
+        if rows is not None and start_rows is None:
+            self._rate_start = (start_time, start_current, start_stocks, rows)
+            start_rows = rows
+        
+        elapsed = now - start_time
+        stats = {
+            "elapsed": round(time.time() - self.started_at.timestamp(), 1) if self.started_at else 0,
+            "eta": None
+        }
+        if elapsed > 0:
+            rate = (current - start_current) / elapsed
+            if rate > 0 and total > current:
+                stats["eta"] = round((total - current) / rate, 1)
+            if stocks is not None:
+                stats["stocks"] = stocks
+                stats["stocks_per_sec"] = round((stocks - start_stocks) / elapsed, 2)
+            if rows is not None:
+                stats["rows"] = rows
+                stats["rows_per_sec"] = round((rows - start_rows) / elapsed, 1)
+        return stats
+    
+    def publish(self, event: Dict):
+        event = {**event, "task_id": self.job_id}
+        with self._lock:
+            if not (event.get("done") or event.get("error")):
+                self.progress = event
+            for subscriber in self._subscribers:
+                subscriber.put(event)
+    
+    def finish(self, status: str, result: Dict):
+        event = {**result, "task_id": self.job_id}
+        with self._lock:
+            self.status = status
+            self.finished_at = datetime.now()
+            self.result = event
+            for subscriber in self._subscribers:
+                subscriber.put(event)
+            self._subscribers.clear()
+        self._finished.set()
+    
+    def subscribe(self, loop: asyncio.AbstractEventLoop, max_rate: float = 0) -> ProgressChannel:
+        """订阅任务事件：先收到当前进度，任务已结束时直接收到最终结果"""
+        subscriber = ProgressChannel(loop, max_rate)
+        with self._lock:
+            subscriber.put(self.progress)
+            if self.result is not None:
+                subscriber.put(self.result)
+            else:
+                self._subscribers.append(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: ProgressChannel):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+    
+    def to_dict(self) -> Dict:
+        return {
+            "task_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "writer": self.writer,
+            "progress": self.progress,
+            "result": self.result,
+            "subscribers": len(self._subscribers),
+            "created_at": self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "started_at": self.started_at.strftime('%Y-%m-%d %H:%M:%S') if self.started_at else None,
+            "finished_at": self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None,
+        }
+
+
+class JobManager:
+    """后台任务管理器"""
+    
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, BackgroundJob] = {}
+        self._active: Dict[str, BackgroundJob] = {}  # {去重键: 未结束的任务}
+        self._lock = threading.Lock()
+        # 数据库写入锁：同一时间只有一个写入任务运行
+        self.writer_lock = threading.Lock()
+    
+    def submit(
+        self,
+        kind: str,
+        key: str,
+        func: Callable[[Callable], Dict],
+        writer: bool = False,
+        error_message: str = "执行失败"
+    ) -> BackgroundJob:
+        """提交任务，相同去重键的任务未结束时返回已有任务
+        
+        Args:
+            kind: 任务类型
+            key: 去重键（相同参数的任务使用相同的键）
+            func: 任务函数，接收进度回调 (current, total, message)，返回最终事件（包含 done: True）
+            writer: 是否写数据库（写入任务依次运行）
+            error_message: 任务出错时最终事件的消息前缀
+        """
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                logger.info(f"任务 {key} 正在运行，复用任务 {job.job_id}")
+                return job
+            
+            job = BackgroundJob(kind, key, writer)
+            self._jobs[job.job_id] = job
+            self._active[key] = job
+            self._prune()
+        
+        self._executor.submit(self._run, job, func, error_message)
+        return job
+    
+    def get(self, job_id: str) -> Optional[BackgroundJob]:
+        return self._jobs.get(job_id)
+    
+    def list(self) -> List[BackgroundJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+    
+    def _run(self, job: BackgroundJob, func: Callable, error_message: str):
+        try:
+            if job.writer:
+                if not self.writer_lock.acquire(blocking=False):
+                    job.status = "waiting"
+                    job.report(0, 100, "等待其他写入任务完成...")
+                    self.writer_lock.acquire()
+            try:
+                job.status = "running"
+                job.started_at = datetime.now()
+                result = func(job.report)
+                status, final = "completed", {**(result or {}), "done": True}
+            finally:
+                if job.writer:
+                    self.writer_lock.release()
+        except Exception as e:
+            logger.error(f"后台任务 {job.kind} ({job.job_id}) 出错: {e}", exc_info=True)
+            status, final = "failed", {
+                "current": 0,
+                "total": 100,
+                "message": f"{error_message}: {str(e)}",
+                "percent": 0,
+                "error": True
+            }
+        
+        # 先移出去重表再发送最终结果，之后的相同提交会创建新任务
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+        job.finish(status, final)
+    
+    def _prune(self):
+        """只保留最近的已结束任务（调用方持有锁）"""
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished),
+            key=lambda job: job.created_at
+        )
+        for job in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[job.job_id]
+
+
+async def stream_job_events(job: BackgroundJob):
+    """把任务事件转换为SSE数据流，收到最终结果后结束"""
+    from config import JOB_CONFIG
+    
+    subscriber = job.subscribe(asyncio.get_running_loop(), JOB_CONFIG["sse_max_rate"])
+    try:
+        async for event in subscriber.events():
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    finally:
+        job.unsubscribe(subscriber)
+
+
+async def wait_job(job: BackgroundJob) -> Dict:
+    """在事件循环中等待任务结束，返回最终事件"""
+    subscriber = job.subscribe(asyncio.get_running_loop())
+    try:
+        async for event in subscriber.events():
+            if event.get("done") or event.get("error"):
+                return event
+    finally:
+        job.unsubscribe(subscriber)
+
+
+class ServerBusyError(Exception):
+    """排队等待的请求数超过上限"""
+    pass
+
+
+class BlockingCallPool:
+    """在线程池中运行请求中的阻塞调用，避免阻塞事件循环
+    
+    每个分组（如 statistics、export）有单独的并发上限，超出上限的请求排队等待；
+    排队数超过 max_queue 时抛出 ServerBusyError。
+    """
+    
+    def __init__(self, max_workers: int, limits: Dict[str, int], max_queue: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="request")
+        self._max_workers = max_workers
+        self._limits = limits
+        self._max_queue = max_queue
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiting: Dict[str, int] = {}
+    
+    async def run(self, group: str, func: Callable, *args, **kwargs):
+        """在线程池中运行 func(*args, **kwargs) 并返回结果
+        
+        Args:
+            group: 并发分组，未配置的分组上限为线程池大小
+            func: 阻塞函数
+        """
+        semaphore = self._semaphores.get(group)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self._limits.get(group, self._max_workers))
+            self._semaphores[group] = semaphore
+        
+        waiting = self._waiting.get(group, 0)
+        if semaphore.locked() and waiting >= self._max_queue:
+            raise ServerBusyError(f"服务器繁忙，请稍后重试（{group} 排队 {waiting} 个请求）")
+        
+        self._waiting[group] = waiting + 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[group] -= 1
+        
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        # 线程结束后才释放并发名额；客户端断开时线程仍会运行完
+        future.add_done_callback(lambda _: semaphore.release())
+        return await asyncio.shield(future)
+
+
+
+_blocking_pool: Optional[BlockingCallPool] = None
+
+
+async def run_blocking(group: str, func: Callable, *args, **kwargs):
+    """在请求线程池中运行阻塞调用（见 BlockingCallPool.run）"""
+    global _blocking_pool
+    if _blocking_pool is None:
+        from config import JOB_CONFIG
+        _blocking_pool = BlockingCallPool(
+            max_workers=JOB_CONFIG["request_workers"],
+            limits=JOB_CONFIG["request_limits"],
+            max_queue=JOB_CONFIG["request_max_queue"]
+        )
+    return await _blocking_pool.run(group, func, *args, **kwargs)
+
+
+# 迭代结束标记
+_EXHAUSTED = object()
+
+
+async def iterate_blocking(group: str, iterator: Iterator):
+    """逐项在请求线程池中取出同步迭代器的下一项（每次计算一页结果等）"""
+    while True:
+        item = await run_blocking(group, next, iterator, _EXHAUSTED)
+        if item is _EXHAUSTED:
+            return
+        yield item
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """获取进程级任务管理器"""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            from config import JOB_CONFIG
+            _job_manager = JobManager(max_workers=JOB_CONFIG["max_workers"])
+        return _job_manager
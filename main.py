@@ -2,22 +2,30 @@
 主程序入口
 """
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 import asyncio
 import json
+from functools import partial
+from datetime import datetime
 from sqlalchemy.orm import Session
-from database import engine, get_db, Base
-from models import Stock, MonthlyKData
+from database import engine, get_db, Base, SessionLocal
+from models import Stock, MonthlyKData, StatisticsCache
 from data_collector import DataCollector
-from statistics import StatisticsCalculator
+from statistics import StatisticsCalculator, BatchRanking
+from statistics_cache import get_cache_stats
+from job_manager import get_job_manager, stream_job_events, wait_job, run_blocking, iterate_blocking, ServerBusyError
+from batch_export import stream_csv, write_xlsx, iter_file, export_filename, content_disposition
+from data_snapshot import pyarrow_available, write_snapshot_file
+from update_jobs import (
+    create_update_job, start_update_job, pause_update_job, resume_update_job,
+    resume_interrupted_jobs, get_update_job_status, list_update_jobs
+)
 from config import WEB_CONFIG, DATA_SOURCE_CONFIG, STATISTICS_CONFIG, save_data_source_config
 import uvicorn
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-import pandas as pd
-from datetime import datetime
 import os
 import logging
 
@@ -32,11 +40,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(title="股票月K统计分析系统")
 
+
+@app.on_event("startup")
+def startup():
+    """服务启动时初始化数据库
+    
+    不在模块导入时执行：多进程获取和统计使用spawn启动工作进程，
+    工作进程会重新导入主模块。
+    """
+    # 创建数据库表
+    Base.metadata.create_all(bind=engine)
+    
+    # 继续上次进程退出时被中断的更新任务
+    resume_interrupted_jobs()
+
 # 静态文件和模板
 if not os.path.exists("static"):
     os.makedirs("static")
@@ -47,6 +66,12 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
+@app.exception_handler(ServerBusyError)
+async def server_busy_handler(request: Request, exc: ServerBusyError):
+    """请求排队数超过上限"""
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 # Pydantic模型
 class StockQuery(BaseModel):
     stock_code: str
@@ -62,6 +87,10 @@ class BatchQuery(BaseModel):
     min_total_count: int = 0  # 最小总涨跌次数
     limit: int = 20
     order_by: str = "up_probability"
+    page_size: Optional[int] = None  # 设置后分页返回，配合 cursor 取下一页
+    cursor: Optional[str] = None  # 上一页返回的 next_cursor
+    stream: bool = False  # True=以NDJSON逐行返回全部结果（limit<=0 表示不限数量）
+    export_all: bool = False  # 导出时忽略limit，导出所有符合条件的股票
 
 
 class IndustryQuery(BaseModel):
@@ -82,6 +111,11 @@ class UpdateRequest(BaseModel):
     force_update: bool = False
 
 
+class UpdateJobRequest(BaseModel):
+    stock_codes: Optional[List[str]] = None  # None表示全市场
+    force_update: bool = False
+
+
 class ConfigUpdate(BaseModel):
     baostock_enabled: bool = True
     tushare_enabled: bool = False
@@ -102,7 +136,7 @@ async def index(request: Request):
 async def get_stock_suggestions(keyword: str, db: Session = Depends(get_db)):
     """股票代码/名称自动补全"""
     calculator = StatisticsCalculator(db)
-    suggestions = calculator.get_stock_suggestions(keyword, limit=10)
+    suggestions = await run_blocking("query", calculator.get_stock_suggestions, keyword, limit=10)
     return {"suggestions": suggestions}
 
 
@@ -110,7 +144,9 @@ async def get_stock_suggestions(keyword: str, db: Session = Depends(get_db)):
 async def get_stock_statistics(query: StockQuery, db: Session = Depends(get_db)):
     """获取单只股票统计信息"""
     calculator = StatisticsCalculator(db)
-    result = calculator.calculate_stock_statistics(
+    result = await run_blocking(
+        "statistics",
+        calculator.calculate_stock_statistics,
         query.stock_code,
         months=query.months,
         min_total_count=query.min_total_count,
@@ -125,9 +161,78 @@ async def get_stock_statistics(query: StockQuery, db: Session = Depends(get_db))
 
 @app.post("/api/stocks/batch")
 async def get_batch_statistics(query: BatchQuery, db: Session = Depends(get_db)):
-    """批量获取股票统计信息"""
+    """批量获取股票统计信息
+    
+    默认返回前 limit 名；设置 page_size/cursor 时按排名分页返回，
+    设置 stream 时以 application/x-ndjson 逐行返回，最后一行为 {"done": true, ...}。
+    前 limit 名的流式输出与默认查询共用统计缓存。
+    """
     calculator = StatisticsCalculator(db)
-    results = calculator.calculate_batch_statistics(
+    if query.stream and query.limit > 0:
+        cached = await run_blocking(
+            "statistics",
+            calculator.get_cached_batch_statistics,
+            months=query.months,
+            market=query.market,
+            industry_code=query.industry_code,
+            min_total_count=query.min_total_count,
+            exclude_delisted=STATISTICS_CONFIG["exclude_delisted"],
+            limit=query.limit,
+            order_by=query.order_by
+        )
+        if cached is not None:
+            return StreamingResponse(stream_cached_rows(cached), media_type="application/x-ndjson")
+    
+    if query.stream or query.page_size or query.cursor:
+        after = None
+        if query.cursor:
+            try:
+                after = BatchRanking.decode_cursor(query.cursor, query.order_by)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        ranking = await run_blocking(
+            "statistics",
+            calculator.rank_batch_statistics,
+            months=query.months,
+            market=query.market,
+            industry_code=query.industry_code,
+            min_total_count=query.min_total_count,
+            exclude_delisted=STATISTICS_CONFIG["exclude_delisted"],
+            order_by=query.order_by
+        )
+        total = min(ranking.total, query.limit) if query.limit > 0 else ranking.total
+        
+        if query.stream:
+            on_complete = None
+            if query.limit > 0:
+                on_complete = partial(
+                    calculator.cache_batch_statistics,
+                    months=query.months,
+                    market=query.market,
+                    industry_code=query.industry_code,
+                    min_total_count=query.min_total_count,
+                    exclude_delisted=STATISTICS_CONFIG["exclude_delisted"],
+                    limit=query.limit,
+                    order_by=query.order_by
+                )
+            return StreamingResponse(stream_batch_rows(ranking, total, on_complete), media_type="application/x-ndjson")
+        
+        page_size = max(1, query.page_size or STATISTICS_CONFIG["batch_page_size"])
+        rows, next_after = await run_blocking("statistics", ranking.page, after, page_size)
+        rows = [row for row in rows if row["rank"] <= total]
+        if not rows or rows[-1]["rank"] >= total:
+            next_after = None
+        return {
+            "results": rows,
+            "count": len(rows),
+            "total": total,
+            "next_cursor": BatchRanking.encode_cursor(query.order_by, next_after) if next_after else None
+        }
+    
+    results = await run_blocking(
+        "statistics",
+        calculator.calculate_batch_statistics,
         months=query.months,
         market=query.market,
         industry_code=query.industry_code,
@@ -140,11 +245,34 @@ async def get_batch_statistics(query: BatchQuery, db: Session = Depends(get_db))
     return {"results": results, "count": len(results)}
 
 
+async def stream_batch_rows(ranking: BatchRanking, total: int, on_complete=None):
+    """逐页计算批量统计结果并输出NDJSON，第一页较小以便尽快显示
+    
+    全部输出后把所有行传给 on_complete（用于写入统计缓存），中途断开时不调用。
+    """
+    results = []
+    pages = ranking.iter_pages(total, STATISTICS_CONFIG["batch_page_size"], STATISTICS_CONFIG["batch_stream_page_size"])
+    async for rows in iterate_blocking("statistics", pages):
+        for row in rows:
+            results.append(row)
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+    if on_complete and len(results) == total:
+        await run_blocking("statistics", on_complete, results)
+    yield json.dumps({"done": True, "count": len(results), "total": total}, ensure_ascii=False) + "\n"
+
+
+async def stream_cached_rows(results: List[Dict]):
+    """以NDJSON输出缓存中的批量统计结果，格式与 stream_batch_rows 相同"""
+    for row in results:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+    yield json.dumps({"done": True, "count": len(results), "total": len(results)}, ensure_ascii=False) + "\n"
+
+
 @app.get("/api/industries")
 async def get_industries(db: Session = Depends(get_db)):
     """获取行业列表"""
     calculator = StatisticsCalculator(db)
-    industries = calculator.get_industry_list()
+    industries = await run_blocking("query", calculator.get_industry_list)
     return {"industries": industries}
 
 
@@ -152,7 +280,9 @@ async def get_industries(db: Session = Depends(get_db)):
 async def get_industry_statistics(query: IndustryQuery, db: Session = Depends(get_db)):
     """获取行业统计信息"""
     calculator = StatisticsCalculator(db)
-    result = calculator.calculate_industry_statistics(
+    result = await run_blocking(
+        "statistics",
+        calculator.calculate_industry_statistics,
         query.industry_code,
         months=query.months,
         min_total_count=query.min_total_count,
@@ -171,443 +301,254 @@ async def get_industries_rank_by_month(query: IndustryRankQuery, db: Session = D
     if not (1 <= query.month <= 12):
         raise HTTPException(status_code=400, detail="月份必须在1-12之间")
     
-    async def generate_progress():
-        import queue
-        import threading
-        import json
-        
-        progress_queue = queue.Queue()
-        update_complete = threading.Event()
-        
-        def progress_callback(current, total, message):
-            progress_data = {
-                "current": current,
-                "total": total,
-                "message": message,
-                "percent": int(current / total * 100) if total > 0 else 0
-            }
-            progress_queue.put(progress_data)
+    sse_headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "X-Accel-Buffering": "no"
+    }
+    
+    # 优先读取数据更新后预先计算的排名快照，没有快照时再实时计算
+    snapshot = await run_blocking(
+        "statistics",
+        StatisticsCalculator(db).get_industry_rank_snapshot,
+        month=query.month,
+        min_total_count=query.min_total_count,
+        limit=query.limit
+    )
+    if snapshot:
+        results = snapshot["results"]
+        final_data = {
+            "done": True,
+            "month": query.month,
+            "results": results,
+            "count": len(results),
+            "total_industries": snapshot["total_industries"],
+            "success_count": len(results),
+            "failed_count": snapshot["total_industries"] - len(results),
+            "snapshot_version": snapshot["snapshot_version"],
+            "snapshot_at": snapshot["snapshot_at"]
+        }
         
-        def run_query():
-            try:
-                # 在后台线程中创建新的数据库会话
-                from database import SessionLocal
-                thread_db = SessionLocal()
-                thread_calculator = StatisticsCalculator(thread_db)
-                
-                try:
-                    # 获取所有行业
-                    industries = thread_calculator.get_industry_list()
-                    total_industries = len(industries)
-                    
-                    progress_callback(0, total_industries, f"开始查询 {total_industries} 个行业...")
-                    
-                    # 调用带进度回调的查询方法
-                    results = thread_calculator.calculate_industries_rank_by_month_with_progress(
-                        month=query.month,
-                        min_total_count=query.min_total_count,
-                        limit=query.limit,
-                        progress_callback=progress_callback
-                    )
-                    
-                    # 获取所有行业列表，用于统计
-                    all_industries = thread_calculator.get_industry_list()
-                    total_industries = len(all_industries)
-                    
-                    # 发送最终结果（包含统计信息）
-                    final_data = {
-                        "done": True,
-                        "month": query.month,
-                        "results": results,
-                        "count": len(results),
-                        "total_industries": total_industries,
-                        "success_count": len(results),
-                        "failed_count": total_industries - len(results)
-                    }
-                    progress_queue.put(final_data)
-                    
-                finally:
-                    thread_db.close()
-                    
-            except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.error(f"查询行业排名失败: {e}", exc_info=True)
-                error_data = {
-                    "error": True,
-                    "message": f"查询失败: {str(e)}"
-                }
-                progress_queue.put(error_data)
-            finally:
-                update_complete.set()
+        async def send_snapshot():
+            yield f"data: {json.dumps(final_data, ensure_ascii=False)}\n\n"
         
+        return StreamingResponse(send_snapshot(), media_type="text/event-stream", headers=sse_headers)
+    
+    def run_query(progress_callback):
+        # 在后台线程中创建新的数据库会话
+        thread_db = SessionLocal()
         try:
-            # 发送初始消息
-            yield f"data: {json.dumps({'current': 0, 'total': 100, 'message': '开始查询行业排名...', 'percent': 0}, ensure_ascii=False)}\n\n"
+            thread_calculator = StatisticsCalculator(thread_db)
             
-            # 在后台线程中运行查询任务
-            import threading
-            query_thread = threading.Thread(target=run_query, daemon=True)
-            query_thread.start()
+            # 获取所有行业，用于统计
+            total_industries = len(thread_calculator.get_industry_list())
+            progress_callback(0, total_industries, f"开始查询 {total_industries} 个行业...")
             
-            # 持续发送进度更新
-            last_percent = 0
-            final_result = None
+            # 调用带进度回调的查询方法
+            results = thread_calculator.calculate_industries_rank_by_month_with_progress(
+                month=query.month,
+                min_total_count=query.min_total_count,
+                limit=query.limit,
+                progress_callback=progress_callback
+            )
             
-            while not update_complete.is_set() or not progress_queue.empty():
-                try:
-                    # 检查是否有进度更新（非阻塞）
-                    try:
-                        while True:
-                            progress_data = progress_queue.get_nowait()
-                            
-                            # 检查是否是最终结果
-                            if progress_data.get("done"):
-                                final_result = progress_data
-                                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                                break
-                            elif progress_data.get("error"):
-                                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                                break
-                            else:
-                                percent = progress_data.get("percent", 0)
-                                if percent > last_percent or progress_data.get("message", ""):
-                                    yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                                    last_percent = percent
-                    except queue.Empty:
-                        pass
-                    
-                    # 如果已经收到最终结果，退出循环
-                    if final_result:
-                        break
-                    
-                    # 短暂休眠，避免CPU占用过高
-                    import asyncio
-                    await asyncio.sleep(0.1)
-                    
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"发送进度更新时发生错误: {e}", exc_info=True)
-                    break
-            
-            # 确保最终结果已发送
-            if final_result:
-                yield f"data: {json.dumps(final_result, ensure_ascii=False)}\n\n"
-                
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"生成进度流时发生错误: {e}", exc_info=True)
-            error_data = {
-                "error": True,
-                "message": f"查询失败: {str(e)}"
+            # 最终结果（包含统计信息）
+            return {
+                "month": query.month,
+                "results": results,
+                "count": len(results),
+                "total_industries": total_industries,
+                "success_count": len(results),
+                "failed_count": total_industries - len(results)
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-    
-    return StreamingResponse(
-        generate_progress(), 
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
+        finally:
+            thread_db.close()
+    
+    # 相同参数的查询正在进行时直接订阅已有任务
+    job = get_job_manager().submit(
+        "industry_rank",
+        f"industry_rank:{query.month}:{query.min_total_count}:{query.limit}",
+        run_query,
+        error_message="查询失败"
     )
+    return StreamingResponse(stream_job_events(job), media_type="text/event-stream", headers=sse_headers)
+
+
+@app.post("/api/industries/rank-snapshot")
+async def rebuild_industry_rank_snapshot():
+    """重新计算行业月份排名快照（12个月）"""
+    def run_build(progress_callback):
+        thread_db = SessionLocal()
+        try:
+            return {"version": StatisticsCalculator(thread_db).build_industry_rank_snapshot()}
+        finally:
+            thread_db.close()
+    
+    job = get_job_manager().submit("rank_snapshot", "rank_snapshot", run_build, writer=True, error_message="计算失败")
+    result = await wait_job(job)
+    if result.get("error"):
+        raise HTTPException(status_code=500, detail=result["message"])
+    if result["version"] is None:
+        raise HTTPException(status_code=404, detail="暂无行业数据")
+    return {"message": "行业排名快照计算完成", "version": result["version"]}
 
 
 @app.post("/api/data/update")
-async def update_data(request: UpdateRequest, db: Session = Depends(get_db)):
-    """更新数据"""
+async def update_data(request: UpdateRequest):
+    """更新数据（写入任务依次运行，相同的更新请求共用一个任务）"""
     try:
-        collector = DataCollector(db)
-        
         if request.stock_codes:
             # 更新指定股票
-            total_count = 0
-            success_count = 0
-            failed_count = 0
-            for code in request.stock_codes:
+            def run_update_stocks(progress_callback):
+                thread_db = SessionLocal()
                 try:
-                    count = collector.update_monthly_k_data(code, force_update=request.force_update)
-                    total_count += count
-                    success_count += 1
-                except Exception as e:
-                    failed_count += 1
-                    logger.error(f"更新股票 {code} 失败: {e}")
-            
-            collector._logout_baostock()  # 登出BaoStock
+                    total_count, success_count, failed_count = DataCollector(thread_db).update_monthly_k_data_batch(
+                        request.stock_codes, force_update=request.force_update, progress_callback=progress_callback
+                    )
+                    return {
+                        "message": f"更新完成，成功：{success_count}，失败：{failed_count}，共更新 {total_count} 条记录"
+                    }
+                finally:
+                    thread_db.close()
             
-            return {
-                "message": f"更新完成，成功：{success_count}，失败：{failed_count}，共更新 {total_count} 条记录"
-            }
+            job = get_job_manager().submit(
+                "update_stocks",
+                f"update_stocks:{request.force_update}:{','.join(sorted(request.stock_codes))}",
+                run_update_stocks,
+                writer=True,
+                error_message="更新失败"
+            )
+            result = await wait_job(job)
+            if result.get("error"):
+                raise HTTPException(status_code=500, detail=result["message"])
+            return {"message": result["message"], "task_id": job.job_id}
         else:
             # 更新所有股票 - 使用流式响应返回进度
-            async def generate_progress():
-                import queue
-                import concurrent.futures
-                
-                progress_queue = queue.Queue()
+            def run_update(progress_callback):
+                # 在后台线程中创建新的数据库会话
+                thread_db = SessionLocal()
+                try:
+                    # 先更新股票列表
+                    summary = DataCollector(thread_db).update_stock_list(progress_callback=progress_callback)
+                    
+                    # 获取所有股票代码
+                    stock_codes = [code for (code,) in thread_db.query(Stock.code).filter(Stock.is_delisted == 0).all()]
+                finally:
+                    thread_db.close()
                 
-                def progress_callback(current, total, message):
-                    progress_data = {
-                        "current": current,
-                        "total": total,
-                        "message": message,
-                        "percent": int(current / total * 100) if total > 0 else 0
-                    }
-                    progress_queue.put(progress_data)
+                def stock_progress(current, total, message, **counts):
+                    # 计算总体进度：股票列表更新占10%，月K数据更新占90%
+                    overall_current = 10 + int(current / total * 90) if total > 0 else 10
+                    progress_callback(overall_current, 100, message, **counts)
                 
-                def run_update():
-                    # 在后台线程中创建新的数据库会话
-                    from database import SessionLocal
-                    thread_db = SessionLocal()
-                    thread_collector = DataCollector(thread_db)
-                    
-                    try:
-                        # 先更新股票列表
-                        stock_count = thread_collector.update_stock_list(progress_callback=progress_callback)
-                        
-                        # 获取所有股票代码和名称（在会话内获取，避免会话问题）
-                        stocks = thread_db.query(Stock).filter(Stock.is_delisted == 0).all()
-                        # 立即提取所有需要的数据，避免后续访问时会话已关闭
-                        stock_list = [(s.code, s.name if s.name else s.code) for s in stocks]
-                        total_stocks = len(stock_list)
-                        total_count = 0
-                        success_count = 0
-                        failed_count = 0
-                        
-                        # 关闭查询会话，后续使用新的会话
-                        thread_db.close()
-                        
-                        # 使用批量会话，每50个股票重新创建一次会话，避免会话过期
-                        batch_size = 50
-                        current_db = None
-                        current_collector = None
-                        
-                        for idx, (stock_code, stock_name) in enumerate(stock_list):
-                            try:
-                                # 每50个股票或第一个股票时创建新会话
-                                if idx % batch_size == 0:
-                                    if current_db:
-                                        try:
-                                            current_collector._logout_baostock()
-                                            current_db.close()
-                                        except:
-                                            pass
-                                    current_db = SessionLocal()
-                                    current_collector = DataCollector(current_db)
-                                
-                                def stock_progress(current, total, message):
-                                    # 计算总体进度：股票列表更新占10%，月K数据更新占90%
-                                    overall_current = 10 + int((idx + current / total) / total_stocks * 90) if total > 0 else 10 + int(idx / total_stocks * 90)
-                                    progress_queue.put({
-                                        "current": overall_current,
-                                        "total": 100,
-                                        "message": f"正在更新 {stock_code} - {stock_name} ({idx + 1}/{total_stocks})",
-                                        "percent": overall_current
-                                    })
-                                
-                                count = current_collector.update_monthly_k_data(stock_code, force_update=request.force_update, progress_callback=stock_progress)
-                                total_count += count
-                                success_count += 1
-                            except Exception as e:
-                                failed_count += 1
-                                logger.error(f"更新股票 {stock_code} 失败: {e}", exc_info=True)
-                        
-                        # 关闭最后一个会话
-                        if current_db:
-                            try:
-                                current_collector._logout_baostock()
-                                current_db.close()
-                            except:
-                                pass
-                        
-                        thread_collector._logout_baostock()
-                        return stock_count, total_count, success_count, failed_count, None
-                    except Exception as e:
-                        logger.error(f"更新过程出错: {e}", exc_info=True)
-                        try:
-                            thread_db.close()
-                        except:
-                            pass
-                        return 0, 0, 0, 0, str(e)
+                # 月K数据由多个进程并行获取，在当前会话中逐只写入
+                update_db = SessionLocal()
+                try:
+                    total_count, success_count, failed_count = DataCollector(update_db).update_monthly_k_data_batch(
+                        stock_codes,
+                        force_update=request.force_update,
+                        progress_callback=stock_progress
+                    )
+                finally:
+                    update_db.close()
                 
+                # 更新行业指数月K数据，行业统计只读取本地数据
+                progress_callback(99, 100, "正在更新行业指数数据...")
+                index_db = SessionLocal()
                 try:
-                    loop = asyncio.get_event_loop()
-                    future = loop.run_in_executor(None, run_update)
-                    
-                    while True:
-                        try:
-                            while not progress_queue.empty():
-                                progress_data = progress_queue.get_nowait()
-                                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                            
-                            if future.done():
-                                stock_count, total_count, success_count, failed_count, error = await future
-                                
-                                # 发送剩余的进度更新
-                                while not progress_queue.empty():
-                                    progress_data = progress_queue.get_nowait()
-                                    yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                                
-                                if error:
-                                    error_data = {
-                                        "current": 0,
-                                        "total": 100,
-                                        "message": f"更新失败: {error}",
-                                        "percent": 0,
-                                        "error": True
-                                    }
-                                    yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-                                else:
-                                    final_data = {
-                                        "current": 100,
-                                        "total": 100,
-                                        "message": f"更新完成，股票列表：{stock_count}，成功：{success_count}，失败：{failed_count}，月K数据：{total_count} 条记录",
-                                        "percent": 100,
-                                        "done": True
-                                    }
-                                    yield f"data: {json.dumps(final_data, ensure_ascii=False)}\n\n"
-                                break
-                            
-                            await asyncio.sleep(0.1)
-                        except Exception as e:
-                            logger.error(f"发送进度时出错: {e}")
-                            break
-                except Exception as e:
-                    logger.error(f"更新月K数据时发生错误: {e}", exc_info=True)
-                    error_data = {
-                        "current": 0,
-                        "total": 100,
-                        "message": f"更新失败: {str(e)}",
-                        "percent": 0,
-                        "error": True
-                    }
-                    yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+                    DataCollector(index_db).update_industry_index_data()
+                    # 指数数据更新后预先计算12个月的行业排名
+                    StatisticsCalculator(index_db).build_industry_rank_snapshot()
+                finally:
+                    index_db.close()
+                
+                return {
+                    "current": 100,
+                    "total": 100,
+                    "message": (
+                        f"更新完成，股票列表：新增 {summary.get('added', 0)}，变化 {summary.get('changed', 0)}，"
+                        f"新退市 {summary.get('delisted', 0)}，上市 {len(stock_codes)} 只；"
+                        f"成功：{success_count}，失败：{failed_count}，月K数据：{total_count} 条记录"
+                    ),
+                    "percent": 100
+                }
             
-            return StreamingResponse(generate_progress(), media_type="text/event-stream")
+            job = get_job_manager().submit(
+                "update_all",
+                f"update_all:{request.force_update}",
+                run_update,
+                writer=True,
+                error_message="更新失败"
+            )
+            return StreamingResponse(stream_job_events(job), media_type="text/event-stream")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"更新数据时发生错误: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"更新失败: {str(e)}")
 
 
 @app.post("/api/data/update-stock-list")
-async def update_stock_list(db: Session = Depends(get_db)):
+async def update_stock_list():
     """更新股票列表（带进度反馈）"""
-    async def generate_progress():
-        import queue
-        import concurrent.futures
-        import threading
-        
-        progress_queue = queue.Queue()
-        update_complete = threading.Event()
-        update_result = {"count": 0, "error": None}
-        
-        def progress_callback(current, total, message):
-            try:
-                progress_data = {
-                    "current": current,
-                    "total": total,
-                    "message": message,
-                    "percent": int(current / total * 100) if total > 0 else 0
-                }
-                progress_queue.put(progress_data)
-            except Exception as e:
-                logger.error(f"进度回调出错: {e}")
-        
-        def run_update():
-            # 在后台线程中创建新的数据库会话
-            from database import SessionLocal
-            thread_db = SessionLocal()
-            thread_collector = DataCollector(thread_db)
-            
-            try:
-                count = thread_collector.update_stock_list(progress_callback=progress_callback)
-                thread_collector._logout_baostock()
-                update_result["count"] = count
-                update_result["error"] = None
-            except Exception as e:
-                logger.error(f"更新股票列表失败: {e}", exc_info=True)
-                update_result["error"] = str(e)
-            finally:
-                try:
-                    thread_db.close()
-                except:
-                    pass
-                update_complete.set()
-        
+    def run_update(progress_callback):
+        # 在后台线程中创建新的数据库会话
+        thread_db = SessionLocal()
         try:
-            # 发送初始消息
-            yield f"data: {json.dumps({'current': 0, 'total': 100, 'message': '开始更新股票列表...', 'percent': 0}, ensure_ascii=False)}\n\n"
-            
-            # 在后台线程中运行更新任务
-            import threading
-            update_thread = threading.Thread(target=run_update, daemon=True)
-            update_thread.start()
-            
-            # 持续发送进度更新
-            last_percent = 0
-            while not update_complete.is_set() or not progress_queue.empty():
-                try:
-                    # 检查是否有进度更新（非阻塞）
-                    try:
-                        while True:
-                            progress_data = progress_queue.get_nowait()
-                            percent = progress_data.get("percent", 0)
-                            if percent > last_percent or progress_data.get("message", ""):
-                                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                                last_percent = percent
-                    except queue.Empty:
-                        pass
-                    
-                    # 如果任务完成，发送最终消息
-                    if update_complete.is_set():
-                        # 发送剩余的进度更新
-                        try:
-                            while True:
-                                progress_data = progress_queue.get_nowait()
-                                yield f"data: {json.dumps(progress_data, ensure_ascii=False)}\n\n"
-                        except queue.Empty:
-                            pass
-                        
-                        if update_result["error"]:
-                            error_data = {
-                                "current": 0,
-                                "total": 100,
-                                "message": f"更新失败: {update_result['error']}",
-                                "percent": 0,
-                                "error": True
-                            }
-                            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-                        else:
-                            final_data = {
-                                "current": 100,
-                                "total": 100,
-                                "message": f"更新完成，共 {update_result['count']} 只股票",
-                                "percent": 100,
-                                "done": True
-                            }
-                            yield f"data: {json.dumps(final_data, ensure_ascii=False)}\n\n"
-                        break
-                    
-                    await asyncio.sleep(0.2)  # 短暂等待，避免CPU占用过高
-                except Exception as e:
-                    logger.error(f"发送进度时出错: {e}", exc_info=True)
-                    break
-        except Exception as e:
-            logger.error(f"更新股票列表时发生错误: {e}", exc_info=True)
-            error_data = {
-                "current": 0,
+            progress_callback(0, 100, "开始更新股票列表...")
+            thread_collector = DataCollector(thread_db)
+            summary = thread_collector.update_stock_list(progress_callback=progress_callback)
+            thread_collector._logout_baostock()
+            if not summary:
+                raise RuntimeError("未能获取股票列表")
+            return {
+                "current": 100,
                 "total": 100,
-                "message": f"更新失败: {str(e)}",
-                "percent": 0,
-                "error": True
+                "message": (
+                    f"更新完成，新增 {summary['added']} 只，信息变化 {summary['changed']} 只，"
+                    f"未变化 {summary['unchanged']} 只，列表中已不存在 {summary['vanished']} 只，新退市 {summary['delisted']} 只"
+                ),
+                "percent": 100,
+                "summary": summary
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+        finally:
+            thread_db.close()
     
+    job = get_job_manager().submit("update_stock_list", "update_stock_list", run_update, writer=True, error_message="更新失败")
+    return StreamingResponse(
+        stream_job_events(job), 
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@app.get("/api/tasks")
+async def list_background_tasks():
+    """列出后台任务（数据更新、行业排名等）"""
+    return {"tasks": [job.to_dict() for job in get_job_manager().list()]}
+
+
+@app.get("/api/tasks/{task_id}")
+async def get_background_task(task_id: str):
+    """查询后台任务状态和进度"""
+    job = get_job_manager().get(task_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
+    return job.to_dict()
+
+
+@app.get("/api/tasks/{task_id}/events")
+async def stream_background_task(task_id: str):
+    """订阅后台任务进度（SSE），可以有任意多个客户端同时订阅"""
+    job = get_job_manager().get(task_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务 {task_id} 不存在")
     return StreamingResponse(
-        generate_progress(), 
+        stream_job_events(job),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -617,13 +558,101 @@ async def update_stock_list(db: Session = Depends(get_db)):
     )
 
 
+@app.post("/api/data/update-index")
+async def update_index_data(force_update: bool = False):
+    """更新行业指数月K数据（行业统计只读取本地数据）"""
+    def run_update(progress_callback):
+        thread_db = SessionLocal()
+        try:
+            collector = DataCollector(thread_db)
+            count = collector.update_industry_index_data(force_update=force_update, progress_callback=progress_callback)
+            collector._logout_baostock()
+            StatisticsCalculator(thread_db).build_industry_rank_snapshot()
+            return {"message": f"行业指数更新完成，新增 {count} 条记录"}
+        finally:
+            thread_db.close()
+    
+    job = get_job_manager().submit("update_index", f"update_index:{force_update}", run_update, writer=True, error_message="更新失败")
+    result = await wait_job(job)
+    if result.get("error"):
+        raise HTTPException(status_code=500, detail=result["message"])
+    return {"message": result["message"], "task_id": job.job_id}
+
+
+@app.get("/api/data/snapshot")
+async def download_data_snapshot():
+    """下载数据快照（股票、行业和月K数据的Parquet快照，新节点用 data_snapshot.py import 导入）"""
+    if not pyarrow_available():
+        raise HTTPException(status_code=501, detail="服务器未安装pyarrow，无法导出数据快照")
+    
+    def export_locked():
+        # 持有写入锁，导出期间的读事务不会让更新任务写入失败
+        manager = get_job_manager()
+        if not manager.writer_lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="有数据更新任务正在运行，请稍后再导出快照")
+        try:
+            return write_snapshot_file(engine)
+        finally:
+            manager.writer_lock.release()
+    
+    fileobj = await run_blocking("export", export_locked)
+    filename = f"data-snapshot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        iter_file(fileobj),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.post("/api/jobs/update")
+async def create_update_job_api(request: UpdateJobRequest, db: Session = Depends(get_db)):
+    """创建并启动数据更新任务（进度保存在数据库中，与HTTP连接无关）"""
+    job = await run_blocking("query", create_update_job, db, stock_codes=request.stock_codes, force_update=request.force_update)
+    start_update_job(job.id)
+    return await run_blocking("query", get_update_job_status, db, job.id)
+
+
+@app.get("/api/jobs")
+async def list_update_jobs_api(limit: int = 20, db: Session = Depends(get_db)):
+    """列出最近的数据更新任务"""
+    return {"jobs": await run_blocking("query", list_update_jobs, db, limit=limit)}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_update_job_api(job_id: int, db: Session = Depends(get_db)):
+    """查询数据更新任务状态"""
+    status = await run_blocking("query", get_update_job_status, db, job_id)
+    if not status:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return status
+
+
+@app.post("/api/jobs/{job_id}/pause")
+async def pause_update_job_api(job_id: int, db: Session = Depends(get_db)):
+    """暂停数据更新任务（写完当前股票后停止）"""
+    if not await run_blocking("query", pause_update_job, db, job_id):
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    return await run_blocking("query", get_update_job_status, db, job_id)
+
+
+@app.post("/api/jobs/{job_id}/resume")
+async def resume_update_job_api(job_id: int, db: Session = Depends(get_db)):
+    """继续数据更新任务，只处理未完成的股票"""
+    job = await run_blocking("query", resume_update_job, db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在")
+    if job.status == "completed":
+        raise HTTPException(status_code=400, detail=f"任务 {job_id} 已完成")
+    return await run_blocking("query", get_update_job_status, db, job_id)
+
+
 def mask_api_key(api_key: str, show_chars: int = 4) -> str:
     """掩码API密钥，只显示前几位
     
     Args:
         api_key: 原始API密钥
         show_chars: 显示前几位字符
-        
+    
     Returns:
         掩码后的API密钥（例如：abcd****）
     """
@@ -693,7 +722,12 @@ async def update_config(config: ConfigUpdate):
 
 @app.post("/api/config/test-connection")
 async def test_connection(config: ConfigUpdate):
-    """测试数据源连接"""
+    """测试数据源连接（在线程池中依次运行，测试期间临时修改全局配置）"""
+    return await run_blocking("config_test", _test_connection, config)
+
+
+def _test_connection(config: ConfigUpdate) -> dict:
+    """测试各数据源连接"""
     results = {
         "baostock": {"success": False, "message": ""},
         "tushare": {"success": False, "message": ""},
@@ -823,139 +857,54 @@ async def test_connection(config: ConfigUpdate):
     return results
 
 
-@app.post("/api/export/excel")
-async def export_to_excel(query: BatchQuery, db: Session = Depends(get_db)):
-    """导出Excel"""
+@app.get("/api/cache/stats")
+async def get_cache_statistics(db: Session = Depends(get_db)):
+    """获取统计结果缓存的命中情况"""
+    stats = get_cache_stats()
+    stats["entries"] = await run_blocking("query", db.query(StatisticsCache).count)
+    return stats
+
+
+async def rank_for_export(query: BatchQuery, db: Session):
+    """计算导出用的排名结果集，返回 (排名结果集, 导出行数)"""
     calculator = StatisticsCalculator(db)
-    # 导出时使用查询时的limit参数，导出与查询显示一致的数据量
-    results = calculator.calculate_batch_statistics(
+    ranking = await run_blocking(
+        "export",
+        calculator.rank_batch_statistics,
         months=query.months,
         market=query.market,
         industry_code=query.industry_code,
         min_total_count=query.min_total_count,
         exclude_delisted=STATISTICS_CONFIG["exclude_delisted"],
-        limit=query.limit,  # 使用查询时的limit，导出与显示一致的数据量
         order_by=query.order_by
     )
-    
-    if not results:
+    # 默认导出与查询显示一致的数据量（使用查询时的limit）
+    total = ranking.total if query.export_all or query.limit <= 0 else min(ranking.total, query.limit)
+    if total == 0:
         raise HTTPException(status_code=404, detail="没有可导出的数据")
-    
-    # 确保 static 目录存在
-    os.makedirs("static", exist_ok=True)
-    
-    df = pd.DataFrame(results)
-    
-    # 定义中文列名映射
-    column_mapping = {
-        'rank': '排名',
-        'stock_code': '股票代码',
-        'stock_name': '股票名称',
-        'market': '市场',
-        'listing_date': '上市日期',
-        'up_count': '上涨次数',
-        'down_count': '下跌次数',
-        'total_count': '总涨跌次数',
-        'up_probability': '上涨概率(%)',
-        'down_probability': '下跌概率(%)',
-        'avg_up_pct': '平均涨幅(%)',
-        'avg_down_pct': '平均跌幅(%)',
-        'year_range': '统计年份范围',
-        'years_count': '统计年数'
-    }
-    
-    # 重命名列
-    df = df.rename(columns=column_mapping)
-    
-    # 重新排列列的顺序
-    column_order = ['排名', '股票代码', '股票名称', '市场', '上市日期', 
-                    '上涨次数', '下跌次数', '总涨跌次数', '上涨概率(%)', '下跌概率(%)',
-                    '平均涨幅(%)', '平均跌幅(%)', '统计年份范围', '统计年数']
-    # 只保留存在的列
-    column_order = [col for col in column_order if col in df.columns]
-    df = df[column_order]
-    
-    # 生成文件名（使用连字符而不是下划线，避免格式问题）
-    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
-    filename = f"股票统计_{timestamp}.xlsx"
-    filepath = os.path.abspath(os.path.join("static", filename))
-    
-    # 导出Excel，使用openpyxl引擎
-    with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='股票统计')
-    
-    return FileResponse(
-        filepath, 
-        filename=filename,
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    return ranking, total
+
+
+@app.post("/api/export/excel")
+async def export_to_excel(query: BatchQuery, db: Session = Depends(get_db)):
+    """导出Excel（只写模式工作簿，不在服务器上保留文件）"""
+    ranking, total = await rank_for_export(query, db)
+    fileobj = await run_blocking("export", write_xlsx, ranking, total)
+    return StreamingResponse(
+        iter_file(fileobj),
+        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers={"Content-Disposition": content_disposition(export_filename("xlsx"))}
     )
 
 
 @app.post("/api/export/csv")
 async def export_to_csv(query: BatchQuery, db: Session = Depends(get_db)):
-    """导出CSV"""
-    calculator = StatisticsCalculator(db)
-    # 导出时使用查询时的limit参数，导出与查询显示一致的数据量
-    results = calculator.calculate_batch_statistics(
-        months=query.months,
-        market=query.market,
-        industry_code=query.industry_code,
-        min_total_count=query.min_total_count,
-        exclude_delisted=STATISTICS_CONFIG["exclude_delisted"],
-        limit=query.limit,  # 使用查询时的limit，导出与显示一致的数据量
-        order_by=query.order_by
-    )
-    
-    if not results:
-        raise HTTPException(status_code=404, detail="没有可导出的数据")
-    
-    # 确保 static 目录存在
-    os.makedirs("static", exist_ok=True)
-    
-    df = pd.DataFrame(results)
-    
-    # 定义中文列名映射
-    column_mapping = {
-        'rank': '排名',
-        'stock_code': '股票代码',
-        'stock_name': '股票名称',
-        'market': '市场',
-        'listing_date': '上市日期',
-        'up_count': '上涨次数',
-        'down_count': '下跌次数',
-        'total_count': '总涨跌次数',
-        'up_probability': '上涨概率(%)',
-        'down_probability': '下跌概率(%)',
-        'avg_up_pct': '平均涨幅(%)',
-        'avg_down_pct': '平均跌幅(%)',
-        'year_range': '统计年份范围',
-        'years_count': '统计年数'
-    }
-    
-    # 重命名列
-    df = df.rename(columns=column_mapping)
-    
-    # 重新排列列的顺序
-    column_order = ['排名', '股票代码', '股票名称', '市场', '上市日期', 
-                    '上涨次数', '下跌次数', '总涨跌次数', '上涨概率(%)', '下跌概率(%)',
-                    '平均涨幅(%)', '平均跌幅(%)', '统计年份范围', '统计年数']
-    # 只保留存在的列
-    column_order = [col for col in column_order if col in df.columns]
-    df = df[column_order]
-    
-    # 生成文件名（使用连字符而不是下划线，避免格式问题）
-    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
-    filename = f"股票统计_{timestamp}.csv"
-    filepath = os.path.abspath(os.path.join("static", filename))
-    
-    # 导出CSV，使用UTF-8-BOM编码以支持Excel正确显示中文
-    # 使用utf-8-sig编码（带BOM的UTF-8），确保Excel能正确识别中文
-    df.to_csv(filepath, index=False, encoding='utf-8-sig')
-    
-    return FileResponse(
-        filepath, 
-        filename=filename,
-        media_type='text/csv; charset=utf-8'
+    """导出CSV（逐页生成并直接写入响应，使用UTF-8 BOM以便Excel正确显示中文）"""
+    ranking, total = await rank_for_export(query, db)
+    return StreamingResponse(
+        stream_csv(ranking, total),
+        media_type='text/csv; charset=utf-8',
+        headers={"Content-Disposition": content_disposition(export_filename("csv"))}
     )
 
 
@@ -33,6 +33,17 @@ class Stock(Base):
     )
 
 
+class DelistingEvent(Base):
+    """退市事件表（更新股票列表时检测到的退市，股票的月K历史数据保留）"""
+    __tablename__ = "delisting_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    stock_code = Column(String(10), ForeignKey("stocks.code"), nullable=False, index=True, comment="股票代码")
+    delist_date = Column(Date, nullable=False, comment="退市日期（基本资料没有退市日期时为检测日期）")
+    reason = Column(String(20), nullable=False, comment="判断依据：out_date退市日期/status退市状态/vanished不在股票列表中")
+    created_at = Column(DateTime, default=datetime.now)
+
+
 class MonthlyKData(Base):
     """前复权月K数据表"""
     __tablename__ = "monthly_k_data"
@@ -60,6 +71,46 @@ class MonthlyKData(Base):
     )
 
 
+class IndexMonthlyKData(Base):
+    """行业指数前复权月K数据表"""
+    __tablename__ = "index_monthly_k_data"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    index_code = Column(String(20), nullable=False, index=True, comment="BaoStock指数代码，如：sh.000006")
+    year = Column(Integer, nullable=False, comment="年份")
+    month = Column(Integer, nullable=False, comment="月份")
+    open_price = Column(Float, comment="开盘价")
+    close_price = Column(Float, nullable=False, comment="收盘价")
+    high_price = Column(Float, comment="最高价")
+    low_price = Column(Float, comment="最低价")
+    volume = Column(Float, comment="成交量")
+    amount = Column(Float, comment="成交额")
+    pct_change = Column(Float, comment="涨跌幅（%）")
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index('idx_index_year_month', 'index_code', 'year', 'month', unique=True),
+    )
+
+
+class AdjustFactor(Base):
+    """复权因子表（每次除权除息一行，更新时发现前复权历史变化的股票重新获取数据后追加新事件）"""
+    __tablename__ = "adjust_factors"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    stock_code = Column(String(10), ForeignKey("stocks.code"), nullable=False, comment="股票代码")
+    divid_operate_date = Column(Date, nullable=False, comment="除权除息日期")
+    fore_adjust_factor = Column(Float, comment="向前复权因子")
+    back_adjust_factor = Column(Float, comment="向后复权因子")
+    adjust_factor = Column(Float, comment="本次复权因子")
+    created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('idx_adjust_stock_date', 'stock_code', 'divid_operate_date', unique=True),
+    )
+
+
 class Industry(Base):
     """行业分类表"""
     __tablename__ = "industries"
@@ -76,6 +127,62 @@ class Industry(Base):
     parent = relationship("Industry", remote_side=[code], backref="children")
 
 
+class IndustryRankSnapshot(Base):
+    """行业月份排名快照表（数据更新后一次性预先计算12个月的排名）"""
+    __tablename__ = "industry_rank_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    version = Column(Integer, nullable=False, index=True, comment="快照版本号")
+    month = Column(Integer, nullable=False, comment="月份")
+    total_industries = Column(Integer, default=0, comment="参与计算的行业总数")
+    result_data = Column(Text, comment="JSON格式的完整排名（未按最小涨跌次数过滤）")
+    created_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        Index('idx_snapshot_version_month', 'version', 'month', unique=True),
+    )
+
+
+class UpdateJob(Base):
+    """数据更新任务表（记录进度，中断后可继续）"""
+    __tablename__ = "update_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String(20), default="monthly_k", comment="任务类型")
+    status = Column(String(20), default="pending", index=True, comment="状态：pending/running/pausing/paused/completed/failed")
+    stock_codes = Column(Text, comment="JSON格式的股票代码列表，为空表示全市场")
+    force_update = Column(Integer, default=0, comment="是否强制更新全部数据：0-否，1-是")
+    planned = Column(Integer, default=0, comment="是否已生成更新计划：0-否，1-是")
+    total_count = Column(Integer, default=0, comment="需要获取的股票数")
+    skipped_count = Column(Integer, default=0, comment="已是最新或已退市而跳过的股票数")
+    message = Column(String(200), comment="最近的进度信息")
+    last_error = Column(Text, comment="任务级错误信息")
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, comment="最近一次开始运行时间")
+    finished_at = Column(DateTime, comment="完成时间")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class UpdateJobItem(Base):
+    """数据更新任务的股票明细表（每只股票写入后立即提交，作为断点）"""
+    __tablename__ = "update_job_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("update_jobs.id"), nullable=False, comment="任务ID")
+    stock_code = Column(String(10), nullable=False, comment="股票代码")
+    start_date = Column(String(10), comment="获取开始日期")
+    status = Column(String(20), default="pending", comment="状态：pending/done/failed")
+    attempts = Column(Integer, default=0, comment="尝试次数")
+    last_error = Column(Text, comment="最近一次错误信息")
+    rows_written = Column(Integer, default=0, comment="新增记录数")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index('idx_job_item_stock', 'job_id', 'stock_code', unique=True),
+        Index('idx_job_item_status', 'job_id', 'status'),
+    )
+
+
 class StatisticsCache(Base):
     """统计结果缓存表（可选，用于提升性能）"""
     __tablename__ = "statistics_cache"
@@ -0,0 +1,196 @@
+"""
+月K涨跌幅内存面板 - 进程内常驻的 股票 × (年, 月) 涨跌幅矩阵
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models import MonthlyKData
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple, Iterable
+import numpy as np
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class MonthlyPanel:
+    """月K涨跌幅面板
+    
+    pct_change: 形状为 (股票数, 年数, 12) 的float64数组，无数据或涨跌幅为空时为NaN
+    present: 同形状的bool数组，表示该月存在月K记录（涨跌幅为空的记录也计入统计年份）
+    version: 修补次数，数组内容变化后加1（共享内存中的副本据此判断是否需要重新发布）
+    """
+    
+    def __init__(self, codes: List[str], first_year: int, pct_change: np.ndarray, present: np.ndarray):
+        self.codes = list(codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.first_year = first_year
+        self.pct_change = pct_change
+        self.present = present
+        self.version = 0
+        # 保护数组的读取与修补，避免统计时读到修补了一半的数据
+        self._lock = threading.Lock()
+    
+    @property
+    def last_year(self) -> int:
+        return self.first_year + self.pct_change.shape[1] - 1
+    
+    @classmethod
+    def load(cls, db: Session) -> "MonthlyPanel":
+        """从数据库一次性加载所有股票的月K涨跌幅"""
+        rows = db.execute(select(
+            MonthlyKData.stock_code,
+            MonthlyKData.year,
+            MonthlyKData.month,
+            MonthlyKData.pct_change
+        )).all()
+        
+        if not rows:
+            current_year = datetime.now().year
+            return cls([], current_year, np.full((0, 1, 12), np.nan), np.zeros((0, 1, 12), dtype=bool))
+        
+        stock_codes, years, months, pct_changes = zip(*rows)
+        codes, stock_idx = np.unique(np.array(stock_codes), return_inverse=True)
+        years = np.array(years, dtype=np.int32)
+        months = np.array(months, dtype=np.int32)
+        
+        # 年份轴预留到当前年份，本年新增月份可以直接写入面板而无需重建
+        first_year = int(years.min())
+        last_year = max(int(years.max()), datetime.now().year)
+        shape = (len(codes), last_year - first_year + 1, 12)
+        
+        pct_change = np.full(shape, np.nan)
+        present = np.zeros(shape, dtype=bool)
+        pct_change[stock_idx, years - first_year, months - 1] = np.array(pct_changes, dtype=float)
+        present[stock_idx, years - first_year, months - 1] = True
+        
+        logger.info(f"月K面板加载完成：{shape[0]} 只股票，{first_year}-{last_year}，共 {len(rows)} 条记录")
+        return cls(codes.tolist(), first_year, pct_change, present)
+    
+    def replace_stock(self, code: str, rows: Iterable[Tuple[int, int, Optional[float]]]) -> bool:
+        """用 (年, 月, 涨跌幅) 记录覆盖单只股票的数据
+        
+        Returns:
+            股票不在面板中或年份超出范围时返回False，需要重建面板
+        """
+        idx = self.code_index.get(code)
+        if idx is None:
+            return False
+        
+        rows = list(rows)
+        if any(year < self.first_year or year > self.last_year for year, _, _ in rows):
+            return False
+        
+        with self._lock:
+            self.pct_change[idx] = np.nan
+            self.present[idx] = False
+            for year, month, pct_change in rows:
+                self.pct_change[idx, year - self.first_year, month - 1] = np.nan if pct_change is None else pct_change
+                self.present[idx, year - self.first_year, month - 1] = True
+            self.version += 1
+        return True
+    
+    def aggregate_arrays(self, stock_codes: List[str], months: Optional[List[int]] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """向量化计算多只股票的涨跌统计，结果保持为数组（用于排序选取前N名）
+        
+        Returns:
+            (股票在 stock_codes 中的位置, {字段: 数组})，字段与聚合元组的各项相同：
+            up_count、down_count、up_pct_sum、down_pct_sum、min_year、max_year、years_count；
+            不在面板中的股票不返回，没有数据的股票 years_count 为0
+        """
+        positions = np.array([i for i, code in enumerate(stock_codes) if code in self.code_index], dtype=np.int64)
+        month_columns = sorted({m - 1 for m in months if 1 <= m <= 12}) if months else list(range(12))
+        if len(positions) == 0 or not month_columns:
+            return np.zeros(0, dtype=np.int64), {
+                field: np.zeros(0) for field in AGGREGATE_FIELDS
+            }
+        
+        rows = np.array([self.code_index[stock_codes[i]] for i in positions])
+        with self._lock:
+            pct_change = self.pct_change[rows][:, :, month_columns]
+            present = self.present[rows][:, :, month_columns]
+        
+        # 展平为按时间顺序排列的二维数组，NaN与0比较均为False，不计入涨跌
+        flat = pct_change.reshape(len(rows), -1)
+        with np.errstate(invalid="ignore"):
+            up = flat > 0
+            down = flat < 0
+        
+        year_present = present.any(axis=2)
+        return positions, {
+            "up_count": up.sum(axis=1),
+            "down_count": down.sum(axis=1),
+            # 用cumsum按时间顺序逐项累加（np.sum为成对求和），保证与逐行累加的结果完全一致
+            "up_pct_sum": np.cumsum(np.where(up, flat, 0.0), axis=1)[:, -1],
+            "down_pct_sum": np.cumsum(np.where(down, flat, 0.0), axis=1)[:, -1],
+            "min_year": self.first_year + year_present.argmax(axis=1),
+            "max_year": self.first_year + year_present.shape[1] - 1 - year_present[:, ::-1].argmax(axis=1),
+            "years_count": year_present.sum(axis=1),
+        }
+    
+    def aggregate(self, stock_codes: List[str], months: Optional[List[int]] = None) -> Dict[str, Tuple]:
+        """向量化计算多只股票的涨跌统计
+        
+        Returns:
+            {股票代码: (上涨次数, 下跌次数, 涨幅合计, 跌幅合计, 最小年份, 最大年份, 年数)}，
+            与 StatisticsCalculator._query_monthly_aggregates 的返回格式一致
+        """
+        positions, arrays = self.aggregate_arrays(stock_codes, months)
+        return {
+            stock_codes[position]: aggregate_tuple(arrays, i)
+            for i, position in enumerate(positions)
+            if arrays["years_count"][i] > 0
+        }
+
+
+# 聚合元组的字段顺序
+AGGREGATE_FIELDS = ("up_count", "down_count", "up_pct_sum", "down_pct_sum", "min_year", "max_year", "years_count")
+
+
+def aggregate_tuple(arrays: Dict[str, np.ndarray], i: int) -> Tuple:
+    """取出第i只股票的聚合元组（转换为Python数值）"""
+    return (
+        int(arrays["up_count"][i]), int(arrays["down_count"][i]),
+        float(arrays["up_pct_sum"][i]), float(arrays["down_pct_sum"][i]),
+        int(arrays["min_year"][i]), int(arrays["max_year"][i]), int(arrays["years_count"][i])
+    )
+
+
+# 进程级面板实例，首次使用时加载，数据更新后按股票修补或标记重建
+_panel: Optional[MonthlyPanel] = None
+_panel_stale = False
+_panel_lock = threading.RLock()
+
+
+def get_monthly_panel(db: Session) -> MonthlyPanel:
+    """获取进程级月K面板，未加载或已失效时从数据库（重新）加载"""
+    global _panel, _panel_stale
+    with _panel_lock:
+        if _panel is None or _panel_stale:
+            _panel = MonthlyPanel.load(db)
+            _panel_stale = False
+        return _panel
+
+
+def refresh_monthly_panel_stock(db: Session, code: str):
+    """股票月K数据写入数据库后，用数据库中的最新记录修补面板"""
+    global _panel_stale
+    with _panel_lock:
+        if _panel is None or _panel_stale:
+            return
+        rows = db.execute(select(
+            MonthlyKData.year,
+            MonthlyKData.month,
+            MonthlyKData.pct_change
+        ).where(MonthlyKData.stock_code == code)).all()
+        if not _panel.replace_stock(code, rows):
+            # 新股票或新年份超出面板范围，下次使用时重建
+            _panel_stale = True
+
+
+def invalidate_monthly_panel():
+    """标记面板失效，下次使用时重建"""
+    global _panel_stale
+    with _panel_lock:
+        _panel_stale = True
@@ -0,0 +1,191 @@
+"""
+月K面板多进程统计 - 把涨跌幅面板发布到共享内存，由多个工作进程分片计算批量统计
+
+面板数组在数据变化后复制一次到 multiprocessing.shared_memory，工作进程直接映射
+共享内存中的数组（不复制），各自计算一个股票分片的统计信息和前N名，主进程合并结果。
+"""
+from multiprocessing import shared_memory
+from typing import List, Dict, Optional, Tuple
+from monthly_panel import MonthlyPanel
+from statistics import top_statistics, sort_statistics
+import numpy as np
+import multiprocessing
+import threading
+import atexit
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# ---------- 工作进程 ----------
+
+_attached: Dict[str, Tuple[List[shared_memory.SharedMemory], MonthlyPanel]] = {}
+
+
+def _attach_panel(meta: Dict) -> MonthlyPanel:
+    """映射共享内存中的面板数组，面板重新发布后释放旧的映射"""
+    key = meta["pct_change"][0]
+    entry = _attached.get(key)
+    if entry is None:
+        for blocks, _ in _attached.values():
+            for block in blocks:
+                block.close()
+        _attached.clear()
+        
+        blocks = []
+        arrays = {}
+        for field in ("pct_change", "present"):
+            name, shape, dtype = meta[field]
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[field] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        panel = MonthlyPanel(meta["codes"], meta["first_year"], arrays["pct_change"], arrays["present"])
+        entry = _attached[key] = (blocks, panel)
+    return entry[1]
+
+
+def compute_top_statistics(
+    panel: MonthlyPanel,
+    positions: List[int],
+    codes: List[str],
+    months: Optional[List[int]],
+    min_total_count: int,
+    order_by: str,
+    reverse: bool,
+    limit: int
+) -> List[Tuple[int, Dict]]:
+    """在当前进程中计算一组股票的统计信息，返回前N名 [(位置, 统计信息)]"""
+    index, arrays = panel.aggregate_arrays(codes, months)
+    return top_statistics(np.asarray(positions, dtype=np.int64)[index], arrays, order_by, reverse, limit, min_total_count)
+
+
+def _shard_top(meta: Dict, positions: List[int], rows: List[int], *args) -> List[Tuple[int, Dict]]:
+    """工作进程：计算一个股票分片的统计信息，返回分片内的前N名"""
+    panel = _attach_panel(meta)
+    return compute_top_statistics(panel, positions, [panel.codes[row] for row in rows], *args)
+
+
+# ---------- 主进程 ----------
+
+class SharedPanelExecutor:
+    """共享内存面板的多进程统计执行器
+    
+    同一时间只运行一个批量统计（每次统计已占用所有工作进程），
+    面板被替换或修补后，下次统计前重新发布到共享内存。
+    """
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._meta: Optional[Dict] = None
+        self._published: Optional[Tuple[MonthlyPanel, int]] = None
+        self._lock = threading.Lock()
+    
+    def _publish(self, panel: MonthlyPanel) -> Dict:
+        """把面板数组复制到新的共享内存（面板未变化时复用），返回工作进程映射所需的信息"""
+        if self._published is not None and self._published[0] is panel and self._published[1] == panel.version:
+            return self._meta
+        
+        blocks = []
+        meta = {"codes": panel.codes, "first_year": panel.first_year}
+        with panel._lock:
+            version = panel.version
+            for field in ("pct_change", "present"):
+                array = getattr(panel, field)
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                blocks.append(block)
+                meta[field] = (block.name, array.shape, array.dtype.str)
+        
+        # 工作进程已映射的旧共享内存在释放映射后才真正回收
+        self._release_blocks()
+        self._blocks = blocks
+        self._meta = meta
+        self._published = (panel, version)
+        logger.info(f"月K面板已发布到共享内存：{len(panel.codes)} 只股票，{sum(block.size for block in blocks) / 1024 / 1024:.1f} MB")
+        return meta
+    
+    def _release_blocks(self):
+        for block in self._blocks:
+            try:
+                block.close()
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+    
+    def _get_pool(self):
+        if self._pool is None:
+            # 使用spawn启动工作进程，避免在多线程的Web服务中fork
+            ctx = multiprocessing.get_context("spawn")
+            self._pool = ctx.Pool(processes=self.workers)
+        return self._pool
+    
+    def top_statistics(
+        self,
+        panel: MonthlyPanel,
+        stock_codes: List[str],
+        months: Optional[List[int]] = None,
+        min_total_count: int = 0,
+        order_by: str = "up_probability",
+        reverse: bool = True,
+        limit: int = 20
+    ) -> List[Tuple[int, Dict]]:
+        """多进程计算股票统计信息并取前N名
+        
+        Args:
+            panel: 月K面板
+            stock_codes: 股票代码列表（按结果中相同值的先后顺序排列）
+        
+        Returns:
+            [(股票在 stock_codes 中的位置, 统计信息)]，按排序字段排列
+        """
+        positions = [i for i, code in enumerate(stock_codes) if code in panel.code_index]
+        rows = [panel.code_index[stock_codes[i]] for i in positions]
+        if not positions:
+            return []
+        
+        with self._lock:
+            meta = self._publish(panel)
+            pool = self._get_pool()
+            
+            shard_count = min(self.workers, len(positions))
+            bounds = np.linspace(0, len(positions), shard_count + 1, dtype=int)
+            tasks = [
+                pool.apply_async(_shard_top, (
+                    meta, positions[start:end], rows[start:end],
+                    months, min_total_count, order_by, reverse, limit
+                ))
+                for start, end in zip(bounds[:-1], bounds[1:])
+            ]
+            candidates = [candidate for task in tasks for candidate in task.get()]
+        
+        return sort_statistics(candidates, order_by, reverse, limit)
+    
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+            self._release_blocks()
+            self._published = None
+
+
+_executor: Optional[SharedPanelExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_panel_executor(workers: int) -> SharedPanelExecutor:
+    """获取进程级执行器，工作进程数变化时重新创建"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor.workers != workers:
+            _executor.close()
+            _executor = None
+        if _executor is None:
+            _executor = SharedPanelExecutor(workers)
+            atexit.register(_executor.close)
+        return _executor
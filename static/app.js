@@ -341,20 +341,66 @@ async function queryBatch() {
     resultsDiv.innerHTML = '';
     
     try {
+        // 以NDJSON流式获取结果，收到一行显示一行
         const response = await fetch('/api/stocks/batch', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson'
             },
-            body: JSON.stringify(currentQuery)
+            body: JSON.stringify({ ...currentQuery, stream: true })
         });
         
         if (!response.ok) {
             throw new Error('查询失败');
         }
         
-        const data = await response.json();
-        displayBatchResults(data.results);
+        if (!response.body) {
+            throw new Error('响应体为空');
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        const results = [];
+        let tbody = null;
+        let buffer = '';
+        
+        function handleLine(line) {
+            if (!line.trim()) {
+                return;
+            }
+            const data = JSON.parse(line);
+            if (data.done) {
+                return;
+            }
+            if (!tbody) {
+                tbody = createBatchTable();
+                loadingDiv.classList.remove('active');
+            }
+            results.push(data);
+            appendBatchRow(tbody, data);
+        }
+        
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                handleLine(buffer);
+                break;
+            }
+            
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() || ''; // 保留最后一行（可能不完整）
+            lines.forEach(handleLine);
+        }
+        
+        if (results.length === 0) {
+            resultsDiv.innerHTML = '<div class="error">未找到符合条件的股票</div>';
+            return;
+        }
+        
+        // 绘制图表
+        drawBatchChart(results);
     } catch (error) {
         resultsDiv.innerHTML = `<div class="error">查询失败: ${error.message}</div>`;
     } finally {
@@ -362,16 +408,10 @@ async function queryBatch() {
     }
 }
 
-// 显示批量查询结果
-function displayBatchResults(results) {
+// 创建批量查询结果表格，返回用于追加行的tbody
+function createBatchTable() {
     const resultsDiv = document.getElementById('batch-results');
-    
-    if (results.length === 0) {
-        resultsDiv.innerHTML = '<div class="error">未找到符合条件的股票</div>';
-        return;
-    }
-    
-    let tableHTML = `
+    resultsDiv.innerHTML = `
         <table class="results-table">
             <thead>
                 <tr>
@@ -387,33 +427,27 @@ function displayBatchResults(results) {
                 </tr>
             </thead>
             <tbody>
-    `;
-    
-    results.forEach(stock => {
-        tableHTML += `
-            <tr>
-                <td>${stock.rank}</td>
-                <td>${stock.stock_code}</td>
-                <td>${stock.stock_name}</td>
-                <td>${stock.up_count}</td>
-                <td>${stock.down_count}</td>
-                <td>${stock.up_probability}%</td>
-                <td>${stock.avg_up_pct}%</td>
-                <td>${stock.avg_down_pct}%</td>
-                <td>${stock.year_range}</td>
-            </tr>
-        `;
-    });
-    
-    tableHTML += `
             </tbody>
         </table>
     `;
-    
-    resultsDiv.innerHTML = tableHTML;
-    
-    // 绘制图表
-    drawBatchChart(results);
+    return resultsDiv.querySelector('tbody');
+}
+
+// 在批量查询结果表格中追加一行
+function appendBatchRow(tbody, stock) {
+    tbody.insertAdjacentHTML('beforeend', `
+        <tr>
+            <td>${stock.rank}</td>
+            <td>${stock.stock_code}</td>
+            <td>${stock.stock_name}</td>
+            <td>${stock.up_count}</td>
+            <td>${stock.down_count}</td>
+            <td>${stock.up_probability}%</td>
+            <td>${stock.avg_up_pct}%</td>
+            <td>${stock.avg_down_pct}%</td>
+            <td>${stock.year_range}</td>
+        </tr>
+    `);
 }
 
 // 绘制批量查询图表
@@ -819,11 +853,13 @@ function displayIndustryRankResult(data) {
     const statsInfo = totalIndustries > data.count ? 
         `共查询 ${totalIndustries} 个行业，成功 ${successCount} 个，失败 ${failedCount} 个，显示前 ${data.count} 个` :
         `共找到 ${data.count} 个行业`;
+    // 来自预先计算的快照时显示数据时间
+    const snapshotInfo = data.snapshot_at ? `（排名快照：${data.snapshot_at}）` : '';
     
     let html = `
         <div class="stats-card">
             <h3>${monthNames[data.month]} 行业上涨概率排名</h3>
-            <p style="color: #666; margin-bottom: 20px;">${statsInfo}</p>
+            <p style="color: #666; margin-bottom: 20px;">${statsInfo}${snapshotInfo}</p>
             <table class="data-table" style="width: 100%; border-collapse: collapse;">
                 <thead>
                     <tr style="background: #f8f9fa; border-bottom: 2px solid #dee2e6;">
@@ -1128,6 +1164,23 @@ async function updateStockList() {
     }
 }
 
+// 格式化进度事件中的处理速度和预计剩余时间
+function formatProgressStats(data) {
+    const parts = [];
+    if (data.stocks_per_sec) {
+        parts.push(`${data.stocks_per_sec} 只/秒`);
+    }
+    if (data.rows_per_sec) {
+        parts.push(`${data.rows_per_sec} 条/秒`);
+    }
+    if (data.eta !== null && data.eta !== undefined) {
+        const seconds = Math.round(data.eta);
+        const minutes = Math.floor(seconds / 60);
+        parts.push(`预计剩余 ${minutes > 0 ? minutes + '分' : ''}${seconds % 60}秒`);
+    }
+    return parts.length > 0 ? `（${parts.join('，')}）` : '';
+}
+
 // 更新月K数据（带进度显示）
 async function updateMonthlyData() {
     const messageDiv = document.getElementById('update-message');
@@ -1242,7 +1295,7 @@ async function updateMonthlyData() {
         
         // 更新进度文本
         if (data.message && progressText) {
-            progressText.textContent = data.message;
+            progressText.textContent = data.message + (data.done || data.error ? '' : formatProgressStats(data));
         }
         
         // 如果完成或出错，显示最终消息
@@ -1258,6 +1311,25 @@ async function updateMonthlyData() {
     }
 }
 
+// 导出参数：勾选"导出全部股票"时忽略显示数量
+function getExportQuery() {
+    const exportAll = document.getElementById('export-all');
+    return { ...currentQuery, export_all: Boolean(exportAll && exportAll.checked) };
+}
+
+// 从Content-Disposition响应头获取文件名，优先使用UTF-8编码的中文文件名
+function getExportFilename(contentDisposition, defaultName) {
+    if (!contentDisposition) {
+        return defaultName;
+    }
+    const encodedMatch = contentDisposition.match(/filename\*=UTF-8''([^;]+)/i);
+    if (encodedMatch) {
+        return decodeURIComponent(encodedMatch[1]);
+    }
+    const filenameMatch = contentDisposition.match(/filename="?([^";]+)"?/);
+    return filenameMatch ? filenameMatch[1] : defaultName;
+}
+
 // 导出Excel
 async function exportExcel() {
     if (!currentQuery) {
@@ -1271,7 +1343,7 @@ async function exportExcel() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify(currentQuery)
+            body: JSON.stringify(getExportQuery())
         });
         
         if (!response.ok) {
@@ -1280,14 +1352,10 @@ async function exportExcel() {
         }
         
         // 从响应头获取文件名
-        const contentDisposition = response.headers.get('Content-Disposition');
-        let filename = `stock_statistics_${new Date().toISOString().slice(0,10)}.xlsx`;
-        if (contentDisposition) {
-            const filenameMatch = contentDisposition.match(/filename="?(.+)"?/);
-            if (filenameMatch) {
-                filename = filenameMatch[1];
-            }
-        }
+        const filename = getExportFilename(
+            response.headers.get('Content-Disposition'),
+            `stock_statistics_${new Date().toISOString().slice(0,10)}.xlsx`
+        );
         
         const blob = await response.blob();
         const url = window.URL.createObjectURL(blob);
@@ -1316,7 +1384,7 @@ async function exportCSV() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify(currentQuery)
+            body: JSON.stringify(getExportQuery())
         });
         
         if (!response.ok) {
@@ -1325,14 +1393,10 @@ async function exportCSV() {
         }
         
         // 从响应头获取文件名
-        const contentDisposition = response.headers.get('Content-Disposition');
-        let filename = `stock_statistics_${new Date().toISOString().slice(0,10)}.csv`;
-        if (contentDisposition) {
-            const filenameMatch = contentDisposition.match(/filename="?(.+)"?/);
-            if (filenameMatch) {
-                filename = filenameMatch[1];
-            }
-        }
+        const filename = getExportFilename(
+            response.headers.get('Content-Disposition'),
+            `stock_statistics_${new Date().toISOString().slice(0,10)}.csv`
+        );
         
         const blob = await response.blob();
         const url = window.URL.createObjectURL(blob);
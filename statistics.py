@@ -3,43 +3,280 @@
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
-from models import Stock, MonthlyKData, Industry
+from models import Stock, MonthlyKData, IndexMonthlyKData, Industry, IndustryRankSnapshot
+from monthly_panel import get_monthly_panel, aggregate_tuple, AGGREGATE_FIELDS
+from statistics_cache import StatisticsResultCache, normalize_months
+from config import STATISTICS_CONFIG
 from datetime import date, datetime
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Iterator, Optional, Tuple
+import numpy as np
 import pandas as pd
+import base64
+import binascii
+import json
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 可以直接在聚合数组上选取前N名的排序字段：{字段: 统计信息中四舍五入造成的最大偏差}
+TOP_K_ORDER_KEYS = {
+    "up_probability": 0.01,
+    "down_probability": 0.01,
+    "avg_up_pct": 0.01,
+    "avg_down_pct": 0.01,
+    "up_count": 0,
+    "down_count": 0,
+    "total_count": 0,
+    "years_count": 0,
+}
+
+# 来自股票信息而不是统计信息的排序字段（批量统计结果行中的字段）
+STOCK_ORDER_KEYS = ("stock_code", "stock_name", "market", "listing_date")
+
+
+def _valid_index(arrays: Dict[str, np.ndarray], min_total_count: int = 0) -> np.ndarray:
+    """有统计结果（有涨跌记录且满足最小涨跌次数）的行下标，按原顺序排列"""
+    total_count = arrays["up_count"].astype(np.int64) + arrays["down_count"].astype(np.int64)
+    valid = (arrays["years_count"] > 0) & (total_count > 0)
+    if min_total_count > 0:
+        valid &= total_count >= min_total_count
+    return np.flatnonzero(valid)
+
+
+def _order_keys(arrays: Dict[str, np.ndarray], index: np.ndarray, order_by: str, reverse: bool) -> np.ndarray:
+    """计算未舍入的排序字段值，转换为越小越靠前的排序键（order_by 须在 TOP_K_ORDER_KEYS 中）"""
+    up = arrays["up_count"][index].astype(np.int64)
+    down = arrays["down_count"][index].astype(np.int64)
+    total = up + down
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if order_by == "up_probability":
+            values = up / total * 100
+        elif order_by == "down_probability":
+            values = down / total * 100
+        elif order_by == "avg_up_pct":
+            values = np.where(up > 0, arrays["up_pct_sum"][index] / up, 0.0)
+        elif order_by == "avg_down_pct":
+            values = np.where(down > 0, arrays["down_pct_sum"][index] / down, 0.0)
+        elif order_by == "total_count":
+            values = total
+        else:
+            values = arrays[order_by][index]
+    values = values.astype(float)
+    return -values if reverse else values
+
+
+def _partition_candidates(index: np.ndarray, keys: np.ndarray, limit: int, tolerance: float) -> np.ndarray:
+    """用argpartition选出排序键前 limit 名，并保留与第 limit 名相差不超过 tolerance 的行"""
+    if limit <= 0 or len(index) <= limit:
+        return index
+    threshold = np.partition(keys, limit - 1)[limit - 1] + tolerance
+    return index[keys <= threshold]
+
+
+def select_top_k(arrays: Dict[str, np.ndarray], order_by: str, reverse: bool, limit: int, min_total_count: int = 0) -> np.ndarray:
+    """从聚合数组中选出可能进入前N名的股票，返回按原顺序排列的数组下标
+    
+    统计信息中的概率和平均涨跌幅保留两位小数，最终排序使用舍入后的值，
+    因此按未舍入的值用argpartition选取，并保留与第N名相差不超过舍入偏差的股票；
+    调用方按舍入后的值稳定排序后，结果与完整排序再截取前N名一致。
+    排序字段不在 TOP_K_ORDER_KEYS 中时返回所有有效股票。
+    """
+    index = _valid_index(arrays, min_total_count)
+    if order_by not in TOP_K_ORDER_KEYS:
+        return index
+    keys = _order_keys(arrays, index, order_by, reverse)
+    return _partition_candidates(index, keys, limit, TOP_K_ORDER_KEYS[order_by])
+
+
+def order_value(stock, stats: Dict, order_by: str):
+    """一行结果的排序字段值：统计信息中没有的字段（股票代码、名称、上市日期等）取批量统计结果行中的值"""
+    if order_by in stats or stock is None:
+        return stats.get(order_by, 0)
+    return StatisticsCalculator._batch_result(stock, stats, 0).get(order_by, 0)
+
+
+def sort_statistics(
+    candidates: List[Tuple[int, Dict]],
+    order_by: str,
+    reverse: bool,
+    limit: int,
+    stocks: Optional[List] = None
+) -> List[Tuple[int, Dict]]:
+    """按排序字段取前N名，相同值按股票顺序排列（与对全部结果稳定排序后截取一致）
+    
+    Args:
+        candidates: [(股票在查询结果中的位置, 统计信息)]
+        stocks: 查询结果中的股票，按 STOCK_ORDER_KEYS 中的字段排序时必须提供
+    """
+    if order_by in STOCK_ORDER_KEYS and stocks is None:
+        raise ValueError(f"按 {order_by} 排序需要提供股票信息")
+    candidates.sort(key=lambda item: item[0])
+    candidates.sort(
+        key=lambda item: order_value(stocks[item[0]] if stocks is not None else None, item[1], order_by),
+        reverse=reverse
+    )
+    return candidates[:limit]
+
+
+def top_statistics(
+    positions: np.ndarray,
+    arrays: Dict[str, np.ndarray],
+    order_by: str,
+    reverse: bool,
+    limit: int,
+    min_total_count: int = 0,
+    stocks: Optional[List] = None
+) -> List[Tuple[int, Dict]]:
+    """由聚合数组计算前N名股票的统计信息，只为候选股票生成统计字典
+    
+    Args:
+        positions: 各行聚合数据对应的股票位置
+        arrays: 聚合数组（见 MonthlyPanel.aggregate_arrays）
+        stocks: 查询结果中的股票，按 STOCK_ORDER_KEYS 中的字段排序时必须提供
+    
+    Returns:
+        [(股票位置, 统计信息)]，按排序字段排列
+    """
+    candidates = []
+    for i in select_top_k(arrays, order_by, reverse, limit, min_total_count):
+        stats = StatisticsCalculator._build_statistics(*aggregate_tuple(arrays, i))
+        if not stats:
+            continue
+        if min_total_count > 0 and stats["total_count"] < min_total_count:
+            continue
+        candidates.append((int(positions[i]), stats))
+    return sort_statistics(candidates, order_by, reverse, limit, stocks)
+
+
+class BatchRanking:
+    """批量统计的排名结果集：聚合数组已经计算好，按游标逐页生成统计信息
+    
+    排名顺序为排序字段值（按排序方向），相同值按股票ID升序；游标是上一页最后一行的
+    (排序字段值, 股票ID)，下一页从排在它之后的股票开始，数据不变时翻页结果稳定。
+    """
+    
+    def __init__(self, stocks: List, positions: np.ndarray, arrays: Dict[str, np.ndarray], order_by: str, reverse: bool, min_total_count: int = 0):
+        self.stocks = stocks
+        self.positions = positions
+        self.arrays = arrays
+        self.order_by = order_by
+        self.reverse = reverse
+        self._index = _valid_index(arrays, min_total_count)
+        self.total = len(self._index)
+        self._keys = _order_keys(arrays, self._index, order_by, reverse) if order_by in TOP_K_ORDER_KEYS else None
+        self._sorted: Optional[List[Tuple[int, Dict]]] = None
+    
+    def _candidates(self, selected: np.ndarray) -> List[Tuple[int, Dict]]:
+        return [
+            (int(self.positions[i]), StatisticsCalculator._build_statistics(*aggregate_tuple(self.arrays, i)))
+            for i in selected
+        ]
+    
+    def _is_after(self, position: int, stats: Dict, after: Tuple) -> bool:
+        value, stock_id = after
+        current = order_value(self.stocks[position], stats, self.order_by)
+        if current == value:
+            return self.stocks[position].id > stock_id
+        return current < value if self.reverse else current > value
+    
+    def page(self, after: Optional[Tuple] = None, size: int = 100) -> Tuple[List[Dict], Optional[Tuple]]:
+        """取游标之后的一页结果
+        
+        Args:
+            after: 上一页最后一行的 (排序字段值, 股票ID)，None表示第一页
+            size: 每页行数
+        
+        Returns:
+            (结果行（包含排名rank）, 下一页游标)，没有更多结果时游标为None
+        """
+        if self._keys is None:
+            # 排序字段无法向量化计算：生成全部统计信息后排序一次
+            if self._sorted is None:
+                self._sorted = sort_statistics(
+                    self._candidates(self._index), self.order_by, self.reverse, self.total, self.stocks
+                )
+            items = self._sorted if after is None else [item for item in self._sorted if self._is_after(*item, after)]
+            rank_offset = self.total - len(items)
+            items = items[:size]
+        else:
+            tolerance = TOP_K_ORDER_KEYS[self.order_by]
+            if after is None:
+                rank_offset = 0
+                candidates = self._candidates(_partition_candidates(self._index, self._keys, size, tolerance))
+            else:
+                # 与游标相差不超过舍入偏差的行逐行比较舍入后的值，更靠后的行直接参与选取
+                cursor_key = -after[0] if self.reverse else after[0]
+                band = np.abs(self._keys - cursor_key) <= tolerance
+                behind = (self._keys > cursor_key) & ~band
+                candidates = [item for item in self._candidates(self._index[band]) if self._is_after(*item, after)]
+                rank_offset = self.total - len(candidates) - int(behind.sum())
+                candidates += self._candidates(
+                    _partition_candidates(self._index[behind], self._keys[behind], size, tolerance)
+                )
+            items = sort_statistics(candidates, self.order_by, self.reverse, size)
+        
+        rows = [
+            StatisticsCalculator._batch_result(self.stocks[position], stats, rank_offset + i)
+            for i, (position, stats) in enumerate(items, 1)
+        ]
+        next_after = None
+        if items and rank_offset + len(items) < self.total:
+            position, stats = items[-1]
+            next_after = (order_value(self.stocks[position], stats, self.order_by), self.stocks[position].id)
+        return rows, next_after
+    
+    def iter_pages(self, total: int, first_page_size: int, page_size: int) -> Iterator[List[Dict]]:
+        """从第一名开始逐页生成结果，共 total 行；第一页较小以便尽快输出"""
+        after = None
+        count = 0
+        size = first_page_size
+        while count < total:
+            rows, after = self.page(after, size)
+            rows = rows[:total - count]
+            if rows:
+                count += len(rows)
+                yield rows
+            if after is None:
+                break
+            size = page_size
+    
+    @staticmethod
+    def encode_cursor(order_by: str, after: Tuple) -> str:
+        """把游标编码为URL安全的字符串"""
+        data = json.dumps({"order_by": order_by, "value": after[0], "id": after[1]}, ensure_ascii=False)
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+    
+    @staticmethod
+    def decode_cursor(cursor: str, order_by: str) -> Tuple:
+        """解析游标，格式错误或排序字段不一致时抛出ValueError"""
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+            if data["order_by"] != order_by:
+                raise ValueError("游标的排序字段与查询不一致")
+            return data["value"], int(data["id"])
+        except (KeyError, TypeError, UnicodeError, json.JSONDecodeError, binascii.Error) as e:
+            raise ValueError(f"无效的游标: {e}")
+
 
 class StatisticsCalculator:
     """统计分析计算器"""
     
     def __init__(self, db: Session):
         self.db = db
+        self.cache = StatisticsResultCache(db) if STATISTICS_CONFIG.get("enable_result_cache", True) else None
     
-    def _calculate_statistics_from_data(self, monthly_data: List) -> Optional[Dict]:
-        """从月K数据计算统计信息（内部方法）"""
-        if not monthly_data:
-            return None
-        
-        up_count = 0
-        down_count = 0
-        up_pct_sum = 0.0
-        down_pct_sum = 0.0
-        years = set()
-        
-        for data in monthly_data:
-            years.add(data.year)
-            if data.pct_change is not None:
-                if data.pct_change > 0:
-                    up_count += 1
-                    up_pct_sum += data.pct_change
-                elif data.pct_change < 0:
-                    down_count += 1
-                    down_pct_sum += data.pct_change
-        
+    @staticmethod
+    def _build_statistics(
+        up_count: int,
+        down_count: int,
+        up_pct_sum: float,
+        down_pct_sum: float,
+        min_year: Optional[int],
+        max_year: Optional[int],
+        years_count: int
+    ) -> Optional[Dict]:
+        """由聚合后的涨跌次数、涨跌幅合计和年份范围生成统计信息（内部方法）"""
         total_count = up_count + down_count
         if total_count == 0:
             return None
@@ -49,7 +286,7 @@ class StatisticsCalculator:
         avg_up_pct = (up_pct_sum / up_count) if up_count > 0 else 0
         avg_down_pct = (down_pct_sum / down_count) if down_count > 0 else 0
         
-        year_range = f"{min(years)}-{max(years)}" if years else ""
+        year_range = f"{min_year}-{max_year}" if years_count else ""
         
         return {
             "up_count": up_count,
@@ -60,7 +297,101 @@ class StatisticsCalculator:
             "avg_up_pct": round(avg_up_pct, 2),
             "avg_down_pct": round(avg_down_pct, 2),
             "year_range": year_range,
-            "years_count": len(years)
+            "years_count": years_count
+        }
+    
+    def _query_monthly_aggregates(self, stock_filters: List, months: Optional[List[int]] = None) -> Dict[str, Tuple]:
+        """单次按时间顺序扫描月K涨跌幅，聚合出所有股票的涨跌统计（内部方法）
+        
+        按 (股票代码, 年, 月) 顺序逐行累加，累加顺序与逐只股票计算时一致，
+        保证四舍五入后的平均涨跌幅与原结果完全相同（SQL的SUM可能使用补偿求和，结果末位会不同）。
+        
+        Args:
+            stock_filters: 作用于Stock表的过滤条件
+            months: 月份列表，None表示所有月份
+        
+        Returns:
+            {股票代码: (上涨次数, 下跌次数, 涨幅合计, 跌幅合计, 最小年份, 最大年份, 年数)}
+        """
+        query = self.db.query(
+            MonthlyKData.stock_code,
+            MonthlyKData.year,
+            MonthlyKData.pct_change
+        ).join(Stock, Stock.code == MonthlyKData.stock_code)
+        
+        if stock_filters:
+            query = query.filter(*stock_filters)
+        
+        if months:
+            query = query.filter(MonthlyKData.month.in_(months))
+        
+        query = query.order_by(MonthlyKData.stock_code, MonthlyKData.year, MonthlyKData.month)
+        
+        aggregates = {}
+        current_code = None
+        up_count = down_count = 0
+        up_pct_sum = down_pct_sum = 0.0
+        min_year = last_year = None
+        years_count = 0
+        
+        for stock_code, year, pct_change in self.db.execute(query.statement):
+            if stock_code != current_code:
+                if current_code is not None:
+                    aggregates[current_code] = (
+                        up_count, down_count, up_pct_sum, down_pct_sum,
+                        min_year, last_year, years_count
+                    )
+                current_code = stock_code
+                up_count = down_count = 0
+                up_pct_sum = down_pct_sum = 0.0
+                min_year = last_year = year
+                years_count = 1
+            elif year != last_year:
+                last_year = year
+                years_count += 1
+            
+            if pct_change is not None:
+                if pct_change > 0:
+                    up_count += 1
+                    up_pct_sum += pct_change
+                elif pct_change < 0:
+                    down_count += 1
+                    down_pct_sum += pct_change
+        
+        if current_code is not None:
+            aggregates[current_code] = (
+                up_count, down_count, up_pct_sum, down_pct_sum,
+                min_year, last_year, years_count
+            )
+        
+        return aggregates
+    
+    def _load_monthly_aggregates(
+        self,
+        stock_codes: List[str],
+        stock_filters: List,
+        months: Optional[List[int]] = None
+    ) -> Dict[str, Tuple]:
+        """获取股票的涨跌聚合数据：优先使用内存面板，未启用时扫描数据库（内部方法）"""
+        if STATISTICS_CONFIG.get("use_memory_panel", True):
+            return get_monthly_panel(self.db).aggregate(stock_codes, months)
+        return self._query_monthly_aggregates(stock_filters, months)
+    
+    def _load_aggregate_arrays(
+        self,
+        stock_codes: List[str],
+        stock_filters: List,
+        months: Optional[List[int]] = None
+    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """获取股票的涨跌聚合数据（数组形式，见 MonthlyPanel.aggregate_arrays）"""
+        if STATISTICS_CONFIG.get("use_memory_panel", True):
+            return get_monthly_panel(self.db).aggregate_arrays(stock_codes, months)
+        
+        aggregates = self._load_monthly_aggregates(stock_codes, stock_filters, months)
+        positions = [i for i, code in enumerate(stock_codes) if code in aggregates]
+        values = np.array([aggregates[stock_codes[i]] for i in positions], dtype=float).reshape(-1, len(AGGREGATE_FIELDS))
+        return np.array(positions, dtype=np.int64), {
+            field: values[:, j] for j, field in enumerate(AGGREGATE_FIELDS)
         }
     
     def calculate_stock_statistics(
@@ -78,22 +409,38 @@ class StatisticsCalculator:
             min_total_count: 最小总涨跌次数
             group_by_month: True=按月统计，False=汇总统计
         """
+        params = {
+            "stock_code": stock_code,
+            "months": normalize_months(months),
+            "min_total_count": min_total_count,
+            "group_by_month": bool(group_by_month and months and len(months) > 1)
+        }
+        if self.cache:
+            cached = self.cache.get("stock", params)
+            if cached is not None:
+                return cached
+        
+        result = self._calculate_stock_statistics(stock_code, months, min_total_count, group_by_month)
+        
+        if self.cache:
+            self.cache.set("stock", params, result, stock_code=stock_code)
+        return result
+    
+    def _calculate_stock_statistics(
+        self,
+        stock_code: str,
+        months: Optional[List[int]] = None,
+        min_total_count: int = 0,
+        group_by_month: bool = False
+    ) -> Optional[Dict]:
+        """计算单只股票的统计信息（不使用缓存）"""
         stock = self.db.query(Stock).filter(Stock.code == stock_code).first()
         if not stock:
             return None
         
-        # 构建查询条件
-        query = self.db.query(MonthlyKData).filter(
-            MonthlyKData.stock_code == stock_code
-        )
-        
-        if months:
-            query = query.filter(MonthlyKData.month.in_(months))
-        
-        # 获取所有月K数据
-        monthly_data = query.order_by(MonthlyKData.year, MonthlyKData.month).all()
-        
-        if not monthly_data:
+        stock_filters = [Stock.code == stock_code]
+        aggregate = self._load_monthly_aggregates([stock_code], stock_filters, months).get(stock_code)
+        if not aggregate:
             return None
         
         base_info = {
@@ -107,8 +454,8 @@ class StatisticsCalculator:
             # 按月统计模式
             monthly_stats = {}
             for month in months:
-                month_data = [d for d in monthly_data if d.month == month]
-                stats = self._calculate_statistics_from_data(month_data)
+                month_aggregate = self._load_monthly_aggregates([stock_code], stock_filters, [month]).get(stock_code)
+                stats = self._build_statistics(*month_aggregate) if month_aggregate else None
                 if stats:
                     monthly_stats[month] = stats
             
@@ -116,7 +463,7 @@ class StatisticsCalculator:
                 return None
             
             # 检查最小涨跌次数（检查汇总数据）
-            all_stats = self._calculate_statistics_from_data(monthly_data)
+            all_stats = self._build_statistics(*aggregate)
             if all_stats and min_total_count > 0 and all_stats["total_count"] < min_total_count:
                 return None
             
@@ -128,7 +475,7 @@ class StatisticsCalculator:
             }
         else:
             # 汇总统计模式
-            stats = self._calculate_statistics_from_data(monthly_data)
+            stats = self._build_statistics(*aggregate)
             if not stats:
                 return None
             
@@ -152,41 +499,186 @@ class StatisticsCalculator:
         limit: int = 20,
         order_by: str = "up_probability"
     ) -> List[Dict]:
-        """批量计算股票统计信息"""
-        # 构建股票查询
-        stock_query = self.db.query(Stock)
+        """批量计算股票统计信息
         
-        if market:
-            stock_query = stock_query.filter(Stock.market == market)
+        所有股票的涨跌统计通过内存面板的向量化计算（或一次有序扫描数据库）得到，
+        避免逐只股票查询月K数据；排序时先在聚合数组上选出前 limit 名的候选，
+        只为候选股票生成统计信息，相同值按股票ID顺序排列。
+        """
+        cached = self.get_cached_batch_statistics(
+            months, market, industry_code, min_total_count, exclude_delisted, limit, order_by
+        )
+        if cached is not None:
+            return cached
         
-        if industry_code:
-            stock_query = stock_query.filter(Stock.industry_code == industry_code)
+        results = self._calculate_batch_statistics(
+            months, market, industry_code, min_total_count, exclude_delisted, limit, order_by
+        )
         
-        if exclude_delisted:
-            stock_query = stock_query.filter(Stock.is_delisted == 0)
+        self.cache_batch_statistics(
+            results, months, market, industry_code, min_total_count, exclude_delisted, limit, order_by
+        )
+        return results
+    
+    @staticmethod
+    def _batch_cache_params(
+        months: Optional[List[int]],
+        market: Optional[str],
+        industry_code: Optional[str],
+        min_total_count: int,
+        exclude_delisted: bool,
+        limit: int,
+        order_by: str
+    ) -> Dict:
+        """批量统计的缓存参数（内部方法）"""
+        return {
+            "months": normalize_months(months),
+            "market": market,
+            "industry_code": industry_code,
+            "min_total_count": min_total_count,
+            "exclude_delisted": exclude_delisted,
+            "limit": limit,
+            "order_by": order_by
+        }
+    
+    def get_cached_batch_statistics(
+        self,
+        months: Optional[List[int]] = None,
+        market: Optional[str] = None,
+        industry_code: Optional[str] = None,
+        min_total_count: int = 0,
+        exclude_delisted: bool = True,
+        limit: int = 20,
+        order_by: str = "up_probability"
+    ) -> Optional[List[Dict]]:
+        """读取批量统计前 limit 名的缓存结果，未启用缓存或未命中时返回None"""
+        if not self.cache:
+            return None
+        return self.cache.get("batch", self._batch_cache_params(
+            months, market, industry_code, min_total_count, exclude_delisted, limit, order_by
+        ))
+    
+    def cache_batch_statistics(
+        self,
+        results: List[Dict],
+        months: Optional[List[int]] = None,
+        market: Optional[str] = None,
+        industry_code: Optional[str] = None,
+        min_total_count: int = 0,
+        exclude_delisted: bool = True,
+        limit: int = 20,
+        order_by: str = "up_probability"
+    ):
+        """缓存批量统计前 limit 名的完整结果
+        
+        calculate_batch_statistics 和按排名流式输出的前 limit 名结果相同，共用同一个缓存条目。
+        """
+        if self.cache:
+            self.cache.set("batch", self._batch_cache_params(
+                months, market, industry_code, min_total_count, exclude_delisted, limit, order_by
+            ), results, industry_code=industry_code)
+    
+    def _calculate_batch_statistics(
+        self,
+        months: Optional[List[int]] = None,
+        market: Optional[str] = None,
+        industry_code: Optional[str] = None,
+        min_total_count: int = 0,
+        exclude_delisted: bool = True,
+        limit: int = 20,
+        order_by: str = "up_probability"
+    ) -> List[Dict]:
+        """批量计算股票统计信息（不使用缓存）"""
+        stocks, stock_filters = self._query_batch_stocks(market, industry_code, exclude_delisted)
         
-        stocks = stock_query.all()
+        # 排序方向
+        reverse = True if order_by in ["up_probability", "avg_up_pct"] else False
         
-        results = []
-        for stock in stocks:
-            stats = self.calculate_stock_statistics(
-                stock.code,
-                months=months,
-                min_total_count=min_total_count
+        workers = STATISTICS_CONFIG.get("parallel_workers", 0)
+        # 按股票信息排序时工作进程中没有股票信息，只在当前进程中计算
+        if (workers > 1 and STATISTICS_CONFIG.get("use_memory_panel", True) and order_by not in STOCK_ORDER_KEYS
+                and len(stocks) >= STATISTICS_CONFIG.get("parallel_min_stocks", 0)):
+            return self._calculate_batch_statistics_parallel(
+                stocks, months, min_total_count, limit, order_by, reverse, workers
             )
-            
-            if stats:
-                results.append(stats)
         
-        # 排序
+        # 只为可能进入前N名的股票生成统计信息，相同值按股票ID顺序排列
+        positions, arrays = self._load_aggregate_arrays([stock.code for stock in stocks], stock_filters, months)
+        top = top_statistics(positions, arrays, order_by, reverse, limit, min_total_count, stocks)
+        return [self._batch_result(stocks[position], stats, rank) for rank, (position, stats) in enumerate(top, 1)]
+    
+    def rank_batch_statistics(
+        self,
+        months: Optional[List[int]] = None,
+        market: Optional[str] = None,
+        industry_code: Optional[str] = None,
+        min_total_count: int = 0,
+        exclude_delisted: bool = True,
+        order_by: str = "up_probability"
+    ) -> BatchRanking:
+        """批量统计的分页和流式查询：查询股票并计算聚合数组，返回可按游标取页的排名结果集"""
+        stocks, stock_filters = self._query_batch_stocks(market, industry_code, exclude_delisted)
+        positions, arrays = self._load_aggregate_arrays([stock.code for stock in stocks], stock_filters, months)
         reverse = True if order_by in ["up_probability", "avg_up_pct"] else False
-        results.sort(key=lambda x: x.get(order_by, 0), reverse=reverse)
+        return BatchRanking(stocks, positions, arrays, order_by, reverse, min_total_count)
+    
+    def _query_batch_stocks(self, market: Optional[str], industry_code: Optional[str], exclude_delisted: bool) -> Tuple[List, List]:
+        """按条件查询批量统计的股票（按ID排序），返回 (股票列表, 过滤条件)"""
+        # 构建股票过滤条件
+        stock_filters = []
         
-        # 添加排名
-        for i, result in enumerate(results[:limit], 1):
-            result["rank"] = i
+        if market:
+            stock_filters.append(Stock.market == market)
         
-        return results[:limit]
+        if industry_code:
+            stock_filters.append(Stock.industry_code == industry_code)
+        
+        if exclude_delisted:
+            stock_filters.append(Stock.is_delisted == 0)
+        
+        stocks = self.db.query(
+            Stock.id, Stock.code, Stock.name, Stock.market, Stock.listing_date
+        ).filter(*stock_filters).order_by(Stock.id).all()
+        return stocks, stock_filters
+    
+    @staticmethod
+    def _batch_result(stock, stats: Dict, rank: int) -> Dict:
+        """批量统计的一行结果"""
+        return {
+            "stock_code": stock.code,
+            "stock_name": stock.name,
+            "market": stock.market,
+            "listing_date": stock.listing_date.strftime('%Y-%m-%d'),
+            "statistics_mode": "summary",
+            **stats,
+            "rank": rank
+        }
+    
+    def _calculate_batch_statistics_parallel(
+        self,
+        stocks: List,
+        months: Optional[List[int]],
+        min_total_count: int,
+        limit: int,
+        order_by: str,
+        reverse: bool,
+        workers: int
+    ) -> List[Dict]:
+        """多进程计算批量统计：面板发布到共享内存，各工作进程计算一个股票分片的前N名后合并"""
+        from panel_executor import get_panel_executor
+        
+        panel = get_monthly_panel(self.db)
+        top = get_panel_executor(workers).top_statistics(
+            panel,
+            [stock.code for stock in stocks],
+            months=months,
+            min_total_count=min_total_count,
+            order_by=order_by,
+            reverse=reverse,
+            limit=limit
+        )
+        
+        return [self._batch_result(stocks[position], stats, rank) for rank, (position, stats) in enumerate(top, 1)]
     
     def calculate_industry_statistics(
         self,
@@ -211,9 +703,32 @@ class StatisticsCalculator:
             min_total_count: 最小总涨跌次数
             group_by_month: True=按月统计，False=汇总统计
         """
-        from data_collector import DataCollector
+        params = {
+            "industry_code": industry_code,
+            "months": normalize_months(months),
+            "min_total_count": min_total_count,
+            "group_by_month": bool(group_by_month and months and len(months) > 1)
+        }
+        if self.cache:
+            cached = self.cache.get("industry", params)
+            if cached is not None:
+                return cached
+        
+        result = self._calculate_industry_statistics(industry_code, months, min_total_count, group_by_month)
+        
+        if self.cache:
+            self.cache.set("industry", params, result, industry_code=industry_code)
+        return result
+    
+    def _calculate_industry_statistics(
+        self,
+        industry_code: str,
+        months: Optional[List[int]] = None,
+        min_total_count: int = 0,
+        group_by_month: bool = False
+    ) -> Optional[Dict]:
+        """计算行业统计信息（不使用缓存）"""
         from industry_index_mapping import get_index_code
-        from datetime import datetime
         
         industry = self.db.query(Industry).filter(Industry.code == industry_code).first()
         if not industry:
@@ -229,29 +744,11 @@ class StatisticsCalculator:
         
         logger.info(f"行业板块 '{industry_name}' 使用BaoStock指数代码: {index_code}")
         
-        # 获取行业板块的月K数据
-        collector = DataCollector(self.db)
-        start_date = "2000-01-01"
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # 从BaoStock获取行业板块月K数据
-        df = collector.get_industry_monthly_k_baostock(index_code, start_date, end_date)
-        
-        if df is None or len(df) == 0:
-            logger.warning(f"未能获取行业板块 {index_code} ({industry_name}) 的月K数据")
-            return None
-        
-        # 转换为月度数据列表
-        monthly_data = []
-        for _, row in df.iterrows():
-            if pd.notna(row.get('pct_change')):
-                monthly_data.append({
-                    'year': int(row['year']),
-                    'month': int(row['month']),
-                    'pct_change': float(row['pct_change'])
-                })
+        # 从本地指数月K数据读取行业板块的涨跌幅
+        monthly_data = self._load_index_monthly_data(index_code)
         
         if not monthly_data:
+            logger.warning(f"本地没有行业板块 {index_code} ({industry_name}) 的月K数据，请先更新行业指数数据")
             return None
         
         # 按月份筛选
@@ -277,141 +774,36 @@ class StatisticsCalculator:
             # 按月统计模式
             monthly_stats = {}
             for month in months:
-                month_data = [d for d in monthly_data if d['month'] == month]
-                if not month_data:
-                    continue
-                
-                # 计算该月的统计信息
-                up_count = 0
-                down_count = 0
-                up_pct_sum = 0.0
-                down_pct_sum = 0.0
-                years = set()
-                
-                for data in month_data:
-                    years.add(data['year'])
-                    pct_change = data['pct_change']
-                    if pct_change > 0:
-                        up_count += 1
-                        up_pct_sum += pct_change
-                    elif pct_change < 0:
-                        down_count += 1
-                        down_pct_sum += pct_change
-                
-                total_count = up_count + down_count
-                if total_count == 0:
-                    continue
-                
+                stats = self._summarize_index_data([d for d in monthly_data if d['month'] == month])
                 # 检查最小涨跌次数
-                if min_total_count > 0 and total_count < min_total_count:
-                    continue
-                
-                up_probability = (up_count / total_count * 100) if total_count > 0 else 0
-                down_probability = (down_count / total_count * 100) if total_count > 0 else 0
-                avg_up_pct = (up_pct_sum / up_count) if up_count > 0 else 0
-                avg_down_pct = (down_pct_sum / down_count) if down_count > 0 else 0
-                year_range = f"{min(years)}-{max(years)}" if years else ""
-                
-                monthly_stats[month] = {
-                    "up_count": up_count,
-                    "down_count": down_count,
-                    "total_count": total_count,
-                    "up_probability": round(up_probability, 2),
-                    "down_probability": round(down_probability, 2),
-                    "avg_up_pct": round(avg_up_pct, 2),
-                    "avg_down_pct": round(avg_down_pct, 2),
-                    "year_range": year_range
-                }
+                if stats and stats["total_count"] >= min_total_count:
+                    monthly_stats[month] = stats
             
             if not monthly_stats:
                 return None
             
             # 计算汇总统计（所有选中月份合并）
-            all_up_count = 0
-            all_down_count = 0
-            all_up_pct_sum = 0.0
-            all_down_pct_sum = 0.0
-            all_years = set()
-            
-            for data in monthly_data:
-                all_years.add(data['year'])
-                pct_change = data['pct_change']
-                if pct_change > 0:
-                    all_up_count += 1
-                    all_up_pct_sum += pct_change
-                elif pct_change < 0:
-                    all_down_count += 1
-                    all_down_pct_sum += pct_change
-            
-            all_total_count = all_up_count + all_down_count
-            if all_total_count == 0:
+            summary_stats = self._summarize_index_data(monthly_data)
+            if not summary_stats:
                 return None
             
-            all_up_probability = (all_up_count / all_total_count * 100) if all_total_count > 0 else 0
-            all_down_probability = (all_down_count / all_total_count * 100) if all_total_count > 0 else 0
-            all_avg_up_pct = (all_up_pct_sum / all_up_count) if all_up_count > 0 else 0
-            all_avg_down_pct = (all_down_pct_sum / all_down_count) if all_down_count > 0 else 0
-            all_year_range = f"{min(all_years)}-{max(all_years)}" if all_years else ""
-            
             return {
                 **base_info,
                 "statistics_mode": "monthly",
                 "monthly_statistics": monthly_stats,
-                "summary_statistics": {
-                    "up_count": all_up_count,
-                    "down_count": all_down_count,
-                    "total_count": all_total_count,
-                    "up_probability": round(all_up_probability, 2),
-                    "down_probability": round(all_down_probability, 2),
-                    "avg_up_pct": round(all_avg_up_pct, 2),
-                    "avg_down_pct": round(all_avg_down_pct, 2),
-                    "year_range": all_year_range
-                }
+                "summary_statistics": summary_stats
             }
         else:
             # 汇总统计模式
-            up_count = 0
-            down_count = 0
-            up_pct_sum = 0.0
-            down_pct_sum = 0.0
-            years = set()
-            
-            for data in monthly_data:
-                years.add(data['year'])
-                pct_change = data['pct_change']
-                if pct_change > 0:
-                    up_count += 1
-                    up_pct_sum += pct_change
-                elif pct_change < 0:
-                    down_count += 1
-                    down_pct_sum += pct_change
-            
-            total_count = up_count + down_count
-            if total_count == 0:
-                return None
-            
+            stats = self._summarize_index_data(monthly_data)
             # 检查最小涨跌次数
-            if min_total_count > 0 and total_count < min_total_count:
+            if not stats or stats["total_count"] < min_total_count:
                 return None
             
-            up_probability = (up_count / total_count * 100) if total_count > 0 else 0
-            down_probability = (down_count / total_count * 100) if total_count > 0 else 0
-            avg_up_pct = (up_pct_sum / up_count) if up_count > 0 else 0
-            avg_down_pct = (down_pct_sum / down_count) if down_count > 0 else 0
-            
-            year_range = f"{min(years)}-{max(years)}" if years else ""
-            
             return {
                 **base_info,
                 "statistics_mode": "summary",
-                "up_count": up_count,
-                "down_count": down_count,
-                "total_count": total_count,
-                "up_probability": round(up_probability, 2),
-                "down_probability": round(down_probability, 2),
-                "avg_up_pct": round(avg_up_pct, 2),
-                "avg_down_pct": round(avg_down_pct, 2),
-                "year_range": year_range
+                **stats
             }
     
     def calculate_industries_rank_by_month(
@@ -426,72 +818,15 @@ class StatisticsCalculator:
             month: 月份（1-12）
             min_total_count: 最小总涨跌次数
             limit: 返回前N名
-            
+        
         Returns:
             按上涨概率降序排列的行业统计列表
         """
-        from data_collector import DataCollector
-        import time
-        
-        # 获取所有行业
-        industries = self.get_industry_list()
-        total_industries = len(industries)
-        
-        logger.info(f"开始查询 {total_industries} 个行业在 {month} 月的统计数据")
-        
-        # 创建一个共享的DataCollector实例，避免重复登录
-        collector = DataCollector(self.db)
-        
-        results = []
-        success_count = 0
-        failed_count = 0
-        
-        for idx, industry in enumerate(industries):
-            if idx % 5 == 0:  # 每5个行业记录一次进度
-                logger.info(f"进度: {idx + 1}/{total_industries} - {industry['name']}")
-            try:
-                # 计算该行业在指定月份的统计数据，传入共享的collector
-                stats = self._calculate_industry_statistics_with_collector(
-                    industry_code=industry['code'],
-                    months=[month],
-                    min_total_count=min_total_count,
-                    group_by_month=False,
-                    collector=collector
-                )
-                
-                if stats and stats.get('statistics_mode') == 'summary':
-                    results.append({
-                        "industry_code": stats['industry_code'],
-                        "industry_name": stats['industry_name'],
-                        "stock_count": stats.get('stock_count', 0),
-                        "up_count": stats['up_count'],
-                        "down_count": stats['down_count'],
-                        "total_count": stats['total_count'],
-                        "up_probability": stats['up_probability'],
-                        "down_probability": stats['down_probability'],
-                        "avg_up_pct": stats['avg_up_pct'],
-                        "avg_down_pct": stats['avg_down_pct'],
-                        "year_range": stats['year_range']
-                    })
-                    success_count += 1
-                else:
-                    failed_count += 1
-                
-                # 减少延迟，因为已经复用了DataCollector，不需要太多延迟
-                if idx < len(industries) - 1:
-                    time.sleep(0.01)  # 每个请求间隔10ms（最小延迟，避免请求过快）
-                    
-            except Exception as e:
-                logger.warning(f"计算行业 {industry['name']} 统计失败: {e}")
-                failed_count += 1
-                continue
-        
-        logger.info(f"查询完成: 成功 {success_count} 个，失败 {failed_count} 个，共找到 {len(results)} 个有效结果")
-        
-        # 按上涨概率降序排序
-        results.sort(key=lambda x: x['up_probability'], reverse=True)
-        
-        return results[:limit]
+        return self.calculate_industries_rank_by_month_with_progress(
+            month=month,
+            min_total_count=min_total_count,
+            limit=limit
+        )
     
     def calculate_industries_rank_by_month_with_progress(
         self,
@@ -502,113 +837,59 @@ class StatisticsCalculator:
     ) -> List[Dict]:
         """计算所有行业在指定月份的统计数据，按上涨概率排序（带进度回调）
         
+        多个行业常常对应同一个指数，先把所有行业解析为指数代码，
+        每个不同的指数只读取一次（本地没有数据时才从BaoStock获取一次），
+        再把统计结果分发给对应该指数的所有行业。
+        
         Args:
             month: 月份（1-12）
             min_total_count: 最小总涨跌次数
             limit: 返回前N名
-            progress_callback: 进度回调函数 (current, total, message)
-            
+            progress_callback: 进度回调函数 (current, total, message)，按不同指数计数
+        
         Returns:
             按上涨概率降序排列的行业统计列表
         """
-        from data_collector import DataCollector
-        import time
-        
-        # 获取所有行业
+        # 获取所有行业，并解析对应的指数代码
         industries = self.get_industry_list()
         total_industries = len(industries)
+        industries_by_index = self._group_industries_by_index(industries)
         
-        logger.info(f"开始查询 {total_industries} 个行业在 {month} 月的统计数据")
+        logger.info(f"开始查询 {total_industries} 个行业在 {month} 月的统计数据，共 {len(industries_by_index)} 个不同指数")
         
-        # 创建一个共享的DataCollector实例，避免重复登录
-        collector = DataCollector(self.db)
+        # 行业下股票数量（用于显示）
+        stock_counts = self._count_stocks_by_industry()
         
-        results = []
-        success_count = 0
-        failed_count = 0
+        series_by_index = self._load_index_series(list(industries_by_index), progress_callback)
         
-        for idx, industry in enumerate(industries):
-            if progress_callback:
-                progress_callback(idx + 1, total_industries, f"正在查询 {industry['name']}...")
-            
-            if idx % 5 == 0:  # 每5个行业记录一次进度
-                logger.info(f"进度: {idx + 1}/{total_industries} - {industry['name']}")
+        stats_by_industry = {}
+        for index_code, index_industries in industries_by_index.items():
+            stats = self._summarize_index_data(
+                [d for d in series_by_index.get(index_code, []) if d['month'] == month]
+            )
+            if not stats:
+                continue
             
-            try:
-                # 使用线程实现超时机制（Windows兼容）
-                import threading
-                import queue as thread_queue
-                
-                result_queue = thread_queue.Queue()
-                exception_queue = thread_queue.Queue()
-                
-                def query_industry():
-                    try:
-                        stats = self._calculate_industry_statistics_with_collector(
-                            industry_code=industry['code'],
-                            months=[month],
-                            min_total_count=min_total_count,
-                            group_by_month=False,
-                            collector=collector
-                        )
-                        result_queue.put(stats)
-                    except Exception as e:
-                        exception_queue.put(e)
-                
-                # 启动查询线程
-                query_thread = threading.Thread(target=query_industry, daemon=True)
-                query_thread.start()
-                query_thread.join(timeout=8)  # 8秒超时
-                
-                if query_thread.is_alive():
-                    # 线程仍在运行，说明超时了
-                    logger.warning(f"查询行业 {industry['name']} 超时（8秒），跳过")
-                    failed_count += 1
-                    continue
-                
-                # 检查是否有异常
-                try:
-                    exception = exception_queue.get_nowait()
-                    raise exception
-                except thread_queue.Empty:
-                    pass
-                
-                # 获取结果
-                try:
-                    stats = result_queue.get_nowait()
-                except thread_queue.Empty:
-                    logger.warning(f"查询行业 {industry['name']} 未返回结果")
-                    failed_count += 1
-                    continue
-                
-                if stats and stats.get('statistics_mode') == 'summary':
-                    results.append({
-                        "industry_code": stats['industry_code'],
-                        "industry_name": stats['industry_name'],
-                        "stock_count": stats.get('stock_count', 0),
-                        "up_count": stats['up_count'],
-                        "down_count": stats['down_count'],
-                        "total_count": stats['total_count'],
-                        "up_probability": stats['up_probability'],
-                        "down_probability": stats['down_probability'],
-                        "avg_up_pct": stats['avg_up_pct'],
-                        "avg_down_pct": stats['avg_down_pct'],
-                        "year_range": stats['year_range']
-                    })
-                    success_count += 1
-                else:
-                    failed_count += 1
-                
-                # 减少延迟，因为已经复用了DataCollector，不需要太多延迟
-                if idx < len(industries) - 1:
-                    time.sleep(0.01)  # 每个请求间隔10ms（最小延迟，避免请求过快）
-                    
-            except Exception as e:
-                logger.warning(f"计算行业 {industry['name']} 统计失败: {e}")
-                failed_count += 1
+            # 检查最小涨跌次数
+            if min_total_count > 0 and stats["total_count"] < min_total_count:
                 continue
+            
+            for industry in index_industries:
+                stats_by_industry[industry['code']] = stats
+        
+        # 按行业列表顺序生成结果，保证相同上涨概率时的排序稳定
+        results = []
+        for industry in industries:
+            stats = stats_by_industry.get(industry['code'])
+            if stats:
+                results.append({
+                    "industry_code": industry['code'],
+                    "industry_name": industry['name'],
+                    "stock_count": stock_counts.get(industry['code'], 0),
+                    **stats
+                })
         
-        logger.info(f"查询完成: 总行业数 {total_industries}, 成功 {success_count} 个，失败 {failed_count} 个，共找到 {len(results)} 个有效结果")
+        logger.info(f"查询完成: 总行业数 {total_industries}, 指数 {len(industries_by_index)} 个，共找到 {len(results)} 个有效结果")
         
         # 按上涨概率降序排序
         results.sort(key=lambda x: x['up_probability'], reverse=True)
@@ -619,73 +900,164 @@ class StatisticsCalculator:
         
         return results[:limit]
     
-    def _calculate_industry_statistics_with_collector(
-        self,
-        industry_code: str,
-        months: Optional[List[int]] = None,
-        min_total_count: int = 0,
-        group_by_month: bool = False,
-        collector=None
-    ) -> Optional[Dict]:
-        """计算行业统计信息（内部方法，使用传入的collector）"""
-        from industry_index_mapping import get_index_code
-        from datetime import datetime
+    def build_industry_rank_snapshot(self, fetch_missing: bool = True) -> Optional[int]:
+        """一次性计算所有行业12个月的排名，保存为新版本快照
         
-        industry = self.db.query(Industry).filter(Industry.code == industry_code).first()
-        if not industry:
-            return None
+        每个不同指数的月度数据只读取并遍历一次，按月份分桶后分别汇总。
+        快照保存未按最小涨跌次数过滤的完整排名，查询时再过滤和截取。
         
-        industry_name = industry.name
+        Args:
+            fetch_missing: 本地没有数据的指数是否从BaoStock获取，为False时只使用本地数据
         
-        # 获取行业对应的BaoStock指数代码
-        index_code = get_index_code(industry_name)
-        if not index_code:
-            logger.warning(f"未找到行业 '{industry_name}' 对应的指数代码")
+        Returns:
+            新快照的版本号，没有行业时返回None
+        """
+        industries = self.get_industry_list()
+        if not industries:
             return None
         
-        # 获取行业板块的月K数据（使用传入的collector）
-        start_date = "2000-01-01"
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # 从BaoStock获取行业板块月K数据
-        df = collector.get_industry_monthly_k_baostock(index_code, start_date, end_date)
+        industries_by_index = self._group_industries_by_index(industries)
+        stock_counts = self._count_stocks_by_industry()
+        series_by_index = self._load_index_series(list(industries_by_index), fetch_missing=fetch_missing)
         
-        if df is None or len(df) == 0:
-            return None
+        stats_by_month = {month: {} for month in range(1, 13)}  # {month: {industry_code: stats}}
+        for index_code, index_industries in industries_by_index.items():
+            month_buckets = {month: [] for month in range(1, 13)}
+            for data in series_by_index.get(index_code, []):
+                month_buckets[data['month']].append(data)
+            
+            for month, month_data in month_buckets.items():
+                stats = self._summarize_index_data(month_data)
+                if stats:
+                    for industry in index_industries:
+                        stats_by_month[month][industry['code']] = stats
         
-        # 转换为月度数据列表
-        monthly_data = []
-        for _, row in df.iterrows():
-            if pd.notna(row.get('pct_change')):
-                monthly_data.append({
-                    'year': int(row['year']),
-                    'month': int(row['month']),
-                    'pct_change': float(row['pct_change'])
-                })
+        latest_version = self.db.query(func.max(IndustryRankSnapshot.version)).scalar() or 0
+        version = latest_version + 1
+        now = datetime.now()
         
-        if not monthly_data:
-            return None
+        try:
+            for month in range(1, 13):
+                results = []
+                for industry in industries:
+                    stats = stats_by_month[month].get(industry['code'])
+                    if stats:
+                        results.append({
+                            "industry_code": industry['code'],
+                            "industry_name": industry['name'],
+                            "stock_count": stock_counts.get(industry['code'], 0),
+                            **stats
+                        })
+                # 按上涨概率降序排序
+                results.sort(key=lambda x: x['up_probability'], reverse=True)
+                
+                self.db.add(IndustryRankSnapshot(
+                    version=version,
+                    month=month,
+                    total_industries=len(industries),
+                    result_data=json.dumps(results, ensure_ascii=False),
+                    created_at=now
+                ))
+            
+            # 只保留最新版本
+            self.db.query(IndustryRankSnapshot).filter(
+                IndustryRankSnapshot.version < version
+            ).delete(synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
         
-        # 按月份筛选
-        if months:
-            monthly_data = [d for d in monthly_data if d['month'] in months]
+        logger.info(f"行业排名快照 v{version} 计算完成，共 {len(industries)} 个行业")
+        return version
+    
+    def get_industry_rank_snapshot(self, month: int, min_total_count: int = 0, limit: int = 20) -> Optional[Dict]:
+        """从最新快照读取指定月份的行业排名，没有快照时返回None"""
+        snapshot = self.db.query(IndustryRankSnapshot).filter(
+            IndustryRankSnapshot.month == month
+        ).order_by(IndustryRankSnapshot.version.desc()).first()
         
-        if not monthly_data:
+        if not snapshot:
             return None
         
-        # 获取行业下股票数量（用于显示）
-        stock_count = self.db.query(Stock).filter(
-            Stock.industry_code == industry_code,
-            Stock.is_delisted == 0
-        ).count()
+        results = json.loads(snapshot.result_data or "[]")
+        if min_total_count > 0:
+            results = [r for r in results if r["total_count"] >= min_total_count]
         
-        base_info = {
-            "industry_code": industry_code,
-            "industry_name": industry_name,
-            "stock_count": stock_count
+        return {
+            "results": results[:limit],
+            "total_industries": snapshot.total_industries,
+            "snapshot_version": snapshot.version,
+            "snapshot_at": snapshot.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
+    
+    def _group_industries_by_index(self, industries: List[Dict]) -> Dict[str, List[Dict]]:
+        """把行业按对应的BaoStock指数代码分组（内部方法）"""
+        from industry_index_mapping import get_index_code
+        
+        industries_by_index = {}  # {index_code: [industry, ...]}
+        for industry in industries:
+            index_code = get_index_code(industry['name'])
+            if index_code:
+                industries_by_index.setdefault(index_code, []).append(industry)
+            else:
+                logger.warning(f"未找到行业 '{industry['name']}' 对应的指数代码")
+        return industries_by_index
+    
+    def _count_stocks_by_industry(self) -> Dict[str, int]:
+        """一次分组查询各行业的非退市股票数量（内部方法）"""
+        return dict(
+            self.db.query(Stock.industry_code, func.count(Stock.id)).filter(
+                Stock.is_delisted == 0
+            ).group_by(Stock.industry_code).all()
+        )
+    
+    def _load_index_series(self, index_codes: List[str], progress_callback=None, fetch_missing: bool = True) -> Dict[str, List[Dict]]:
+        """读取多个指数的月度数据，每个指数只读取一次（内部方法）
+        
+        本地还没有数据的指数由BaoStock并行获取一次后再读取。
+        
+        Args:
+            index_codes: 不重复的指数代码列表
+            progress_callback: 进度回调函数 (current, total, message)，按指数计数
+            fetch_missing: 是否获取本地没有数据的指数，为False时跳过这些指数
+        """
+        series_by_index = {}
+        missing = []
+        total = len(index_codes)
         
-        # 汇总统计模式
+        for idx, index_code in enumerate(index_codes):
+            if progress_callback:
+                progress_callback(idx + 1, total, f"正在读取指数 {index_code} ({idx + 1}/{total})...")
+            
+            try:
+                monthly_data = self._load_index_monthly_data(index_code)
+            except Exception as e:
+                logger.warning(f"读取指数 {index_code} 月K数据失败: {e}")
+                continue
+            
+            if monthly_data:
+                series_by_index[index_code] = monthly_data
+            else:
+                missing.append(index_code)
+        
+        if missing and not fetch_missing:
+            logger.info(f"本地缺少 {len(missing)} 个指数的月K数据，已跳过")
+        elif missing:
+            from data_collector import DataCollector
+            
+            logger.info(f"本地缺少 {len(missing)} 个指数的月K数据，开始获取")
+            DataCollector(self.db).update_index_monthly_k_data_batch(missing, progress_callback=progress_callback)
+            for index_code in missing:
+                try:
+                    series_by_index[index_code] = self._load_index_monthly_data(index_code)
+                except Exception as e:
+                    logger.warning(f"读取指数 {index_code} 月K数据失败: {e}")
+        
+        return series_by_index
+    
+    def _summarize_index_data(self, monthly_data: List[Dict]) -> Optional[Dict]:
+        """汇总指数月度涨跌幅数据（内部方法）"""
         up_count = 0
         down_count = 0
         up_pct_sum = 0.0
@@ -702,33 +1074,29 @@ class StatisticsCalculator:
                 down_count += 1
                 down_pct_sum += pct_change
         
-        total_count = up_count + down_count
-        if total_count == 0:
-            return None
-        
-        # 检查最小涨跌次数
-        if min_total_count > 0 and total_count < min_total_count:
-            return None
-        
-        up_probability = (up_count / total_count * 100) if total_count > 0 else 0
-        down_probability = (down_count / total_count * 100) if total_count > 0 else 0
-        avg_up_pct = (up_pct_sum / up_count) if up_count > 0 else 0
-        avg_down_pct = (down_pct_sum / down_count) if down_count > 0 else 0
-        
-        year_range = f"{min(years)}-{max(years)}" if years else ""
-        
-        return {
-            **base_info,
-            "statistics_mode": "summary",
-            "up_count": up_count,
-            "down_count": down_count,
-            "total_count": total_count,
-            "up_probability": round(up_probability, 2),
-            "down_probability": round(down_probability, 2),
-            "avg_up_pct": round(avg_up_pct, 2),
-            "avg_down_pct": round(avg_down_pct, 2),
-            "year_range": year_range
-        }
+        stats = self._build_statistics(
+            up_count, down_count, up_pct_sum, down_pct_sum,
+            min(years, default=None), max(years, default=None), len(years)
+        )
+        if stats:
+            del stats["years_count"]
+        return stats
+    
+    def _load_index_monthly_data(self, index_code: str) -> List[Dict]:
+        """从本地读取行业指数有涨跌幅的月K数据，按时间排序（内部方法）"""
+        rows = self.db.query(
+            IndexMonthlyKData.year,
+            IndexMonthlyKData.month,
+            IndexMonthlyKData.pct_change
+        ).filter(
+            IndexMonthlyKData.index_code == index_code,
+            IndexMonthlyKData.pct_change.isnot(None)
+        ).order_by(IndexMonthlyKData.year, IndexMonthlyKData.month).all()
+        
+        return [
+            {'year': row.year, 'month': row.month, 'pct_change': row.pct_change}
+            for row in rows
+        ]
     
     def get_industry_list(self) -> List[Dict]:
         """获取行业列表"""
@@ -792,6 +1160,9 @@ class StatisticsCalculator:
                 stock.industry_code = industry_map[industry_name]
             
             self.db.commit()
+            # 股票的行业归属发生变化，按行业筛选的缓存结果不再有效
+            if self.cache:
+                self.cache.invalidate_all()
             logger.info(f"从股票数据中提取了 {len(industry_map)} 个行业")
         except Exception as e:
             logger.error(f"填充行业数据失败: {e}", exc_info=True)
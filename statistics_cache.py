@@ -0,0 +1,191 @@
+"""
+统计结果缓存 - 基于 statistics_cache 表的持久化结果缓存
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import and_
+from sqlalchemy.dialects.sqlite import insert
+from models import StatisticsCache
+from config import STATISTICS_CONFIG
+from datetime import datetime
+from typing import List, Dict, Optional, Any
+import hashlib
+import json
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 进程内命中统计
+_cache_stats = {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0, "evictions": 0}
+_cache_stats_lock = threading.Lock()
+
+
+def _count(name: str, value: int = 1):
+    with _cache_stats_lock:
+        _cache_stats[name] += value
+
+
+def get_cache_stats() -> Dict:
+    """获取缓存命中统计"""
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups * 100, 2) if lookups > 0 else 0
+    return stats
+
+
+def normalize_months(months: Optional[List[int]]) -> Optional[List[int]]:
+    """月份排序后参与缓存键计算，None和空列表都表示所有月份"""
+    return sorted(months) if months else None
+
+
+class StatisticsResultCache:
+    """统计结果缓存
+    
+    缓存键由规范化后的查询参数生成：
+    - stock: 股票代码、月份、最小涨跌次数、是否按月统计
+    - batch: 月份、市场、行业、最小涨跌次数、是否排除退市、排序字段、返回数量
+    - industry: 行业代码、月份、最小涨跌次数、是否按月统计
+    
+    读取使用调用方的会话；写入和清除在同一数据库上的独立短会话中提交，
+    不会提交或回滚调用方会话中未完成的事务。
+    缓存条目超过 STATISTICS_CONFIG["result_cache_max_entries"] 时，写入后删除最早写入的条目。
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def _session(self) -> Session:
+        """写入缓存用的独立会话（与调用方会话使用同一个引擎）"""
+        return Session(bind=self.db.get_bind())
+    
+    @staticmethod
+    def build_key(cache_type: str, params: Dict[str, Any]) -> str:
+        """根据缓存类型和查询参数生成缓存键"""
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return f"{cache_type}:{hashlib.md5(payload.encode('utf-8')).hexdigest()}"
+    
+    def get(self, cache_type: str, params: Dict[str, Any]) -> Optional[Any]:
+        """读取缓存结果，未命中返回None"""
+        try:
+            entry = self.db.query(StatisticsCache.result_data).filter(
+                StatisticsCache.cache_key == self.build_key(cache_type, params)
+            ).first()
+        except Exception as e:
+            logger.warning(f"读取统计缓存失败: {e}")
+            entry = None
+        
+        if entry is None or entry.result_data is None:
+            _count("misses")
+            return None
+        
+        _count("hits")
+        return self._restore(json.loads(entry.result_data))
+    
+    def set(
+        self,
+        cache_type: str,
+        params: Dict[str, Any],
+        result: Any,
+        stock_code: Optional[str] = None,
+        industry_code: Optional[str] = None
+    ):
+        """写入缓存结果（相同缓存键覆盖）"""
+        if result is None:
+            return
+        
+        summary = result if isinstance(result, dict) else {}
+        months = params.get("months")
+        now = datetime.now()
+        values = {
+            "cache_key": self.build_key(cache_type, params),
+            "cache_type": cache_type,
+            "stock_code": stock_code,
+            "industry_code": industry_code,
+            "months": ",".join(str(m) for m in months) if months else None,
+            "up_count": summary.get("up_count", 0),
+            "down_count": summary.get("down_count", 0),
+            "up_probability": summary.get("up_probability"),
+            "down_probability": summary.get("down_probability"),
+            "avg_up_pct": summary.get("avg_up_pct"),
+            "avg_down_pct": summary.get("avg_down_pct"),
+            "year_range": summary.get("year_range"),
+            "result_data": json.dumps(result, ensure_ascii=False),
+            "created_at": now,
+            "updated_at": now,
+        }
+        
+        try:
+            stmt = insert(StatisticsCache).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[StatisticsCache.cache_key],
+                set_={k: stmt.excluded[k] for k in values if k not in ("cache_key", "created_at")}
+            )
+            with self._session() as session:
+                session.execute(stmt)
+                evicted = self._evict(session, STATISTICS_CONFIG.get("result_cache_max_entries", 0))
+                session.commit()
+            _count("writes")
+            if evicted:
+                _count("evictions", evicted)
+        except Exception as e:
+            logger.warning(f"写入统计缓存失败: {e}")
+    
+    def invalidate_stock(self, stock_code: str):
+        """股票月K数据变化时，清除该股票的缓存
+        
+        批量统计缓存同样受影响，由写入方在整批股票写入后调用 invalidate_batch 清除一次。
+        """
+        self._delete(StatisticsCache.stock_code == stock_code)
+    
+    def invalidate_batch(self):
+        """一批股票的月K数据写入后，清除所有批量统计缓存"""
+        self._delete(StatisticsCache.cache_type == "batch")
+    
+    def invalidate_industry(self, industry_code: Optional[str] = None):
+        """清除行业统计缓存，industry_code为None时清除全部行业缓存"""
+        condition = StatisticsCache.cache_type == "industry"
+        if industry_code:
+            condition = and_(condition, StatisticsCache.industry_code == industry_code)
+        self._delete(condition)
+    
+    def invalidate_all(self):
+        """股票列表变化时清除全部缓存"""
+        self._delete(None)
+    
+    @staticmethod
+    def _evict(session: Session, max_entries: int) -> int:
+        """只保留最近写入的 max_entries 条缓存（按自增id），返回删除的条数；max_entries为0时不限制"""
+        if max_entries <= 0:
+            return 0
+        boundary = session.query(StatisticsCache.id).order_by(
+            StatisticsCache.id.desc()
+        ).offset(max_entries).limit(1).scalar()
+        if boundary is None:
+            return 0
+        return session.query(StatisticsCache).filter(
+            StatisticsCache.id <= boundary
+        ).delete(synchronize_session=False)
+    
+    def _delete(self, condition):
+        try:
+            with self._session() as session:
+                query = session.query(StatisticsCache)
+                if condition is not None:
+                    query = query.filter(condition)
+                deleted = query.delete(synchronize_session=False)
+                session.commit()
+            if deleted:
+                _count("invalidations", deleted)
+        except Exception as e:
+            logger.warning(f"清除统计缓存失败: {e}")
+    
+    @staticmethod
+    def _restore(result: Any) -> Any:
+        """JSON会把按月统计的月份键转成字符串，读取时还原为整数"""
+        if isinstance(result, dict) and isinstance(result.get("monthly_statistics"), dict):
+            result["monthly_statistics"] = {
+                int(month): stats for month, stats in result["monthly_statistics"].items()
+            }
+        return result
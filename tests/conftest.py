@@ -0,0 +1,101 @@
+"""
+测试公共夹具：每个测试使用独立的临时SQLite数据库，写入确定性的股票和月K数据
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+from datetime import date
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base
+from models import Stock, MonthlyKData, Industry
+import monthly_panel
+
+INDUSTRIES = [("801010", "银行"), ("801020", "证券")]
+
+
+def monthly_rows(code: str, first_month: int, last_month: int, seed: int):
+    """生成一只股票从 first_month 到 last_month（YYYYMM）的月K记录，第一个月没有涨跌幅"""
+    rng = random.Random(seed)
+    rows = []
+    close = 10.0
+    previous = None
+    year, month = first_month // 100, first_month % 100
+    while year * 100 + month <= last_month:
+        # 涨跌幅取两位小数，并有一部分平盘月份
+        pct = 0.0 if rng.random() < 0.1 else round(rng.uniform(-12, 12), 2)
+        close = round(close * (1 + pct / 100), 2) or 0.01
+        rows.append({
+            "stock_code": code,
+            "year": year,
+            "month": month,
+            "open_price": close,
+            "close_price": close,
+            "high_price": close,
+            "low_price": close,
+            "volume": 1000.0,
+            "amount": 10000.0,
+            "pct_change": None if previous is None else round((close - previous) / previous * 100, 2),
+        })
+        previous = close
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return rows
+
+
+def populate(db, stock_count: int = 30, last_month: int = 202412):
+    """写入行业、股票和月K数据
+    
+    部分股票使用相同的随机种子（统计值完全相同，用于检查相同值按股票ID排列），
+    部分股票上市较晚（涨跌次数较少，用于检查最小涨跌次数过滤），最后一只股票已退市。
+    """
+    db.add_all(Industry(code=code, name=name, level=1) for code, name in INDUSTRIES)
+    records = []
+    for i in range(stock_count):
+        code = f"{600000 + i:06d}" if i % 2 == 0 else f"{i:06d}"
+        first_year = 2021 if i % 11 == 3 else 2000 + i % 11
+        industry_code, industry_name = INDUSTRIES[i % len(INDUSTRIES)]
+        db.add(Stock(
+            code=code,
+            name=f"股票{i:02d}",
+            market="sh" if i % 2 == 0 else "sz",
+            listing_date=date(first_year, 1, 1),
+            industry_code=industry_code,
+            industry_name=industry_name,
+            is_delisted=1 if i == stock_count - 1 else 0,
+        ))
+        records.extend(monthly_rows(code, first_year * 100 + 1, last_month, seed=i % 11))
+    db.flush()
+    db.bulk_insert_mappings(MonthlyKData, records)
+    db.commit()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    # 进程级内存面板在每个测试中从当前数据库重新加载
+    monthly_panel.invalidate_monthly_panel()
+    yield session
+    session.close()
+    monthly_panel.invalidate_monthly_panel()
+
+
+@pytest.fixture
+def populated_db(db):
+    populate(db)
+    return db
@@ -0,0 +1,112 @@
+"""
+批量统计排名：面板/数据库扫描、前N名选取和游标分页的结果应与逐只股票计算后稳定排序的结果完全一致
+"""
+import pytest
+
+from config import STATISTICS_CONFIG
+from models import Stock, MonthlyKData
+from statistics import StatisticsCalculator, BatchRanking, TOP_K_ORDER_KEYS, STOCK_ORDER_KEYS
+
+ORDER_KEYS = list(TOP_K_ORDER_KEYS) + list(STOCK_ORDER_KEYS)
+
+
+def baseline_batch_statistics(db, months=None, min_total_count=0, limit=20, order_by="up_probability"):
+    """逐只股票按时间顺序累加涨跌幅，再对全部结果稳定排序（批量统计最初的实现方式）"""
+    results = []
+    for stock in db.query(Stock).filter(Stock.is_delisted == 0).order_by(Stock.id).all():
+        query = db.query(MonthlyKData).filter(MonthlyKData.stock_code == stock.code)
+        if months:
+            query = query.filter(MonthlyKData.month.in_(months))
+        monthly_data = query.order_by(MonthlyKData.year, MonthlyKData.month).all()
+        if not monthly_data:
+            continue
+        
+        up_count = down_count = 0
+        up_pct_sum = down_pct_sum = 0.0
+        years = set()
+        for data in monthly_data:
+            years.add(data.year)
+            if data.pct_change is not None:
+                if data.pct_change > 0:
+                    up_count += 1
+                    up_pct_sum += data.pct_change
+                elif data.pct_change < 0:
+                    down_count += 1
+                    down_pct_sum += data.pct_change
+        
+        total_count = up_count + down_count
+        if total_count == 0 or (min_total_count > 0 and total_count < min_total_count):
+            continue
+        
+        results.append({
+            "stock_code": stock.code,
+            "stock_name": stock.name,
+            "market": stock.market,
+            "listing_date": stock.listing_date.strftime('%Y-%m-%d'),
+            "statistics_mode": "summary",
+            "up_count": up_count,
+            "down_count": down_count,
+            "total_count": total_count,
+            "up_probability": round(up_count / total_count * 100, 2),
+            "down_probability": round(down_count / total_count * 100, 2),
+            "avg_up_pct": round(up_pct_sum / up_count, 2) if up_count > 0 else 0,
+            "avg_down_pct": round(down_pct_sum / down_count, 2) if down_count > 0 else 0,
+            "year_range": f"{min(years)}-{max(years)}",
+            "years_count": len(years),
+        })
+    
+    reverse = order_by in ["up_probability", "avg_up_pct"]
+    results.sort(key=lambda x: x.get(order_by, 0), reverse=reverse)
+    return [{**result, "rank": rank} for rank, result in enumerate(results[:limit], 1)]
+
+
+@pytest.fixture(params=[True, False], ids=["panel", "scan"])
+def calculator(request, populated_db, monkeypatch):
+    monkeypatch.setitem(STATISTICS_CONFIG, "use_memory_panel", request.param)
+    monkeypatch.setitem(STATISTICS_CONFIG, "parallel_workers", 0)
+    calculator = StatisticsCalculator(populated_db)
+    calculator.cache = None
+    return calculator
+
+
+@pytest.mark.parametrize("order_by", ORDER_KEYS)
+@pytest.mark.parametrize("months, min_total_count", [(None, 0), ([1, 2], 0), ([12], 20)])
+def test_batch_statistics_matches_baseline(calculator, order_by, months, min_total_count):
+    expected = baseline_batch_statistics(calculator.db, months, min_total_count, 1000, order_by)
+    for limit in (1, 7, 1000):
+        assert calculator.calculate_batch_statistics(
+            months=months, min_total_count=min_total_count, limit=limit, order_by=order_by
+        ) == expected[:limit]
+
+
+@pytest.mark.parametrize("order_by", ORDER_KEYS)
+@pytest.mark.parametrize("page_size", [1, 4, 50])
+def test_cursor_pages_match_baseline(calculator, order_by, page_size):
+    expected = baseline_batch_statistics(calculator.db, [3], 0, 1000, order_by)
+    ranking = calculator.rank_batch_statistics(months=[3], order_by=order_by)
+    assert ranking.total == len(expected)
+    
+    rows = []
+    after = None
+    while True:
+        page, next_after = ranking.page(after, page_size)
+        assert len(page) <= page_size
+        rows.extend(page)
+        if next_after is None:
+            break
+        # 游标经过编码和解析，与客户端取下一页时相同
+        after = BatchRanking.decode_cursor(BatchRanking.encode_cursor(order_by, next_after), order_by)
+    assert rows == expected
+
+
+def test_stream_pages_match_baseline(calculator):
+    expected = baseline_batch_statistics(calculator.db, None, 0, 10, "avg_down_pct")
+    ranking = calculator.rank_batch_statistics(order_by="avg_down_pct")
+    rows = [row for page in ranking.iter_pages(10, 3, 4) for row in page]
+    assert rows == expected
+
+
+def test_cursor_for_another_order_is_rejected():
+    cursor = BatchRanking.encode_cursor("up_probability", (50.0, 3))
+    with pytest.raises(ValueError):
+        BatchRanking.decode_cursor(cursor, "avg_up_pct")
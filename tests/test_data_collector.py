@@ -0,0 +1,178 @@
+"""
+数据采集：更新计划的跳过逻辑、增量获取时的除权除息检查，以及涨跌幅接缝的补算
+"""
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import data_collector
+from conftest import monthly_rows
+from data_collector import DataCollector, _next_month
+from fetch_executor import build_monthly_k_frame, fetch_adjust_factors
+from models import Stock, MonthlyKData, AdjustFactor
+from monthly_panel import invalidate_monthly_panel
+from statistics import StatisticsCalculator
+
+K_FIELDS = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjustflag']
+
+
+def last_completed_month() -> int:
+    now = datetime.now()
+    return (now.year - 1) * 100 + 12 if now.month == 1 else now.year * 100 + now.month - 1
+
+
+def months_before(year_month: int, count: int) -> int:
+    index = year_month // 100 * 12 + year_month % 100 - 1 - count
+    return index // 12 * 100 + index % 12 + 1
+
+
+def add_stock(db, code: str, first_month: int = None, last_month: int = None, is_delisted: int = 0):
+    db.add(Stock(code=code, name=f"股票{code}", market="sh", listing_date=date(2015, 1, 1), is_delisted=is_delisted))
+    if first_month:
+        db.bulk_insert_mappings(MonthlyKData, monthly_rows(code, first_month, last_month, seed=int(code)))
+    db.commit()
+
+
+def stored_close(db, code: str, year: int, month: int):
+    return db.query(MonthlyKData.close_price).filter(
+        MonthlyKData.stock_code == code, MonthlyKData.year == year, MonthlyKData.month == month
+    ).scalar()
+
+
+class FakeExecutor:
+    """按 fetch_executor.BaoStockFetchExecutor 的接口返回生成的数据，记录每次请求
+    
+    本地已有的月份返回本地的收盘价，adjusted 中的股票返回调整后的收盘价（模拟获取后除权除息）。
+    """
+    calls = []
+    adjusted = set()
+    db = None
+    
+    def fetch(self, jobs, fetcher=None):
+        for job in list(jobs):
+            bs_code, start_date, end_date = job
+            code = bs_code[3:]
+            FakeExecutor.calls.append((fetcher.__name__ if fetcher else "monthly_k", code, start_date))
+            if fetcher is fetch_adjust_factors:
+                yield job, pd.DataFrame(
+                    [[date(2026, 6, 1), 0.9, 1.1, 0.9]],
+                    columns=['date', 'fore_adjust_factor', 'back_adjust_factor', 'adjust_factor']
+                ), None
+                continue
+            
+            rows = []
+            for month_end in pd.date_range(start_date, end_date, freq='ME'):
+                close = stored_close(self.db, code, month_end.year, month_end.month)
+                if close is None:
+                    close = 20.0
+                elif code in self.adjusted:
+                    close = round(close * 0.9, 2)
+                rows.append([month_end.strftime('%Y-%m-%d'), '1', '1', '1', str(close), '100', '1000', '2'])
+            yield job, build_monthly_k_frame(rows, K_FIELDS), None
+
+
+@pytest.fixture
+def collector(db, monkeypatch):
+    FakeExecutor.calls = []
+    FakeExecutor.adjusted = set()
+    FakeExecutor.db = db
+    monkeypatch.setattr(data_collector, "BaoStockFetchExecutor", FakeExecutor)
+    monkeypatch.setitem(data_collector.FETCH_CONFIG, "check_adjust_factors", True)
+    collector = DataCollector(db)
+    collector.config = {
+        **collector.config,
+        "baostock": {**collector.config["baostock"], "enabled": True},
+        "tushare": {**collector.config["tushare"], "enabled": False},
+    }
+    return collector
+
+
+def test_plan_skips_up_to_date_and_delisted_stocks(db, collector):
+    last = last_completed_month()
+    add_stock(db, "600000", 201501, last)
+    add_stock(db, "600001", 201501, months_before(last, 3))
+    add_stock(db, "600002")
+    add_stock(db, "600003", 201501, months_before(last, 3), is_delisted=1)
+    
+    plan = collector.plan_monthly_k_update(["600000", "600001", "600002", "600003", "999999"])
+    # 增量获取从本地最后一个月开始（多获取一个月用于检查除权除息）
+    overlap = months_before(last, 3)
+    assert plan["groups"] == {
+        f"{overlap // 100}-{overlap % 100:02d}-01": ["600001"],
+        "2015-01-01": ["600002"],
+    }
+    assert (plan["to_fetch"], plan["skipped"], plan["delisted"], plan["new_listings"]) == (2, 1, 1, 1)
+    assert plan["missing"] == ["999999"]
+    
+    collector.config = {**collector.config, "baostock": {**collector.config["baostock"], "enabled": False}}
+    start = _next_month(overlap)
+    assert collector.plan_monthly_k_update(["600001"])["groups"] == {f"{start // 100}-{start % 100:02d}-01": ["600001"]}
+    
+    plan = collector.plan_monthly_k_update(["600000", "600003"], force_update=True)
+    assert plan["groups"] == {"2015-01-01": ["600000", "600003"]}
+
+
+def test_incremental_update_refetches_adjusted_stocks(db, collector):
+    last = last_completed_month()
+    add_stock(db, "600001", 201501, months_before(last, 3))
+    add_stock(db, "600004", 201501, months_before(last, 3))
+    FakeExecutor.adjusted = {"600004"}
+    first_close = stored_close(db, "600004", 2015, 1)
+    
+    count, success, failed = collector.update_monthly_k_data_batch(["600001", "600004"])
+    assert (count, success, failed) == (6, 2, 0)
+    
+    monthly_k_calls = [(code, start) for fetcher, code, start in FakeExecutor.calls if fetcher == "monthly_k"]
+    overlap = months_before(last, 3)
+    start = f"{overlap // 100}-{overlap % 100:02d}-01"
+    assert sorted(monthly_k_calls) == [("600001", start), ("600004", "2015-01-01"), ("600004", start)]
+    assert db.query(AdjustFactor.stock_code, AdjustFactor.divid_operate_date).all() == [("600004", date(2026, 6, 1))]
+    
+    # 除权除息的股票整段历史被替换为重新获取的数据
+    assert stored_close(db, "600004", 2015, 1) == round(first_close * 0.9, 2)
+    assert db.query(MonthlyKData).filter(MonthlyKData.stock_code == "600004").count() == (
+        db.query(MonthlyKData).filter(MonthlyKData.stock_code == "600001").count()
+    )
+    # 已保存的除权除息事件不会重复获取
+    FakeExecutor.calls = []
+    assert collector.record_adjust_factors(["600004"]) == 0
+    assert FakeExecutor.calls == [("fetch_adjust_factors", "600004", "2026-06-01")]
+
+
+def test_incremental_save_seeds_first_pct_change(db, collector):
+    add_stock(db, "600001", 201501, 202012)
+    previous = stored_close(db, "600001", 2020, 12)
+    
+    df = build_monthly_k_frame([['2021-01-31', '1', '1', '1', '20', '100', '1000', '2']], K_FIELDS)
+    assert collector._save_monthly_k_data("600001", df) == 1
+    pct_change = db.query(MonthlyKData.pct_change).filter(
+        MonthlyKData.stock_code == "600001", MonthlyKData.year == 2021, MonthlyKData.month == 1
+    ).scalar()
+    assert pct_change == round((20 - previous) / previous * 100, 2)
+
+
+def test_repair_pct_change_seams(populated_db):
+    db = populated_db
+    calculator = StatisticsCalculator(db)
+    calculator.cache = None
+    expected = calculator.calculate_batch_statistics(limit=100)
+    
+    original = dict(db.query(MonthlyKData.id, MonthlyKData.pct_change).all())
+    seam_ids = [
+        record_id for record_id, in db.query(MonthlyKData.id).filter(
+            MonthlyKData.month == 7, MonthlyKData.pct_change.isnot(None)
+        ).order_by(MonthlyKData.id).all()
+    ][::5]
+    db.query(MonthlyKData).filter(MonthlyKData.id.in_(seam_ids)).update(
+        {MonthlyKData.pct_change: None}, synchronize_session=False
+    )
+    db.commit()
+    invalidate_monthly_panel()
+    assert calculator.calculate_batch_statistics(limit=100) != expected
+    
+    assert DataCollector(db).repair_pct_change_seams() == len(seam_ids)
+    # 补算的涨跌幅与按上一个月收盘价计算的原值相同，每只股票的第一个月仍为空
+    assert dict(db.query(MonthlyKData.id, MonthlyKData.pct_change).all()) == original
+    assert calculator.calculate_batch_statistics(limit=100) == expected
+    assert DataCollector(db).repair_pct_change_seams() == 0
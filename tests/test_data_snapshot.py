@@ -0,0 +1,52 @@
+"""
+数据快照：导出后导入到新数据库，各表内容一致，行业排名快照只用快照中的数据重建
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+pytest.importorskip("pyarrow")
+
+from conftest import monthly_rows
+from data_collector import DataCollector
+from data_snapshot import SNAPSHOT_TABLES, export_snapshot, import_snapshot
+from models import IndexMonthlyKData, IndustryRankSnapshot
+
+
+def table_rows(engine, table):
+    with engine.connect() as conn:
+        return conn.execute(select(table).order_by(*table.primary_key.columns)).all()
+
+
+def test_snapshot_round_trip(engine, populated_db, tmp_path, monkeypatch):
+    # 只有“银行”对应的指数有本地数据，“证券”对应的指数缺失
+    populated_db.bulk_insert_mappings(IndexMonthlyKData, [
+        {**{key: value for key, value in row.items() if key != "stock_code"}, "index_code": "sh.000038"}
+        for row in monthly_rows("sh.000038", 200501, 202412, seed=1)
+    ])
+    populated_db.commit()
+    
+    def fetch(*args, **kwargs):
+        raise AssertionError("导入快照时不应获取指数数据")
+    
+    monkeypatch.setattr(DataCollector, "update_index_monthly_k_data_batch", fetch)
+    
+    path = tmp_path / "snapshot.zip"
+    exported = export_snapshot(engine, str(path))
+    target_url = f"sqlite:///{tmp_path / 'imported.db'}"
+    assert import_snapshot(str(path), target_url) == exported
+    
+    target = create_engine(target_url)
+    try:
+        for table in SNAPSHOT_TABLES:
+            assert table_rows(target, table) == table_rows(engine, table), table.name
+        
+        with Session(bind=target) as db:
+            snapshots = db.query(IndustryRankSnapshot).order_by(IndustryRankSnapshot.month).all()
+            assert [snapshot.month for snapshot in snapshots] == list(range(1, 13))
+            ranked = {row["industry_name"] for row in json.loads(snapshots[0].result_data)}
+            assert ranked == {"银行"}
+    finally:
+        target.dispose()
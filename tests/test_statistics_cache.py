@@ -0,0 +1,97 @@
+"""
+统计结果缓存：命中、股票数据写入后的清除、批量统计缓存按批清除以及条目数上限
+"""
+import data_collector
+from config import STATISTICS_CONFIG
+from data_collector import DataCollector
+from fetch_executor import build_monthly_k_frame
+from models import StatisticsCache
+from statistics import StatisticsCalculator
+from statistics_cache import StatisticsResultCache
+
+K_FIELDS = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjustflag']
+
+
+def k_frame(dates, closes):
+    return build_monthly_k_frame(
+        [[d, '1', '1', '1', str(close), '100', '1000', '2'] for d, close in zip(dates, closes)], K_FIELDS
+    )
+
+
+def cached_types(db):
+    return sorted(
+        (cache_type, stock_code or "") for cache_type, stock_code in
+        db.query(StatisticsCache.cache_type, StatisticsCache.stock_code).all()
+    )
+
+
+def test_results_are_served_from_cache(populated_db):
+    calculator = StatisticsCalculator(populated_db)
+    first = calculator.calculate_batch_statistics(months=[1], limit=5)
+    stock = calculator.calculate_stock_statistics("600000", months=[1, 2], group_by_month=True)
+    
+    calls = []
+    calculator._calculate_batch_statistics = lambda *args: calls.append(args)
+    calculator._calculate_stock_statistics = lambda *args: calls.append(args)
+    assert calculator.calculate_batch_statistics(months=[1], limit=5) == first
+    assert calculator.calculate_stock_statistics("600000", months=[2, 1], group_by_month=True) == stock
+    assert calls == []
+    # JSON中的月份键读取后还原为整数
+    assert set(stock["monthly_statistics"]) == {1, 2}
+
+
+def test_stream_and_batch_share_entry(populated_db):
+    calculator = StatisticsCalculator(populated_db)
+    ranking = calculator.rank_batch_statistics(months=[5], order_by="avg_up_pct")
+    rows = [row for page in ranking.iter_pages(8, 3, 3) for row in page]
+    calculator.cache_batch_statistics(rows, months=[5], limit=8, order_by="avg_up_pct")
+    
+    assert calculator.get_cached_batch_statistics(months=[5], limit=8, order_by="avg_up_pct") == rows
+    assert calculator.calculate_batch_statistics(months=[5], limit=8, order_by="avg_up_pct") == rows
+
+
+def test_saving_stock_clears_only_its_entries(populated_db):
+    calculator = StatisticsCalculator(populated_db)
+    calculator.calculate_stock_statistics("600000")
+    calculator.calculate_stock_statistics("000001")
+    calculator.calculate_batch_statistics(limit=5)
+    
+    DataCollector(populated_db)._save_monthly_k_data("600000", k_frame(['2025-01-31'], [12.5]))
+    assert cached_types(populated_db) == [("batch", ""), ("stock", "000001")]
+
+
+def test_update_clears_batch_entries_once(populated_db, monkeypatch):
+    codes = ["600000", "000001", "600002"]
+    
+    class FakeExecutor:
+        def fetch(self, jobs, fetcher=None):
+            for job in list(jobs):
+                yield job, k_frame(['2025-01-31', '2025-02-28'], [10.0, 11.0]), None
+    
+    deleted = []
+    delete = StatisticsResultCache._delete
+    monkeypatch.setattr(StatisticsResultCache, "_delete", lambda self, condition: (deleted.append(str(condition)), delete(self, condition)))
+    monkeypatch.setattr(data_collector, "BaoStockFetchExecutor", FakeExecutor)
+    
+    StatisticsCalculator(populated_db).calculate_batch_statistics(limit=5)
+    collector = DataCollector(populated_db)
+    collector.config = {**collector.config, "baostock": {**collector.config["baostock"], "enabled": True}}
+    monkeypatch.setitem(data_collector.FETCH_CONFIG, "check_adjust_factors", False)
+    
+    results = list(collector.iter_monthly_k_updates([(code, "2025-01-01") for code in codes]))
+    assert [error for _, _, error in results] == [None] * len(codes)
+    assert sum("cache_type" in condition for condition in deleted) == 1
+    assert sum("stock_code" in condition for condition in deleted) == len(codes)
+    assert cached_types(populated_db) == []
+
+
+def test_cache_keeps_latest_entries(db, monkeypatch):
+    monkeypatch.setitem(STATISTICS_CONFIG, "result_cache_max_entries", 3)
+    cache = StatisticsResultCache(db)
+    for i in range(5):
+        cache.set("stock", {"stock_code": str(i)}, {"up_count": i}, stock_code=str(i))
+    
+    assert cached_types(db) == [("stock", "2"), ("stock", "3"), ("stock", "4")]
+    assert cache.get("stock", {"stock_code": "4"}) == {"up_count": 4}
+    assert cache.get("stock", {"stock_code": "0"}) is None
+
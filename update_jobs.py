@@ -0,0 +1,279 @@
+"""
+数据更新任务 - 持久化进度、可暂停和继续的月K数据更新
+
+任务和每只股票的状态保存在 update_jobs / update_job_items 表中，
+每写完一只股票立即提交，进程重启或暂停后只继续处理未完成的股票。
+"""
+from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Stock, UpdateJob, UpdateJobItem
+from data_collector import DataCollector
+from config import FETCH_CONFIG
+from job_manager import get_job_manager
+from datetime import datetime
+from typing import List, Dict, Optional
+import json
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 本进程中正在运行的任务：{任务ID: 停止标志}
+_runners: Dict[int, threading.Event] = {}
+_runners_lock = threading.Lock()
+
+
+def create_update_job(db: Session, stock_codes: Optional[List[str]] = None, force_update: bool = False) -> UpdateJob:
+    """创建更新任务（更新计划在任务开始运行时生成）
+    
+    Args:
+        stock_codes: 股票代码列表，None表示全市场（先更新股票列表）
+        force_update: 是否从上市日期重新获取全部数据
+    """
+    job = UpdateJob(
+        job_type="monthly_k",
+        status="pending",
+        stock_codes=json.dumps(stock_codes) if stock_codes else None,
+        force_update=1 if force_update else 0,
+        message="等待开始"
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def start_update_job(job_id: int) -> bool:
+    """提交到后台任务管理器运行（与其他写入任务共用写入锁），任务已在运行时返回False"""
+    with _runners_lock:
+        if job_id in _runners:
+            return False
+        stop_event = threading.Event()
+        _runners[job_id] = stop_event
+    
+    get_job_manager().submit(
+        "update_job",
+        f"update_job:{job_id}",
+        lambda progress_callback: _run_update_job(job_id, stop_event, progress_callback),
+        writer=True
+    )
+    return True
+
+
+def pause_update_job(db: Session, job_id: int) -> Optional[UpdateJob]:
+    """暂停任务：正在运行的任务写完当前股票后停止"""
+    job = db.get(UpdateJob, job_id)
+    if not job:
+        return None
+    
+    with _runners_lock:
+        stop_event = _runners.get(job_id)
+    
+    if stop_event:
+        stop_event.set()
+        job.status = "pausing"
+        job.message = "正在暂停..."
+    elif job.status in ("pending", "running", "pausing"):
+        job.status = "paused"
+        job.message = "已暂停"
+    db.commit()
+    return job
+
+
+def resume_update_job(db: Session, job_id: int) -> Optional[UpdateJob]:
+    """继续暂停、失败或中断的任务，只处理未完成的股票"""
+    job = db.get(UpdateJob, job_id)
+    if not job:
+        return None
+    
+    if job.status != "completed":
+        start_update_job(job_id)
+    return job
+
+
+def resume_interrupted_jobs():
+    """进程启动时继续上次运行中被中断的任务"""
+    db = SessionLocal()
+    try:
+        jobs = db.query(UpdateJob).filter(UpdateJob.status.in_(["running", "pausing"])).all()
+        for job in jobs:
+            if job.status == "pausing":
+                job.status = "paused"
+                job.message = "已暂停"
+            else:
+                logger.info(f"继续被中断的更新任务 {job.id}")
+                start_update_job(job.id)
+        db.commit()
+    finally:
+        db.close()
+
+
+def get_update_job_status(db: Session, job_id: int) -> Optional[Dict]:
+    """获取任务状态和各状态的股票数量"""
+    job = db.get(UpdateJob, job_id)
+    if not job:
+        return None
+    
+    counts = dict(
+        db.query(UpdateJobItem.status, func.count(UpdateJobItem.id)).filter(
+            UpdateJobItem.job_id == job_id
+        ).group_by(UpdateJobItem.status).all()
+    )
+    rows_written = db.query(func.sum(UpdateJobItem.rows_written)).filter(
+        UpdateJobItem.job_id == job_id
+    ).scalar() or 0
+    errors = db.query(UpdateJobItem.stock_code, UpdateJobItem.attempts, UpdateJobItem.last_error).filter(
+        UpdateJobItem.job_id == job_id,
+        UpdateJobItem.status == "failed"
+    ).order_by(UpdateJobItem.updated_at.desc()).limit(20).all()
+    
+    done_count = counts.get("done", 0)
+    return {
+        "job_id": job.id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "running": job.id in _runners,
+        "force_update": bool(job.force_update),
+        "stock_codes": json.loads(job.stock_codes) if job.stock_codes else None,
+        "total_count": job.total_count,
+        "skipped_count": job.skipped_count,
+        "pending_count": counts.get("pending", 0),
+        "done_count": done_count,
+        "failed_count": counts.get("failed", 0),
+        "rows_written": int(rows_written),
+        "percent": int(done_count / job.total_count * 100) if job.total_count else (100 if job.status == "completed" else 0),
+        "message": job.message,
+        "last_error": job.last_error,
+        "failed_items": [
+            {"stock_code": code, "attempts": attempts, "last_error": error}
+            for code, attempts, error in errors
+        ],
+        "created_at": job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        "started_at": job.started_at.strftime('%Y-%m-%d %H:%M:%S') if job.started_at else None,
+        "finished_at": job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+    }
+
+
+def list_update_jobs(db: Session, limit: int = 20) -> List[Dict]:
+    """列出最近的更新任务"""
+    job_ids = [job_id for (job_id,) in db.query(UpdateJob.id).order_by(UpdateJob.id.desc()).limit(limit).all()]
+    return [get_update_job_status(db, job_id) for job_id in job_ids]
+
+
+def _plan_update_job(db: Session, job: UpdateJob, collector: DataCollector):
+    """首次运行时生成更新计划，把需要获取的股票写入明细表"""
+    stock_codes = json.loads(job.stock_codes) if job.stock_codes else None
+    if stock_codes is None:
+        job.message = "正在更新股票列表..."
+        db.commit()
+        collector.update_stock_list()
+        stock_codes = [code for (code,) in db.query(Stock.code).filter(Stock.is_delisted == 0).all()]
+    
+    plan = collector.plan_monthly_k_update(stock_codes, bool(job.force_update))
+    db.bulk_insert_mappings(UpdateJobItem, [
+        {"job_id": job.id, "stock_code": code, "start_date": start_date, "status": "pending"}
+        for start_date, codes in plan["groups"].items()
+        for code in codes
+    ])
+    job.total_count = plan["to_fetch"]
+    job.skipped_count = plan["skipped"] + plan["delisted"]
+    job.planned = 1
+    job.message = (
+        f"更新计划：需要获取 {plan['to_fetch']} 只（其中新上市 {plan['new_listings']} 只），"
+        f"已是最新跳过 {plan['skipped']} 只，已退市跳过 {plan['delisted']} 只"
+    )
+    db.commit()
+    logger.info(f"更新任务 {job.id} {job.message}")
+
+
+def _run_update_job(job_id: int, stop_event: threading.Event, progress_callback=None):
+    """运行任务：处理未完成和可重试的股票，每只股票写入后提交进度"""
+    db = SessionLocal()
+    job = None
+    try:
+        job = db.get(UpdateJob, job_id)
+        if not job:
+            return
+        
+        if stop_event.is_set():
+            # 等待写入锁期间已被暂停
+            job.status = "paused"
+            job.message = "已暂停"
+            db.commit()
+            return
+        
+        job.status = "running"
+        job.started_at = datetime.now()
+        job.finished_at = None
+        job.last_error = None
+        db.commit()
+        
+        collector = DataCollector(db)
+        if not job.planned:
+            _plan_update_job(db, job, collector)
+        
+        # 未处理的股票，以及失败但未超过最大尝试次数的股票
+        items = db.query(UpdateJobItem.stock_code, UpdateJobItem.start_date).filter(
+            UpdateJobItem.job_id == job_id,
+            or_(
+                UpdateJobItem.status == "pending",
+                and_(UpdateJobItem.status == "failed", UpdateJobItem.attempts < FETCH_CONFIG["job_max_attempts"])
+            )
+        ).order_by(UpdateJobItem.start_date, UpdateJobItem.id).all()
+        
+        updates = collector.iter_monthly_k_updates([(code, start_date) for code, start_date in items])
+        try:
+            for idx, (code, count, error) in enumerate(updates):
+                item = db.query(UpdateJobItem).filter(
+                    UpdateJobItem.job_id == job_id,
+                    UpdateJobItem.stock_code == code
+                ).first()
+                item.attempts += 1
+                if error:
+                    item.status = "failed"
+                    item.last_error = error
+                else:
+                    item.status = "done"
+                    item.last_error = None
+                    item.rows_written += count
+                job.message = f"已更新 {code} ({idx + 1}/{len(items)})"
+                db.commit()
+                if progress_callback:
+                    progress_callback(idx + 1, len(items), job.message)
+                
+                if stop_event.is_set():
+                    break
+        finally:
+            # 提前停止时结束获取进程
+            updates.close()
+        
+        if stop_event.is_set():
+            job.status = "paused"
+            job.message = "已暂停"
+        else:
+            if job.stock_codes is None:
+                # 全市场更新完成后更新行业指数数据，并预先计算行业排名
+                job.message = "正在更新行业指数数据..."
+                db.commit()
+                from statistics import StatisticsCalculator
+                collector.update_industry_index_data()
+                StatisticsCalculator(db).build_industry_rank_snapshot()
+            
+            job.status = "completed"
+            job.finished_at = datetime.now()
+            job.message = "更新完成"
+        db.commit()
+    except Exception as e:
+        logger.error(f"更新任务 {job_id} 运行出错: {e}", exc_info=True)
+        db.rollback()
+        if job is not None:
+            job.status = "failed"
+            job.last_error = str(e)
+            job.message = "运行出错"
+            db.commit()
+    finally:
+        with _runners_lock:
+            _runners.pop(job_id, None)
+        db.close()
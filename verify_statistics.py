@@ -0,0 +1,95 @@
+"""
+批量统计一致性检查：按游标逐页取出的排名拼接后、以及导出的各行，应与一次计算的完整排名完全一致
+
+用法：
+    python verify_statistics.py                             检查所有排序字段，每页100行
+    python verify_statistics.py --order-by avg_up_pct --page-size 7 --months 1 2
+    python verify_statistics.py --export-limit 250          导出前250名（默认导出全部）
+"""
+from typing import List, Optional
+from sqlalchemy.orm import Session
+from statistics import StatisticsCalculator, BatchRanking, TOP_K_ORDER_KEYS, STOCK_ORDER_KEYS
+from batch_export import EXPORT_COLUMNS, _export_pages
+import argparse
+import sys
+
+ORDER_KEYS = list(TOP_K_ORDER_KEYS) + list(STOCK_ORDER_KEYS)
+
+
+def _first_difference(actual: List[dict], expected: List[dict]) -> Optional[str]:
+    """两组结果行第一处不一致的说明，一致时返回None"""
+    for i, (row, expected_row) in enumerate(zip(actual, expected)):
+        if row != expected_row:
+            return f"第 {i + 1} 行：{row.get('stock_code')} rank={row.get('rank')}，应为 {expected_row.get('stock_code')} rank={expected_row.get('rank')}"
+    if len(actual) != len(expected):
+        return f"行数 {len(actual)}，应为 {len(expected)}"
+    return None
+
+
+def check_paging(db: Session, order_by: str, page_size: int, months: Optional[List[int]] = None, min_total_count: int = 0) -> Optional[str]:
+    """逐页取出排名（游标经过编码和解析），与 calculate_batch_statistics 的完整结果比较
+    
+    Returns:
+        不一致的说明，一致时返回None
+    """
+    calculator = StatisticsCalculator(db)
+    ranking = calculator.rank_batch_statistics(months=months, min_total_count=min_total_count, order_by=order_by)
+    expected = calculator.calculate_batch_statistics(
+        months=months, min_total_count=min_total_count, limit=max(ranking.total, 1), order_by=order_by
+    )
+    
+    rows = []
+    after = None
+    while True:
+        page, next_after = ranking.page(after, page_size)
+        rows.extend(page)
+        if next_after is None:
+            break
+        after = BatchRanking.decode_cursor(BatchRanking.encode_cursor(order_by, next_after), order_by)
+    return _first_difference(rows, expected)
+
+
+def check_export(db: Session, order_by: str, limit: int = 0, months: Optional[List[int]] = None, min_total_count: int = 0) -> Optional[str]:
+    """按导出的分页方式取出前 limit 名（0表示全部），与相同查询的 calculate_batch_statistics 比较导出的列
+    
+    Returns:
+        不一致的说明，一致时返回None
+    """
+    calculator = StatisticsCalculator(db)
+    ranking = calculator.rank_batch_statistics(months=months, min_total_count=min_total_count, order_by=order_by)
+    total = ranking.total if limit <= 0 else min(ranking.total, limit)
+    expected = calculator.calculate_batch_statistics(
+        months=months, min_total_count=min_total_count, limit=max(total, 1), order_by=order_by
+    )
+    
+    def exported(rows):
+        return [{field: row.get(field) for field, _ in EXPORT_COLUMNS} for row in rows]
+    
+    rows = [row for page in _export_pages(ranking, total) for row in page]
+    return _first_difference(exported(rows), exported(expected[:total]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量统计一致性检查")
+    parser.add_argument("--order-by", nargs="+", default=ORDER_KEYS)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--months", type=int, nargs="*", default=None, help="统计的月份，默认所有月份")
+    parser.add_argument("--min-total-count", type=int, default=0)
+    parser.add_argument("--export-limit", type=int, default=0, help="检查导出的行数，默认全部")
+    args = parser.parse_args()
+    
+    from database import SessionLocal
+    
+    db = SessionLocal()
+    failed = 0
+    try:
+        for order_by in args.order_by:
+            difference = check_paging(db, order_by, args.page_size, args.months, args.min_total_count)
+            print(f"分页 {order_by}：{'一致' if difference is None else '不一致，' + difference}")
+            failed += difference is not None
+            difference = check_export(db, order_by, args.export_limit, args.months, args.min_total_count)
+            print(f"导出 {order_by}：{'一致' if difference is None else '不一致，' + difference}")
+            failed += difference is not None
+    finally:
+        db.close()
+    sys.exit(1 if failed else 0)